@@ -8,13 +8,28 @@ geocoder modules and API
     geocoding
     wsgi
 """
-from loguru import logger
-from geocoder.geocoding import search, query
-
 __version__ = "2.1.23"
 
-find = search.position
-near = search.reverse
+aliases = {
+    'find': 'position',
+    'find_batch': 'position_batch',
+    'near': 'reverse',
+    'near_batch': 'reverse_batch',
+    'near_k': 'near_k',
+    'within': 'within',
+}
+
+
+def __getattr__(name):
+    """
+    Search functions, imported on first use so that the CLI and the processes which do not search start fast; the
+    database itself is mapped by the first search
+    """
+    if name in aliases:
+        from geocoder.geocoding import search
+        return getattr(search, aliases[name])
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
-logger.info('Loading geocoding data')
-query.setup()
+def __dir__():
+    return sorted(list(globals()) + list(aliases))
@@ -56,18 +56,16 @@ class Geocoder:
 
     def geocode(self):
         """
-        Geocode data if not already geocoded and no read error(s) by calling geocoder.find
+        Geocode data if not already geocoded and no read error(s) by calling geocoder.find_batch
         """
         if not self.geocoded and not self.errors:
-            def find(args):
-                if args[0] == '98000':  # pragma: no cover
-                    return np.nan, np.nan, np.nan, np.nan
-                else:
-                    res = geocoder.find(*args)
-                    return res.get('longitude', np.nan), res.get('latitude', np.nan), res.get('quality', np.nan), \
-                        res.get('commune', {}).get('code_insee', np.nan)
-
-            geocoded_fields = [find(args) for args in self.data[[POSTAL_CODE, CITY, ADDRESS]].fillna('').values]
+            values = self.data[[POSTAL_CODE, CITY, ADDRESS]].fillna('').values
+            geocoded_fields = [(np.nan, np.nan, np.nan, np.nan)] * len(values)
+            rows = [i for i, args in enumerate(values) if args[0] != '98000']
+            outputs = geocoder.find_batch(*[[values[i][j] for i in rows] for j in range(3)])
+            for i, res in zip(rows, outputs):
+                geocoded_fields[i] = (res.get('longitude', np.nan), res.get('latitude', np.nan),
+                                      res.get('quality', np.nan), res.get('commune', {}).get('code_insee', np.nan))
 
             self.data['lon'], self.data['lat'], self.data['quality'], self.data['code_insee'] = zip(*geocoded_fields)
             self.geocoded_date_time = datetime.now()
@@ -5,10 +5,16 @@ defines all routes
     get_jsoned_geocoded_data
     geocode_one
     geocode_file
+    reverse_file
+    Reload
+    Ready
+    Metrics
 """
 import json
+from collections import defaultdict
 from datetime import datetime
 
+import numpy as np
 import pandas as pd
 from Geocoding_utils import ADDRESS, POSTAL_CODE, CITY
 from flask import jsonify
@@ -18,6 +24,7 @@ from flask_restx import Namespace, Resource
 
 from geocoder import __version__
 from geocoder.api.Geocoder import Geocoder
+from geocoder.geocoding import normalize, query, remote, result_cache, search, warmup
 
 QUALITY = {'1': 'Successful',
            '2': 'Precise number was not found',
@@ -56,14 +63,74 @@ class Version(Resource):
         get method for Version resource: outputs the current version of the stresspent
 
     """
-    @api_rest.doc(responses={200: 'Version of the stresspent API'})
+    @api_rest.doc(responses={200: 'Version of the stresspent API and of its database'})
     @api_rest.doc(responses={500: 'All other server errors'})
     def get(self):
-        response = jsonify(version=__version__)
+        response = jsonify(version=__version__, database=query.current().version)
         response.status_code = 200
         return response
 
 
+@api_rest.route("/reload", methods=["POST"])
+class Reload(Resource):
+    """
+    Switch to the last published version of the database
+
+    Only the worker serving the request switches at once, the other ones within RELOAD_INTERVAL seconds. The requests
+    in progress carry on with the previous version.
+
+    Methods
+    -------
+    post:
+        post method for Reload resource: loads the published version of the database if it changed
+
+    """
+    @api_rest.doc(responses={200: 'Version of the database in use and whether it changed'})
+    @api_rest.doc(responses={500: 'Corrupted database, the previous version is kept'})
+    def post(self):
+        reloaded = query.reload()
+        return jsonify(database=query.current().version, reloaded=reloaded)
+
+
+@api_rest.route("/ready")
+class Ready(Resource):
+    """
+    Readiness of the API: ready once the database is warmed up
+
+    Methods
+    -------
+    get:
+        get method for Ready resource: starts the warm-up if it did not start yet and tells whether it is done
+
+    """
+    @api_rest.doc(responses={200: 'Ready to serve'})
+    @api_rest.doc(responses={503: 'Warming up'})
+    def get(self):
+        warmup.start()
+        response = jsonify(ready=warmup.ready.is_set(), database=query.current().version)
+        response.status_code = 200 if warmup.ready.is_set() else 503
+        return response
+
+
+@api_rest.route("/metrics")
+class Metrics(Resource):
+    """
+    Metrics of the caches of the geocoder
+
+    Methods
+    -------
+    get:
+        get method for Metrics resource: size and hit ratio of the cache of the blocks of the tables read from S3,
+        hits and misses of the memoized normalization functions, size and hit ratio of the cache of the results of
+        the position search
+
+    """
+    @api_rest.doc(responses={200: 'Metrics of the caches'})
+    def get(self):
+        return jsonify(block_cache=remote.cache.metrics(), normalize=normalize.metrics(),
+                       result_cache=result_cache.cache.metrics())
+
+
 @api_rest.route("/use")
 class Use(Resource):
     """
@@ -116,3 +183,42 @@ class GeocodeFile(Resource):
         geocoder = Geocoder(data_to_geocode)
         geocoder.geocode()
         return jsonify(get_jsoned_geocoded_data(geocoder))
+
+
+def get_columns(outputs):
+    """Flatten outputs of the search methods into columns named like table.field.
+    """
+    columns = defaultdict(list)
+    for output in outputs:
+        for key, value in output.items():
+            if isinstance(value, dict):
+                for field, field_value in value.items():
+                    columns[f'{key}.{field}'].append(field_value)
+            else:
+                columns[key].append(value)
+    return dict(columns)
+
+
+@api_rest.route("/reverse_file", methods=["POST"])
+class ReverseFile(Resource):
+    @api_rest.doc(responses={200: 'Nearest address of each position, in columns'})
+    @api_rest.doc(responses={400: 'Longitude and latitude columns of different lengths or missing'})
+    def post(self):
+        json_as_str = request.get_json(force=True)
+        try:
+            data = json.loads(json_as_str)
+        except (json.JSONDecodeError, TypeError):
+            data = json_as_str
+        try:
+            longitudes = np.asarray(data['longitude'], dtype='float64')
+            latitudes = np.asarray(data['latitude'], dtype='float64')
+        except (KeyError, TypeError, ValueError):
+            api_rest.abort(400, 'Expected longitude and latitude columns')
+        if longitudes.shape != latitudes.shape or longitudes.ndim != 1:
+            api_rest.abort(400, 'Expected longitude and latitude columns of the same length')
+        outputs = search.reverse_batch(longitudes, latitudes)
+        return jsonify({
+            'api_version': __version__,
+            'quality': QUALITY,
+            'data': get_columns(outputs),
+        })
@@ -7,20 +7,27 @@ original geocoding module
     __main__
     activate_reverse
     ban_processing
+    compact
     datapaths
     datatypes
     distance
     download
+    fetch
+    incremental
     index
     normalize
+    packed
     query
+    remote
     result
+    result_cache
     search
     similarity
+    spatial
     utils
+    warmup
 """
 import os
-import boto3
 
 try:
     DEBUG = (os.getenv("DEBUG", 'False').lower() in ('true', '1', 't'))
@@ -34,10 +41,24 @@ if DEBUG and not os.environ.get("LOGURU_LEVEL"):
 elif not os.environ.get("LOGURU_LEVEL"):  # pragma: no cover
     os.environ["LOGURU_LEVEL"] = "ERROR"
 
+
+class LazyClient:
+    """
+    S3 client created on first use, so that boto3 is only imported by the processes which actually reach S3
+    """
+    client = None
+
+    def __getattr__(self, name):
+        if LazyClient.client is None:
+            import boto3
+            LazyClient.client = boto3.client('s3',
+                                             endpoint_url=os.environ.get("S3_ENDPOINT_URL"),
+                                             use_ssl=True,
+                                             verify=False)
+        return getattr(LazyClient.client, name)
+
+
 if not LOCAL_DB:
-    s3 = boto3.client('s3',
-                      endpoint_url=os.environ.get("S3_ENDPOINT_URL"),
-                      use_ssl=True,
-                      verify=False)
+    s3 = LazyClient()
 else:
     s3 = None
@@ -1,26 +1,31 @@
 #!/usr/bin/env python3
 """
 defines entrypoints
+
+The modules of each command are only imported when it runs, so that e.g. `geocoder download` neither imports the
+processing of the BAN files nor the web stack
 """
+import importlib
 import multiprocessing
 import os
 import sys
 from argparse import ArgumentParser
 
 from geocoder.geocoding import LOCAL_DB
-from geocoder.geocoding.activate_reverse import create_kdtree
 from geocoder.geocoding.datapaths import paths
-from geocoder.geocoding.download import check_ban_version, decompress, remove_downloaded_raw_ban_files
-from geocoder.geocoding.index import process_files, create_database
-from geocoder.wsgi import runserver
 
 
 def update():
+    from geocoder.geocoding.activate_reverse import create_kdtree, create_spatial_index
+    from geocoder.geocoding.download import check_ban_version, decompress, remove_downloaded_raw_ban_files
+    from geocoder.geocoding.index import process_files, create_database, pack_database
     if check_ban_version() or (LOCAL_DB and not all([os.path.exists(path) for path in paths])):
         decompress()
         process_files()
         create_database()
         create_kdtree()
+        create_spatial_index()
+        pack_database()
     try:
         remove_downloaded_raw_ban_files()
     except Exception:  # nosec
@@ -28,16 +33,48 @@ def update():
     return True
 
 
+def stream():
+    from geocoder.geocoding.activate_reverse import create_kdtree, create_spatial_index
+    from geocoder.geocoding.download import check_ban_version
+    from geocoder.geocoding.index import build_database, get_ban_urls, pack_database
+    if check_ban_version(stream=True) or (LOCAL_DB and not all([os.path.exists(path) for path in paths])):
+        build_database(get_ban_urls())
+        create_kdtree()
+        create_spatial_index()
+        pack_database()
+    return True
+
+
 commands = {
-    'download': [check_ban_version],
-    'decompress': [decompress],
-    'index': [process_files, create_database],
-    'reverse': [create_kdtree],
+    'download': ['geocoder.geocoding.download:check_ban_version'],
+    'decompress': ['geocoder.geocoding.download:decompress'],
+    'index': ['geocoder.geocoding.index:process_files', 'geocoder.geocoding.index:create_database'],
+    'build': ['geocoder.geocoding.index:build_database'],
+    'reverse': ['geocoder.geocoding.activate_reverse:create_kdtree',
+                'geocoder.geocoding.activate_reverse:create_spatial_index',
+                'geocoder.geocoding.index:pack_database'],
+    'pack': ['geocoder.geocoding.index:pack_database'],
     'update': [update],
-    'clean': [remove_downloaded_raw_ban_files],
-    'runserver': [runserver]
+    'stream': [stream],
+    'incremental': ['geocoder.geocoding.incremental:update', 'geocoder.geocoding.index:create_database',
+                    'geocoder.geocoding.activate_reverse:create_kdtree',
+                    'geocoder.geocoding.activate_reverse:create_spatial_index',
+                    'geocoder.geocoding.index:pack_database'],
+    'clean': ['geocoder.geocoding.download:remove_downloaded_raw_ban_files'],
+    'runserver': ['geocoder.wsgi:runserver']
 }
 
+
+def load(function):
+    """
+    Function of a command, imported from its module if given as 'module:function'
+    """
+    if callable(function):
+        return function
+    module, name = function.split(':')
+    return getattr(importlib.import_module(module), name)
+
+
 parser = ArgumentParser(description='Runserver parser')
 parser.add_argument('--host', type=str, default='0.0.0.0',  # nosec
                     help='IP to bind')
@@ -52,15 +89,15 @@ def main():
 
     if not command or command[0] not in commands:
         print('usage: geocoding '
-              '{update, download, decompress, index, clean, reverse}')
+              '{update, stream, incremental, download, decompress, index, build, clean, reverse, pack}')
         return
 
     if command[0] == "runserver":
         args, unknown = parser.parse_known_args()
-        runserver(vars(args))
+        load(commands['runserver'][0])(vars(args))
     else:
         for function in commands[command[0]]:
-            success = function()
+            success = load(function)()
             if not success:
                 return
 
@@ -2,27 +2,81 @@
 create kdtree for reverse search
 
 .. autosummary::
+    kdtree_nodes
     create_kdtree
+    create_spatial_index
 """
-import gc
-
 import numpy as np
-from kdquery import Tree
 from loguru import logger
-from tqdm import tqdm
 
 from geocoder.geocoding.datapaths import paths
 from geocoder.geocoding.datatypes import dtypes
+from geocoder.geocoding import spatial
 from geocoder.geocoding.index import create_dat_file
-from geocoder.geocoding.utils import pre_order, degree_to_int
-
+from geocoder.geocoding.utils import degree_to_int, SCALE
 
-def node_to_tuple(node):
-    left = node.left if node.left is not None else -1
-    right = node.right if node.right is not None else -1
 
-    return node.point + tuple(node.region[0]) + tuple(node.region[1]) + \
-        (node.axis, left, right, node.data)
+def kdtree_nodes(longitudes, latitudes, limits):
+    """
+    Balanced kd-tree of the positions, built level by level with numpy
+
+    Each node is the median of the positions of its region along its dimension (longitude and latitude
+    alternately): the positions before it go to its left child and the ones after it to its right child, equal
+    coordinates being on both sides of the closed regions. The nodes are numbered in breadth-first order, the root
+    being 0.
+
+    :param numpy.ndarray longitudes: longitudes of the positions
+    :param numpy.ndarray latitudes: latitudes of the positions
+    :param list limits: lower and upper limits of each dimension, the region of the root
+    :return: the nodes, with the index of their position as ref_id
+    :rtype: numpy.ndarray
+    """
+    coordinates = np.stack([np.asarray(longitudes), np.asarray(latitudes)]).astype('int64')
+    size = coordinates.shape[1]
+    nodes = np.zeros(size, dtype=dtypes['kdtree'])
+    order = np.arange(size)
+    starts, ends, ids = np.array([0]), np.array([size]), np.array([0])
+    lows, highs = np.array([[limit[0] for limit in limits]]), np.array([[limit[1] for limit in limits]])
+    depth, next_id = 0, 1
+
+    while size and len(ids):
+        axis = depth % 2
+        sizes = ends - starts
+        positions = np.arange(sizes.sum()) + np.repeat(starts - (np.cumsum(sizes) - sizes), sizes)
+        # sort the positions of each segment on the axis, the segments staying in place
+        keys = np.repeat(np.arange(len(ids), dtype='int64') << 32, sizes) + \
+            coordinates[axis, order[positions]] + 2 ** 31
+        order[positions] = order[positions][np.argsort(keys)]
+
+        mids = (starts + ends) // 2
+        pivots = order[mids]
+        split = coordinates[axis, pivots]
+        left_highs, right_lows = highs.copy(), lows.copy()
+        left_highs[:, axis], right_lows[:, axis] = split, split
+
+        # left and right children of each node, numbered after the nodes of the level
+        exists = np.stack([mids > starts, mids + 1 < ends], axis=1).ravel()
+        child_ids = next_id + np.cumsum(exists) - 1
+        next_id += exists.sum()
+
+        node = nodes[ids]
+        node['longitude'], node['latitude'] = coordinates[0, pivots], coordinates[1, pivots]
+        node['limit_left'], node['limit_right'] = lows[:, 0], highs[:, 0]
+        node['limit_bottom'], node['limit_top'] = lows[:, 1], highs[:, 1]
+        node['dimension'] = axis
+        node['left'] = np.where(exists[0::2], child_ids[0::2], -1)
+        node['right'] = np.where(exists[1::2], child_ids[1::2], -1)
+        node['ref_id'] = pivots
+        nodes[ids] = node
+
+        ids = child_ids[exists]
+        starts = np.stack([starts, mids + 1], axis=1).ravel()[exists]
+        ends = np.stack([mids, ends], axis=1).ravel()[exists]
+        lows = np.stack([lows, right_lows], axis=1).reshape(-1, 2)[exists]
+        highs = np.stack([left_highs, highs], axis=1).reshape(-1, 2)[exists]
+        depth += 1
+
+    return nodes
 
 
 def create_kdtree():
@@ -32,27 +86,39 @@ def create_kdtree():
     :rtype: bool
     """
     table = np.memmap(paths['localisation'], dtype=dtypes['localisation'])
-    indices = np.argsort(table, order='longitude').astype('int32')
 
     # Limits of all the French region
     limits = [[degree_to_int(-62), degree_to_int(55)],
               [degree_to_int(-22), degree_to_int(52)]]
 
-    tree = Tree(2, len(table), limits)
+    logger.info('Building kdtree...')
+    nodes = kdtree_nodes(table['longitude'], table['latitude'], limits)
 
-    # Load tree with all the addresses on France
-    for i in tqdm(pre_order(len(table)), desc="kd-tree"):
-        index = indices[i]
-        tree.insert((table[index]['longitude'], table[index]['latitude']),
-                    data=index)
+    logger.info('Saving kdtree...')
+    create_dat_file(nodes, paths['kdtree'], dtypes['kdtree'])
+    logger.info('Done')
 
-    tuple_list = [node_to_tuple(node) for node in tree]
+    return True
 
-    del tree
-    gc.collect()
 
-    logger.info('Saving kdtree...')
-    create_dat_file(tuple_list, paths['kdtree'], dtypes['kdtree'])
+def create_spatial_index():
+    """
+    Creates and stores the spatial index (see the spatial module) as dat files on disk for reverse search of addresses
+    given geolocation
+
+    :rtype: bool
+    """
+    table = np.memmap(paths['localisation'], dtype=dtypes['localisation'])
+
+    points = np.zeros(len(table), dtype=dtypes['spatial_point'])
+    points['xyz'] = spatial.to_unit(table['longitude'] / 10 ** SCALE, table['latitude'] / 10 ** SCALE)
+    points['ref_id'] = np.arange(len(table))
+
+    nodes = spatial.build(points, dtypes['spatial_node'])
+
+    logger.info('Saving spatial index...')
+    create_dat_file(nodes, paths['spatial_node'], dtypes['spatial_node'])
+    create_dat_file(points, paths['spatial_point'], dtypes['spatial_point'])
     logger.info('Done')
 
     return True
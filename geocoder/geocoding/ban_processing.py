@@ -7,6 +7,14 @@ process decompressed files into a database
     get_voie
     get_commune
     get_attributes
+    read_lines
+    get_line_attributes
+    make_fields
+    normalize_unique
+    get_typed_columns
+    get_chunk_attributes
+    read_chunk
+    read_columns
     update
     update_departement
     update_postal
@@ -17,12 +25,18 @@ process decompressed files into a database
 from typing import Literal
 
 # -*- coding: utf-8 -*-
+import csv
+import io
+from itertools import islice
+
 import numpy as np
+import pandas as pd
 from loguru import logger
 from sortedcontainers import SortedDict, SortedSet
 
 from geocoder.geocoding import normalize as norm
-from geocoder.geocoding.utils import degree_to_int
+from geocoder.geocoding.download import open_ban_file
+from geocoder.geocoding.utils import degree_to_int, SCALE
 
 line_specs = {
     "adresses": {
@@ -54,6 +68,15 @@ types = {
     "latitude": float
 }
 
+patterns = {
+    "code_postal": r"[0-9]{1,9}",
+    "numero": r"[0-9]{1,9}",
+    "longitude": r"-?[0-9]{1,3}(\.[0-9]{1,15})?",
+    "latitude": r"-?[0-9]{1,3}(\.[0-9]{1,15})?"
+}
+
+CHUNK_SIZE = 100000
+
 voie_fields = ['nom_voie']
 
 commune_fields = ['nom_commune', 'nom_complementaire']
@@ -95,7 +118,20 @@ def get_field(field_name, fields, normalization_method, lieu: Literal["adresses"
     field = line_specs[lieu][field_name]
     if field is None:  # pragma: no cover
         return None, None
-    text = fields[field].replace('"', '')
+    return normalize_field(fields[field], normalization_method, size_limit)
+
+
+@norm.memoized
+def normalize_field(text, normalization_method, size_limit=None):
+    """
+    Name and normalized name of a field, memoized since the same street is repeated for each of its numbers
+
+    :param str text: the parsed string
+    :param fun normalization_method: function to normalize the parsed string
+    :param int size_limit: max length of resulting string
+    :rtype: (str, str)
+    """
+    text = text.replace('"', '')
     normalise = normalization_method(text)
     if len(normalise) > 0:
         nom = norm.remove_separators(norm.uniform(text))
@@ -175,45 +211,215 @@ def get_attributes(fields, lieu: Literal["adresses", "lieux-dits"] = "adresses")
             voie_normalise, voie_nom, numero, repetition, lon, lat)
 
 
+def read_lines(csv_file_path, lieu: Literal["adresses", "lieux-dits"]):
+    """
+    Read a CSV file line by line
+
+    :param str csv_file_path: path to CSV file or gzip archive, or URL of gzip archive to read
+    :param str lieu: adresses or lieux-dits
+    :return: None if the file is empty, the attributes of each valid line otherwise
+    :rtype: list
+    """
+    with open_ban_file(csv_file_path) as f:
+        try:  # some lieux-dits might be empty
+            next(f)
+        except StopIteration:  # pragma: no cover
+            logger.debug(f"{csv_file_path} was empty")
+            return None
+        return get_line_attributes(f, lieu)
+
+
+def get_line_attributes(lines, lieu: Literal["adresses", "lieux-dits"]):
+    """
+    Attributes of each valid line
+
+    :param lines: lines of a CSV file, without the header
+    :param str lieu: adresses or lieux-dits
+    :rtype: list
+    """
+    return [attributes for attributes in (get_attributes(line.strip().split(';'), lieu) for line in lines)
+            if attributes is not None]
+
+
+def make_fields(values, width):
+    """
+    Fields of a line holding only the given values
+
+    :param dict values: the value at each position of the line
+    :param int width: the number of fields
+    :rtype: list
+    """
+    fields = [''] * width
+    for position, value in values.items():
+        fields[position] = value
+    return fields
+
+
+def normalize_unique(keys, positions, method, lieu: Literal["adresses", "lieux-dits"], width):
+    """
+    Call :code:`get_commune` or :code:`get_voie` once for each distinct key
+
+    :param list keys: the values of the fields at positions on each row
+    :param list positions: the position of the fields of the keys
+    :param fun method: :code:`get_commune` or :code:`get_voie`
+    :param str lieu: adresses or lieux-dits
+    :param int width: the number of fields
+    :rtype: dict
+    """
+    return {key: method(make_fields({position: value for position, value in zip(positions, key)
+                                     if position is not None}, width), lieu)
+            for key in set(keys)}
+
+
+def get_typed_columns(chunk, specs):
+    """
+    Convert the typed fields of a chunk of rows as whole vectors
+
+    :param pandas.DataFrame chunk: the columns of the rows, with valid typed fields
+    :param dict specs: the position of the fields
+    :rtype: tuple
+    """
+    def column(field, dtype):
+        return chunk[specs[field]].to_numpy(dtype='U').astype(dtype)
+
+    codes_postaux = column('code_postal', 'int64').tolist()
+    lons = (column('longitude', 'float64') * 10 ** SCALE).astype('int64').tolist()
+    lats = (column('latitude', 'float64') * 10 ** SCALE).astype('int64').tolist()
+    if specs['numero'] is None:  # pragma: no cover
+        return codes_postaux, [0] * len(chunk), [None] * len(chunk), lons, lats
+    numeros = column('numero', 'int64').tolist()
+    repetitions = chunk[specs['repetition']].str.replace('"', '', regex=False).tolist()
+    return codes_postaux, numeros, repetitions, lons, lats
+
+
+def get_chunk_attributes(chunk, lieu: Literal["adresses", "lieux-dits"]):
+    """
+    Parse attributes from a chunk of rows, one column at a time
+
+    The typed fields of the rows are validated with regular expressions and converted as whole vectors, and only the
+    unique commune and street names are normalized. The other rows go through :code:`get_attributes`, so that the
+    result is the same as reading the rows line by line.
+
+    :param pandas.DataFrame chunk: the columns of the rows, named by their position in the line
+    :param str lieu: adresses or lieux-dits
+    :return: the attributes of each row, None for invalid rows
+    :rtype: list
+    """
+    specs = line_specs[lieu]
+    width = max(chunk.columns) + 1
+    valid = np.ones(len(chunk), dtype=bool)
+    for field in types:
+        if specs[field] is not None:
+            valid &= chunk[specs[field]].str.fullmatch(patterns[field]).to_numpy(dtype=bool)
+
+    # Rows with unusual typed fields, line by line
+    attributes = [get_attributes(make_fields(dict(zip(chunk.columns, row)), width), lieu)
+                  for row in chunk[~valid].itertuples(index=False)]
+
+    # Normalize each distinct name once
+    chunk = chunk[valid]
+    commune_positions = [specs[field] for field in commune_fields]
+    commune_keys = list(zip(*[chunk[position] if position is not None else [None] * len(chunk)
+                              for position in commune_positions]))
+    communes = normalize_unique(commune_keys, commune_positions, get_commune, lieu, width)
+    voie_keys = list(zip(chunk[specs['nom_voie']]))
+    voies = normalize_unique(voie_keys, [specs['nom_voie']], get_voie, lieu, width)
+
+    codes_postaux, numeros, repetitions, lons, lats = get_typed_columns(chunk, specs)
+    for row in zip(codes_postaux, commune_keys, chunk[specs['code_insee']].tolist(), voie_keys, numeros,
+                   repetitions, lons, lats):
+        code_postal, commune_key, code_insee, voie_key, numero, repetition, lon, lat = row
+        (commune_nom, commune_normalise), (voie_nom, voie_normalise) = communes[commune_key], voies[voie_key]
+        if commune_nom is None or voie_nom is None:  # pragma: no cover
+            logger.debug("Error reading commune or voie")
+            attributes.append(None)
+            continue
+        attributes.append((code_postal, commune_normalise, commune_nom, code_insee,
+                           voie_normalise, voie_nom, numero, repetition, lon, lat))
+    return attributes
+
+
+def read_chunk(lines, lieu: Literal["adresses", "lieux-dits"]):
+    """
+    Read a chunk of lines with the C parser of pandas, line by line if some of them do not have the fields of the
+    header
+
+    :param list lines: lines of a CSV file, without the header
+    :param str lieu: adresses or lieux-dits
+    :return: the attributes of each valid line
+    :rtype: list
+    """
+    positions = sorted(position for position in line_specs[lieu].values() if position is not None)
+    try:
+        chunk = pd.read_csv(io.StringIO(''.join(lines)), sep=';', header=None, usecols=positions, dtype=str,
+                            keep_default_na=False, na_filter=False, quoting=csv.QUOTE_NONE)
+        if chunk.isna().to_numpy().any():
+            raise pd.errors.ParserError("Missing fields")
+    except (pd.errors.ParserError, ValueError):
+        logger.debug("Chunk read line by line")
+        return get_line_attributes(lines, lieu)
+    except pd.errors.EmptyDataError:  # pragma: no cover
+        return []
+    return [attributes for attributes in get_chunk_attributes(chunk, lieu) if attributes is not None]
+
+
+def read_columns(csv_file_path, lieu: Literal["adresses", "lieux-dits"]):
+    """
+    Read a CSV file by chunks of CHUNK_SIZE lines with the C parser of pandas
+
+    The file is read in a single pass, so that it can be streamed from a gzip archive or an HTTP response.
+
+    :param str csv_file_path: path to CSV file or gzip archive, or URL of gzip archive to read
+    :param str lieu: adresses or lieux-dits
+    :return: None if the file is empty, the attributes of each valid line otherwise
+    :rtype: list
+    """
+    with open_ban_file(csv_file_path) as f:
+        if not f.readline():  # some lieux-dits might be empty
+            logger.debug(f"{csv_file_path} was empty")
+            return None
+        attributes = []
+        for lines in iter(lambda: list(islice(f, CHUNK_SIZE)), []):
+            attributes.extend(read_chunk(lines, lieu))
+    return attributes
+
+
 def update(dpt_nom: str, csv_file_path, processed_files: dict):
     """
     Update processed_files iteratively for each file
 
+    The file is read by chunks with :code:`read_columns`, each chunk being read line by line if some of its lines do
+    not have the fields of the header. Archives are decompressed on the fly: no CSV is written to disk.
+
     :param str dpt_nom: departement
-    :param os.Path csv_file_path: path to CSV file to read and update processed_files
+    :param str csv_file_path: path to CSV file or gzip archive, or URL of gzip archive to read and update
+        processed_files
     :param dict processed_files: databases
     """
+    lieu = "lieux-dits" if "lieux-dits" in csv_file_path else "adresses"
+    rows = read_columns(csv_file_path, lieu)
+    if rows is None:
+        return
+
     postal_dict = SortedDict()
+    for attributes in rows:
+        postal_key = attributes[:1]
+        commune_key = attributes[1:4]
+        voie_key = attributes[4:6]
+        localisation = attributes[6:]
 
-    with open(csv_file_path, 'r', encoding='UTF-8') as f:
-        try:  # some lieux-dits might be empty
-            next(f)
-        except StopIteration:  # pragma: no cover
-            logger.debug(f"{csv_file_path} was empty")
-            return
-        for line in f:
-            attributes = get_attributes(line.strip().split(';'),
-                                        "lieux-dits" if "lieux-dits" in csv_file_path else "adresses")
-            if attributes is None:
-                logger.debug("Failed to parse line")
-                continue
-            postal_key = attributes[:1]
-            commune_key = attributes[1:4]
-            voie_key = attributes[4:6]
-            localisation = attributes[6:]
-
-            if postal_key not in postal_dict:
-                postal_dict[postal_key] = SortedDict()
-
-            commune_dict = postal_dict[postal_key]
-            if commune_key not in commune_dict:
-                commune_dict[commune_key] = SortedDict()
-
-            voie_dict = commune_dict[commune_key]
-            if voie_key not in voie_dict:
-                voie_dict[voie_key] = SortedSet()
-
-            voie_dict[voie_key].add(localisation)
+        if postal_key not in postal_dict:
+            postal_dict[postal_key] = SortedDict()
+
+        commune_dict = postal_dict[postal_key]
+        if commune_key not in commune_dict:
+            commune_dict[commune_key] = SortedDict()
+
+        voie_dict = commune_dict[commune_key]
+        if voie_key not in voie_dict:
+            voie_dict[voie_key] = SortedSet()
+
+        voie_dict[voie_key].add(localisation)
 
     update_departement(dpt_nom, processed_files, postal_dict)
 
@@ -5,6 +5,10 @@ Attributes:
     database (str): Path to the database folder.
     tables (:obj:`list` of :obj:`str`): The name of each table in the database.
     paths (:obj:`list` of :obj:`str`): The path to each table of the database.
+    versions (str): Path to the folder of the published versions of the
+        database, each one a packed database (all the tables in one file).
+    current_path (str): Path to the file holding the name of the published
+        version in use.
 """
 
 import os
@@ -17,6 +21,19 @@ if not os.path.exists(database):
     os.mkdir(database)
 
 tables = ['departement', 'postal', 'commune', 'voie', 'localisation',
-          'commune_index', 'postal_index', 'voie_index', 'kdtree']
+          'repetition', 'commune_index', 'postal_index', 'voie_index', 'kdtree',
+          'commune_hash', 'voie_hash', 'commune_voie_hash',
+          'voie_bigram', 'voie_bigram_posting', 'commune_ngram',
+          'commune_ngram_id', 'voie_ngram', 'voie_ngram_id',
+          'spatial_node', 'spatial_point']
 
 paths = {table: os.path.join(database, table + '.dat') for table in tables}
+
+versions = os.path.join(database, 'versions')
+
+current_path = os.path.join(database, 'CURRENT')
+
+
+def packed_path(version):
+    """Path to the packed database of a published version."""
+    return os.path.join(versions, version, 'geocoder.db')
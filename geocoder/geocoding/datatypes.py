@@ -2,9 +2,13 @@
 """Type of the elements in each table of the database.
 
 The database is formed by numpy arrays and the type of the elements of each one
-is specified in this module as a module level variable.
+is specified in this module as a module level variable. The names and codes are
+ASCII (see the normalize module), so they are stored as byte strings, read as
+str through the compact module.
 
 Attributes:
+    SCHEMA_VERSION (int): The version of the layout of the database, recorded
+        in the packed database and increased whenever a dtype changes.
     departement_dtype (str): The definition of the numpy dtype for the
         elements of the departement table.
     postal_dtype (str): The definition of the numpy dtype for the elements of
@@ -14,9 +18,30 @@ Attributes:
     voie_dtype (str): The definition of the numpy dtype for the elements of
         the voie table.
     localisation_dtype (str): The definition of the numpy dtype for the
-        elements of the localisation table.
+        elements of the localisation table. The repetition is the index of
+        its value in the repetition table.
+    repetition_dtype (str): The definition of the numpy dtype for the
+        distinct values of the repetitions of the street numbers.
     kdtree_dtype (str): The definition of the numpy dtype for the elements of
         the kdtree table.
+    hash_dtype (str): The definition of the numpy dtype for the slots of the
+        open addressing hash tables (commune_hash, voie_hash and
+        commune_voie_hash). A key equal to zero marks an empty slot.
+    bigram_dtype (str): The definition of the numpy dtype for the elements of
+        the voie_bigram table: the key is commune_id * NGRAMS + bigram_id and
+        the start and end fields delimit the rows of the voies of the commune
+        containing the bigram in the voie_bigram_posting table.
+    ngram_dtype (str): The definition of the numpy dtype for the elements of
+        the commune_ngram and voie_ngram tables: for each record of the commune
+        and voie tables, the range of its sorted n-gram identifiers in the
+        commune_ngram_id and voie_ngram_id tables and the score of its set of
+        uni and bigrams.
+    spatial_node_dtype (str): The definition of the numpy dtype for the nodes
+        of the spatial index: the bounding box of the points of the node and
+        their range in the spatial_point table.
+    spatial_point_dtype (str): The definition of the numpy dtype for the
+        points of the spatial index: the unit vector of the position and the
+        index of the address in the localisation table.
     dtypes (:obj:`dict` of :obj:`str`): A python dictionary to easily access
         the dtypes definitions.
 
@@ -24,8 +49,10 @@ Attributes:
 
 import numpy as np
 
+SCHEMA_VERSION = 1
+
 departement_dtype = np.dtype([
-    ('code', 'U3'),
+    ('code', 'S3'),
     ('start', 'int32'),
     ('end', 'int32'),
 ])
@@ -38,9 +65,9 @@ postal_dtype = np.dtype([
 ])
 
 commune_dtype = np.dtype([
-    ('normalise', 'U32'),
-    ('nom', 'U32'),
-    ('code_insee', 'U5'),
+    ('normalise', 'S32'),
+    ('nom', 'S32'),
+    ('code_insee', 'S5'),
     ('longitude', 'int32'),
     ('latitude', 'int32'),
     ('start', 'int32'),
@@ -49,8 +76,8 @@ commune_dtype = np.dtype([
 ])
 
 voie_dtype = np.dtype([
-    ('normalise', 'U47'),
-    ('nom', 'U65'),
+    ('normalise', 'S47'),
+    ('nom', 'S65'),
     ('longitude', 'int32'),
     ('latitude', 'int32'),
     ('start', 'int32'),
@@ -60,12 +87,14 @@ voie_dtype = np.dtype([
 
 localisation_dtype = np.dtype([
     ('numero', 'int16'),
-    ('repetition', 'U3'),
+    ('repetition', 'int16'),
     ('longitude', 'int32'),
     ('latitude', 'int32'),
     ('ref_id', 'int32'),
 ])
 
+repetition_dtype = np.dtype('U3')
+
 kdtree_dtype = np.dtype([
     ('longitude', 'int32'),
     ('latitude', 'int32'),
@@ -79,14 +108,56 @@ kdtree_dtype = np.dtype([
     ('ref_id', 'int32'),
 ])
 
+hash_dtype = np.dtype([
+    ('key', 'uint64'),
+    ('start', 'int32'),
+    ('end', 'int32'),
+])
+
+bigram_dtype = np.dtype([
+    ('key', 'int64'),
+    ('start', 'int32'),
+    ('end', 'int32'),
+])
+
+ngram_dtype = np.dtype([
+    ('start', 'int32'),
+    ('end', 'int32'),
+    ('score', 'int32'),
+])
+
+spatial_node_dtype = np.dtype([
+    ('low', 'float64', (3, )),
+    ('high', 'float64', (3, )),
+    ('start', 'int32'),
+    ('end', 'int32'),
+])
+
+spatial_point_dtype = np.dtype([
+    ('xyz', 'float64', (3, )),
+    ('ref_id', 'int32'),
+])
+
 dtypes = {
     'departement': departement_dtype,
     'postal': postal_dtype,
     'commune': commune_dtype,
     'voie': voie_dtype,
     'localisation': localisation_dtype,
+    'repetition': repetition_dtype,
     'commune_index': 'int32',
     'postal_index': 'int32',
     'voie_index': 'int32',
-    'kdtree': kdtree_dtype
+    'kdtree': kdtree_dtype,
+    'commune_hash': hash_dtype,
+    'voie_hash': hash_dtype,
+    'commune_voie_hash': hash_dtype,
+    'voie_bigram': bigram_dtype,
+    'voie_bigram_posting': 'int32',
+    'commune_ngram': ngram_dtype,
+    'commune_ngram_id': 'int16',
+    'voie_ngram': ngram_dtype,
+    'voie_ngram_id': 'int16',
+    'spatial_node': spatial_node_dtype,
+    'spatial_point': spatial_point_dtype
 }
@@ -21,6 +21,10 @@ SOFTWARE.
 """
 from math import sin, cos, pi, sqrt, atan2
 
+import numpy as np
+
+EARTH_RADIUS = 6371008.8  # mean radius in meters
+
 
 def radian(deg):
     return (deg / 180) * pi
@@ -48,3 +52,27 @@ def spherical(a, b):
               sin_lat1 * sin_lat2 + cos_lat1 * cos_lat2 * cos_delta_lng)
 
     return degree(d)
+
+
+def haversine(longitudes, latitudes, longitude, latitude):
+    """The distances in meters from many points to a point, with numpy.
+
+    Args:
+        longitudes (:obj:`numpy.ndarray` of float): The longitudes of the
+            points in degrees.
+        latitudes (:obj:`numpy.ndarray` of float): The latitudes of the points
+            in degrees.
+        longitude (float or :obj:`numpy.ndarray` of float): The longitude of
+            the other point, or of one point per point.
+        latitude (float or :obj:`numpy.ndarray` of float): The latitude of the
+            other point, or of one point per point.
+
+    Returns:
+        (:obj:`numpy.ndarray` of float): The great-circle distances.
+
+    """
+    lat1, lat2 = np.radians(latitudes), np.radians(latitude)
+    delta_lat = lat2 - lat1
+    delta_lng = np.radians(longitude) - np.radians(longitudes)
+    a = np.sin(delta_lat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(delta_lng / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
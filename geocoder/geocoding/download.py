@@ -6,13 +6,17 @@ import gzip
 import hashlib
 import os
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 import requests
+from requests.adapters import HTTPAdapter
 from loguru import logger
 from tqdm import tqdm
 from urllib3 import disable_warnings
 from urllib3.exceptions import InsecureRequestWarning
-from botocore.errorfactory import ClientError
+from botocore.exceptions import ClientError
 
 from geocoder.geocoding import DEBUG, LOCAL_DB, s3
 from geocoder.geocoding.datapaths import here, database
@@ -27,6 +31,12 @@ ban_url = 'https://adresse.data.gouv.fr/data/ban/adresses-odbl/latest/csv/{}'
 ban_dpt_gz_file_name = ['adresses-{}.csv.gz', 'lieux-dits-{}-beta.csv.gz']
 ban_dpt_file_name = [filegz[:-3] for filegz in ban_dpt_gz_file_name]
 
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", 8))
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+DOWNLOAD_RETRIES = 5
+DOWNLOAD_BACKOFF = 1.
+DOWNLOAD_TIMEOUT = 60
+
 content_folder_path = 'content'
 server_content_file_name = 'server_content_v2.txt'
 local_content_file_name = 'local_content_v2.txt'
@@ -133,40 +143,182 @@ def need_to_download():
         return True
 
 
-def _download_ban_dpt_file(ban_dpt_file_name):
+class IncompleteDownload(Exception):
+    """The transfer of an archive stopped before its end"""
+
+
+def get_session(workers=DOWNLOAD_WORKERS):
     """
-    Downloads a single file from BAN
+    HTTP session shared by the downloads, with a connection pool of one connection per worker
 
     Args:
-        ban_dpt_file_name (str): name of file to download
+        workers (int): number of concurrent downloads
 
-    :rtype: bool
+    Returns:
+        (:obj:`requests.Session`): the session
     """
-    with open(os.path.join(raw_data_folder_path, ban_dpt_file_name), 'wb') as ban_dpt_file:
-        response = requests.get(ban_url.format(ban_dpt_file_name), stream=True,  # nosec
-                                verify=SSL_VERIFICATION)
+    session = requests.Session()
+    session.verify = SSL_VERIFICATION
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, workers))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
 
-        if not response.ok:  # pragma: no cover
-            logger.info('Download {} unsuccessful: bad response'.format(ban_dpt_file_name))
+
+def _fetch(session, url, part_path):
+    """
+    Downloads an archive into part_path, resuming from its current size with an HTTP Range request
+
+    Args:
+        session (requests.Session): HTTP session
+        url (str): URL of the archive
+        part_path (os.Path): path to the partial file
+
+    Returns: whether the archive is complete
+    :rtype: bool
+    """
+    done = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {'Range': 'bytes={}-'.format(done)} if done else {}
+    with session.get(url, stream=True, headers=headers, timeout=DOWNLOAD_TIMEOUT) as response:  # nosec
+        if response.status_code == 416:  # the partial file is already complete
+            return True
+        if response.status_code >= 500:
+            raise IncompleteDownload('Status error code: {}'.format(response.status_code))
+        if not response.ok:
+            logger.info('Download {} unsuccessful: bad response {}'.format(url, response.status_code))
             return False
+        if response.status_code != 206:  # the server ignored the range: start again
+            done = 0
+        length = response.headers.get('content-length')
+        total_size = None if length is None else done + int(length)
+        with open(part_path, 'ab' if done else 'wb') as ban_dpt_file:
+            for block in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                ban_dpt_file.write(block)
+                done += len(block)
+
+    if total_size is not None and done != total_size:
+        raise IncompleteDownload('{} of {} bytes'.format(done, total_size))
+    return True
+
 
-        done, total_size = 0, int(response.headers.get('content-length'))
-        for block in response.iter_content(4096):
-            ban_dpt_file.write(block)
-            done += len(block)
+def _download_ban_dpt_file(ban_dpt_file_name, session=None):
+    """
+    Downloads a single file from BAN, retrying with an exponential backoff and resuming interrupted transfers
+
+    Args:
+        ban_dpt_file_name (str): name of file to download
+        session (requests.Session): HTTP session, see :code:`get_session` by default
 
-    if done != total_size:  # pragma: no cover
+    :rtype: bool
+    """
+    session = get_session(1) if session is None else session
+    file_path = os.path.join(raw_data_folder_path, ban_dpt_file_name)
+    part_path = file_path + '.part'
+    for attempt in range(DOWNLOAD_RETRIES):
+        try:
+            if not _fetch(session, ban_url.format(ban_dpt_file_name), part_path):  # pragma: no cover
+                return False
+            break
+        except (requests.exceptions.RequestException, IncompleteDownload) as error:
+            logger.info('Download {} interrupted ({}), attempt {}'.format(ban_dpt_file_name, error, attempt + 1))
+            time.sleep(DOWNLOAD_BACKOFF * 2 ** attempt)
+    else:
         logger.error('Download {} unsuccessful: incomplete'.format(ban_dpt_file_name))
         return False
+    os.replace(part_path, file_path)
 
     if not LOCAL_DB:
-        with open(os.path.join(raw_data_folder_path, ban_dpt_file_name), 'rb') as ban_dpt_file:
+        with open(file_path, 'rb') as ban_dpt_file:
             s3.upload_fileobj(Fileobj=ban_dpt_file,
                               Bucket='geocoder',
                               Key=f"raw/{ban_dpt_file_name}")
     return True
 
 
+def get_validators(ban_dpt_file_name, session=None):
+    """
+    HTTP validators of a file from BAN, which change with its content
+
+    Args:
+        ban_dpt_file_name (str): name of the file
+        session (requests.Session): HTTP session, see :code:`get_session` by default
+
+    Returns:
+        (:obj:`dict`): ETag, Last-Modified and size of the file, empty if it could not be reached
+    """
+    session = get_session(1) if session is None else session
+    try:
+        response = session.head(ban_url.format(ban_dpt_file_name), allow_redirects=True,  # nosec
+                                timeout=DOWNLOAD_TIMEOUT)
+    except requests.exceptions.RequestException:  # pragma: no cover
+        return {}
+    if not response.ok:
+        return {}
+    return {'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'size': response.headers.get('Content-Length')}
+
+
+def download_ban_files(ban_dpt_file_names, workers=DOWNLOAD_WORKERS):
+    """
+    Downloads files from BAN concurrently through a shared session
+
+    Args:
+        ban_dpt_file_names (list): names of the files to download
+        workers (int): number of concurrent downloads
+
+    Returns:
+        (:obj:`list`): names of the files that could not be downloaded
+    """
+    session = get_session(workers)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        successes = list(tqdm(executor.map(_download_ban_dpt_file, ban_dpt_file_names,
+                                           [session] * len(ban_dpt_file_names)),
+                              total=len(ban_dpt_file_names), desc="Download raw data"))
+    session.close()
+    return [name for name, success in zip(ban_dpt_file_names, successes) if not success]
+
+
+@contextmanager
+def open_ban_file(source):
+    """
+    Open a BAN file as a text stream, decompressing archives on the fly so that no CSV is written to disk
+
+    Args:
+        source (str): path to a CSV file or to a gzip archive, or URL of a gzip archive
+
+    Returns:
+        (:obj:`io.TextIOBase`): the lines of the CSV file
+    """
+    if source.startswith(('http://', 'https://')):
+        response = requests.get(source, stream=True, verify=SSL_VERIFICATION)  # nosec
+        if not response.ok:  # pragma: no cover
+            response.close()
+            raise ConnectionError('Unable to stream {}. Status error code: {}'.format(source, response.status_code))
+        response.raw.decode_content = True
+        with response, gzip.open(response.raw, 'rt', encoding='UTF-8') as f:
+            yield f
+    elif source.endswith('.gz'):
+        with gzip.open(source, 'rt', encoding='UTF-8') as f:
+            yield f
+    else:
+        with open(source, 'r', encoding='UTF-8') as f:
+            yield f
+
+
+def ban_file_urls(dpt):
+    """
+    URLs of the archives of a departement
+
+    Args:
+        dpt (str): departement
+
+    Returns:
+        (:obj:`list`): URL of each archive
+    """
+    return [ban_url.format(ban_dpt_gz_file_name_type.format(dpt)) for ban_dpt_gz_file_name_type in ban_dpt_gz_file_name]
+
+
 def _update_ban_files():
     """
     Downloads everything
@@ -187,20 +339,22 @@ def _update_ban_files():
                 continue
             s3.delete_object(Bucket="geocoder", Key=obj["Key"])
 
-    for dpt in tqdm(dpt_list, desc="Download raw data"):
-        for ban_dpt_gz_file_name_type in ban_dpt_gz_file_name:
-            downloading_ban_dpt_gz_file_name = ban_dpt_gz_file_name_type.format(dpt)
-            if not _download_ban_dpt_file(downloading_ban_dpt_gz_file_name):
-                logger.error('Impossible to download {}'.format(downloading_ban_dpt_gz_file_name))
+    names = [ban_dpt_gz_file_name_type.format(dpt) for dpt in dpt_list
+             for ban_dpt_gz_file_name_type in ban_dpt_gz_file_name]
+    for downloading_ban_dpt_gz_file_name in download_ban_files(names):
+        logger.error('Impossible to download {}'.format(downloading_ban_dpt_gz_file_name))
 
     return True
 
 
-def check_ban_version():
+def check_ban_version(stream=False):
     """
     Checks BAN version and triggers download if necessary
 
-    Returns: whether a download has been performed
+    Args:
+        stream (bool): only record the new version, the archives being streamed by :code:`index.stream_files`
+
+    Returns: whether a download has been performed (or is to be streamed)
     :rtype: bool
     """
     if LOCAL_DB and not os.path.exists(content_folder_path):
@@ -208,9 +362,26 @@ def check_ban_version():
 
     if not need_to_download():
         return False
+    if stream:
+        logger.info('A new version of BAN base is available.')
+        update_local_content_file()
+        return True
     return _update_ban_files()
 
 
+def ban_version():
+    """
+    Version of the BAN files of the database: the hash of the local content file
+
+    Returns: the hash, None if there is no local content file
+    :rtype: str
+    """
+    try:
+        return _md5(local_content_file_name)
+    except (OSError, ClientError):
+        return None
+
+
 def _eventually_download_files_locally():
     """
     If raw files were downloaded to S3, download locally before decompression
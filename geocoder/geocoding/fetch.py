@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""Fetch of the database from S3.
+
+The objects are downloaded once per host into a cache folder, where each one
+is keyed by its ETag, and mapped from there. The process downloading an object
+holds a lock on it, so that the other processes of the host (the workers of
+the API server) wait for it and reuse the file instead of downloading it
+again, and a process starting again finds it in the cache. The objects are downloaded in parallel, each one in parts
+downloaded concurrently, and checked against their size and, when the ETag is
+the MD5 of the object (uploaded in a single part), against their content.
+
+Attributes:
+    FETCH_CACHE (str): The cache folder (FETCH_CACHE environment variable,
+        geocoding/database/s3 by default).
+    FETCH_WORKERS (int): The number of objects downloaded at once, and of
+        threads downloading the parts of each one (FETCH_WORKERS environment
+        variable, 8 by default).
+    PART_SIZE (int): The size of the parts (FETCH_PART_SIZE environment
+        variable, 64 MB by default).
+    KEEP_VERSIONS (int): The number of versions of the database kept in the
+        cache (KEEP_VERSIONS environment variable, 2 by default).
+
+"""
+import hashlib
+import os
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from loguru import logger
+
+from geocoder.geocoding import packed, s3
+from geocoder.geocoding.datapaths import database
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+FETCH_CACHE = os.environ.get("FETCH_CACHE", os.path.join(database, 's3'))
+FETCH_WORKERS = int(os.environ.get("FETCH_WORKERS", 8))
+PART_SIZE = int(os.environ.get("FETCH_PART_SIZE", 64 << 20))
+KEEP_VERSIONS = int(os.environ.get("KEEP_VERSIONS", 2))
+
+
+def transfer_config(workers=FETCH_WORKERS):
+    """Configuration of the multipart downloads of boto3."""
+    from boto3.s3.transfer import TransferConfig
+    return TransferConfig(multipart_threshold=PART_SIZE, multipart_chunksize=PART_SIZE,
+                          max_concurrency=max(1, workers))
+
+
+def cache_path(key, etag):
+    """Path to the cached copy of a version of an object.
+
+    Args:
+        key (str): The key of the object.
+        etag (str): Its ETag, without quotes.
+
+    Returns:
+        str: The path, in a folder of the versions of the object.
+
+    """
+    return os.path.join(FETCH_CACHE, key, re.sub(r'[^0-9A-Za-z-]', '_', etag))
+
+
+@contextmanager
+def locked(path):
+    """Hold an exclusive lock on a path, shared by all the processes of the
+    host, until the end of the block.
+    """
+    with open(path + '.lock', 'w') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def file_md5(path):
+    """MD5 of the bytes of a file."""
+    md5 = hashlib.md5()  # nosec
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(packed.CHUNK_SIZE), b""):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+def check(path, key, etag, size):
+    """Check a downloaded object against its size and, if it was uploaded in
+    a single part, against its ETag.
+
+    Raises:
+        packed.CorruptDatabase: If it does not match.
+
+    """
+    if os.path.getsize(path) != size:
+        raise packed.CorruptDatabase(f"{key} downloaded from S3 has {os.path.getsize(path)} bytes instead of {size}")
+    if re.fullmatch('[0-9a-f]{32}', etag) and file_md5(path) != etag:
+        raise packed.CorruptDatabase(f"{key} downloaded from S3 does not match its ETag")
+
+
+def remove_other_versions(cached):
+    """Remove the cached versions of an object other than cached, but not
+    those being downloaded.
+    """
+    folder = os.path.dirname(cached)
+    for name in os.listdir(folder):
+        if name != os.path.basename(cached) and not name.endswith(('.lock', '.part')):
+            os.remove(os.path.join(folder, name))
+
+
+def remove_old_versions(keep=KEEP_VERSIONS):
+    """Remove the cached versions of the database older than the last keep
+    ones.
+    """
+    folder = os.path.join(FETCH_CACHE, 'database', 'versions')
+    names = sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+    for name in names[:max(len(names) - keep, 0)]:
+        shutil.rmtree(os.path.join(folder, name), ignore_errors=True)
+
+
+def fetch(key, client=None, workers=FETCH_WORKERS):
+    """Fetch an object of the geocoder bucket through the cache.
+
+    Args:
+        key (str): The key of the object.
+        client (optional): The S3 client, geocoding.s3 by default.
+        workers (int, optional): The number of threads downloading its parts,
+            FETCH_WORKERS by default.
+
+    Returns:
+        str: The path to the cached object.
+
+    Raises:
+        packed.CorruptDatabase: If the downloaded object does not match its
+            size or ETag.
+        botocore.exceptions.ClientError: If there is no such object.
+
+    """
+    client = s3 if client is None else client
+    head = client.head_object(Bucket='geocoder', Key=key)
+    etag = head['ETag'].strip('"')
+    cached = cache_path(key, etag)
+    if os.path.isfile(cached):
+        return cached
+    os.makedirs(os.path.dirname(cached), exist_ok=True)
+    with locked(cached):
+        if not os.path.isfile(cached):  # not downloaded meanwhile by another process
+            logger.info(f"Downloading {key} from S3")
+            try:
+                client.download_file('geocoder', key, cached + '.part', Config=transfer_config(workers))
+                check(cached + '.part', key, etag, head['ContentLength'])
+            except BaseException:
+                if os.path.exists(cached + '.part'):
+                    os.remove(cached + '.part')
+                raise
+            os.replace(cached + '.part', cached)
+            remove_other_versions(cached)
+    return cached
+
+
+def fetch_all(keys, client=None, workers=FETCH_WORKERS):
+    """Fetch objects of the geocoder bucket in parallel, through the cache.
+
+    Args:
+        keys (:obj:`list` of str): The keys of the objects.
+        client (optional): The S3 client, geocoding.s3 by default.
+        workers (int, optional): The number of objects fetched at once,
+            FETCH_WORKERS by default.
+
+    Returns:
+        (:obj:`list` of str): The path to each cached object.
+
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(executor.map(lambda key: fetch(key, client, workers), keys))
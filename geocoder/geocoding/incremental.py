@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""Incremental update of the database.
+
+The tables of each departement are cached once processed, along with the HTTP
+validators of its files in a manifest. An update only downloads and processes
+the departements whose files changed, and splices the cached tables of all
+the departements back together.
+
+.. autosummary::
+    cache_path
+    read_manifest
+    write_manifest
+    file_hash
+    is_changed
+    refresh
+    splice
+    update
+"""
+import hashlib
+import json
+import os
+import pickle  # nosec
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+from tqdm import tqdm
+
+from geocoder.geocoding import download, index
+from geocoder.geocoding.datapaths import here, paths
+
+cache_folder_path = os.path.join(here, 'cache')
+
+
+def cache_path(departement):
+    """
+    Path to the cached tables of a departement
+
+    :param str departement: departement
+    :rtype: str
+    """
+    return os.path.join(cache_folder_path, f"{departement}.pkl")
+
+
+def read_manifest():
+    """
+    Validators and hash of each file of the cached departements
+
+    :return: the manifest, empty if there is none
+    :rtype: dict
+    """
+    manifest_path = os.path.join(cache_folder_path, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def write_manifest(manifest):
+    """
+    Replace the manifest atomically
+
+    :param dict manifest: validators and hash of each file
+    """
+    manifest_path = os.path.join(cache_folder_path, 'manifest.json')
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def file_hash(file_path):
+    """
+    SHA-256 hash of a file
+
+    :param str file_path: path to the file
+    :rtype: str
+    """
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(download.DOWNLOAD_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def is_changed(departement, manifest, validators):
+    """
+    Whether the files of a departement changed since its tables were cached
+
+    Files without ETag nor Last-Modified are considered as changed; their hash tells after the download whether they
+    need to be processed again.
+
+    :param str departement: departement
+    :param dict manifest: validators and hash of each file when the departement was cached
+    :param dict validators: current validators of each file
+    :rtype: bool
+    """
+    if not os.path.exists(cache_path(departement)):
+        return True
+    for name in (name_type.format(departement) for name_type in download.ban_dpt_gz_file_name):
+        new, old = validators[name], manifest.get(name, {})
+        if new and new['etag'] is None and new['last_modified'] is None:
+            return True
+        if new != {key: old.get(key) for key in new}:
+            return True
+    return False
+
+
+def refresh(departements, manifest, validators, workers):
+    """
+    Download and process again the departements that changed, and update their cache and the manifest
+
+    :param list departements: the departements that changed
+    :param dict manifest: validators and hash of each file, updated in place
+    :param dict validators: current validators of each file
+    :param int workers: number of processes
+    """
+    os.makedirs(download.raw_data_folder_path, exist_ok=True)
+    names = {departement: [name_type.format(departement) for name_type in download.ban_dpt_gz_file_name]
+             for departement in departements}
+    for name in download.download_ban_files([name for dpt_names in names.values() for name in dpt_names]):
+        logger.error('Impossible to download {}'.format(name))
+
+    ban_files, entries = {}, defaultdict(dict)
+    for departement, dpt_names in names.items():
+        for name in dpt_names:
+            file_path = os.path.join(download.raw_data_folder_path, name)
+            if os.path.exists(file_path):
+                entries[departement][name] = dict(validators[name], sha256=file_hash(file_path))
+                ban_files.setdefault(departement, []).append(file_path)
+        if departement not in ban_files:  # pragma: no cover
+            logger.error(f"No file for departement {departement}: its previous tables are kept")
+        elif os.path.exists(cache_path(departement)) and all(manifest.get(name, {}).get('sha256') == entry['sha256']
+                                                             for name, entry in entries[departement].items()):
+            logger.debug(f"Departement {departement} did not change")
+            manifest.update(entries[departement])
+            del ban_files[departement]
+
+    for departement, columns in tqdm(index.departement_columns(ban_files, workers), total=len(ban_files),
+                                     desc="Process files"):
+        with open(cache_path(departement), 'wb') as f:
+            pickle.dump(columns, f, protocol=pickle.HIGHEST_PROTOCOL)
+        manifest.update(entries[departement])
+        write_manifest(manifest)
+    write_manifest(manifest)
+
+    for files in names.values():
+        for name in files:
+            download._remove_file(os.path.join(download.raw_data_folder_path, name))
+
+
+def splice(tables=index.processed_files):
+    """
+    Concatenate the cached tables of every departement, in the order of the full processing
+
+    :param dict tables: the tables to fill, :code:`index.processed_files` by default
+    """
+    tables.clear()
+    for departement in sorted(download.dpt_list):
+        if not os.path.exists(cache_path(departement)):  # pragma: no cover
+            logger.error(f"Departement {departement} is missing")
+            continue
+        with open(cache_path(departement), 'rb') as f:
+            index.merge_departement(pickle.load(f), tables)  # nosec
+
+
+def update(workers=None, tables=index.processed_files):
+    """
+    Download and process only the departements whose files changed, then splice the tables of all departements
+
+    :param int workers: number of processes, see :code:`index.get_workers` by default
+    :param dict tables: the tables to fill, :code:`index.processed_files` by default
+    :return: whether the database has to be created again
+    :rtype: bool
+    """
+    os.makedirs(cache_folder_path, exist_ok=True)
+    manifest = read_manifest()
+    names = [name_type.format(dpt) for dpt in download.dpt_list for name_type in download.ban_dpt_gz_file_name]
+    session = download.get_session(download.DOWNLOAD_WORKERS)
+    with ThreadPoolExecutor(max_workers=download.DOWNLOAD_WORKERS) as executor:
+        validators = dict(zip(names, executor.map(download.get_validators, names, [session] * len(names))))
+    session.close()
+
+    departements = [dpt for dpt in download.dpt_list if is_changed(dpt, manifest, validators)]
+    logger.info(f"{len(departements)} departement(s) changed")
+    if not departements and all(os.path.exists(path) for path in paths.values()):
+        logger.info('BAN database is already up to date.')
+        return False
+
+    if departements:
+        refresh(departements, manifest, validators, index.get_workers() if workers is None else workers)
+    splice(tables)
+    return True
@@ -7,27 +7,64 @@ files using tools from the package numpy.
 
 """
 
+import heapq
 import os
+import pickle  # nosec
 import shutil
+import tempfile
+from array import array
+from datetime import datetime, timezone
 from collections import deque, defaultdict
+from contextlib import ExitStack
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain, groupby, islice
 
 import numpy as np
 from loguru import logger
 from tqdm import tqdm
 
-from geocoder.geocoding import ban_processing, LOCAL_DB, s3
-from geocoder.geocoding.datapaths import paths, database
+from geocoder.geocoding import ban_processing, packed, LOCAL_DB, s3
+from geocoder.geocoding.compact import to_str
+from geocoder.geocoding.datapaths import here, paths, packed_path, database, versions, current_path
 from geocoder.geocoding.datatypes import dtypes
-from geocoder.geocoding.download import raw_data_folder_path
+from geocoder.geocoding.download import ban_file_urls, ban_version, dpt_list, raw_data_folder_path
+from geocoder.geocoding.similarity import NGRAMS, Similarity, bigram_ids
+from geocoder.geocoding.utils import hash64
 
 file_names = ['departement', 'postal', 'commune', 'voie', 'localisation']
 processed_files = defaultdict(deque)
+offset_fields = ['start', 'end', 'ref_id']
+index_tables = ['postal', 'commune', 'voie']
+KEEP_VERSIONS = int(os.environ.get("KEEP_VERSIONS", 2))
 
 
-def process_files():
+def get_workers():
     """
-    Process all downloaded decompressed files
+    Number of processes used to process the departements: INGEST_WORKERS environment variable, all the cores by
+    default
 
+    :rtype: int
+    """
+    return max(1, int(os.environ.get("INGEST_WORKERS", os.cpu_count() or 1)))
+
+
+def get_chunk_size():
+    """
+    Number of rows read at once when building the database: BUILD_CHUNK_SIZE environment variable, 10000 by default
+
+    :rtype: int
+    """
+    return max(1, int(os.environ.get("BUILD_CHUNK_SIZE", 10000)))
+
+
+def process_files(workers=None):
+    """
+    Process all downloaded files, decompressed or not
+
+    The departements are processed in parallel by a pool of workers processes when workers is greater than 1. The
+    result is the same as the serial processing.
+
+    :param int workers: number of processes, see :code:`get_workers` by default
     :return: if processing was successful
     :rtype: bool
     """
@@ -35,12 +72,79 @@ def process_files():
         logger.info('Data not found - execute: geocoder download')
         return False
 
+    ban_files = get_ban_files()
+    logger.debug(f"Files: {ban_files}")
+
+    # Check if the folder was not empty
+    if not ban_files:  # pragma: no cover
+        logger.info('No CSV file - execute: geocoder download')
+        return False
+
+    return process_ban_files(ban_files, workers)
+
+
+def stream_files(workers=None):
+    """
+    Process the archives of every departement as they are downloaded from BAN, without writing them to disk
+
+    :param int workers: number of processes, see :code:`get_workers` by default
+    :return: if processing was successful
+    :rtype: bool
+    """
+    return process_ban_files(get_ban_urls(), workers)
+
+
+def get_ban_urls():
+    """
+    URLs of the archives of each departement
+
+    :rtype: dict
+    """
+    return {dpt: ban_file_urls(dpt) for dpt in dpt_list}
+
+
+def process_ban_files(ban_files, workers=None):
+    """
+    Process the files of each departement into processed_files
+
+    :param dict ban_files: paths to the files (or URLs of the archives) by departement
+    :param int workers: number of processes, see :code:`get_workers` by default
+    :return: if processing was successful
+    :rtype: bool
+    """
+    departements = list(ban_files.keys())
+    departements.sort()
+
+    workers = get_workers() if workers is None else workers
+    if workers > 1 and len(departements) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(process_departement, departements, [ban_files[d] for d in departements])
+            for columns in tqdm(results, total=len(departements), desc="Process files"):
+                merge_departement(columns, processed_files)
+        return True
+
+    for departement in tqdm(departements, desc="Process files"):
+        for file in ban_files[departement]:
+            logger.debug(f"Département : {departement}")
+            logger.debug(f"Fichier : {file}")
+            ban_processing.update(departement, file, processed_files)
+
+    return True
+
+
+def get_ban_files():
+    """
+    List the CSV files of each departement, or their gzip archives when they were not decompressed
+
+    :return: paths to the files by departement, in the order of their names
+    :rtype: dict
+    """
     ban_files = defaultdict(list)
 
     # Open each csv file
     for (dirname, dirs, files) in os.walk(raw_data_folder_path):
-        for filename in files:
-            if filename.endswith('.csv'):
+        for filename in sorted(files):
+            if filename.endswith('.csv') or (filename.endswith('.csv.gz') and filename[:-3] not in files):
                 file_path = os.path.join(dirname, filename)
                 if "adresses" in filename:
                     dpt_name = filename.split('-')[-1].split('.')[0]
@@ -48,49 +152,281 @@ def process_files():
                     dpt_name = filename.split('-')[-2].split('.')[0]
                 ban_files[dpt_name].append(file_path)
 
-    logger.debug(f"Files: {ban_files}")
+    return ban_files
 
-    # Check if the folder was not empty
+
+def process_departement(departement, files):
+    """
+    Process the files of one departement on their own, as in a worker process
+
+    :param str departement: departement
+    :param list files: paths to the files (or URLs of the archives) of the departement
+    :return: the columns of each table, with start, end and ref_id relative to the departement
+    :rtype: dict
+    """
+    tables = defaultdict(deque)
+    for file in files:
+        logger.debug(f"Département : {departement}")
+        logger.debug(f"Fichier : {file}")
+        ban_processing.update(departement, file, tables)
+    return to_columns(tables)
+
+
+def to_columns(tables):
+    """
+    Convert tables of tuples to columns, with the offsets (start, end and ref_id) as numpy arrays
+
+    :param dict tables: the tables of tuples
+    :return: the list of columns of each table
+    :rtype: dict
+    """
+    columns = {}
+    for table, rows in tables.items():
+        fields = dtypes[table].names
+        values = list(zip(*rows)) if rows else [()] * len(fields)
+        columns[table] = [np.array(value, dtype='int64') if field in offset_fields else list(value)
+                          for field, value in zip(fields, values)]
+    return columns
+
+
+def merge_departement(columns, tables):
+    """
+    Append the tables of one departement to the tables of the previous ones
+
+    :param dict columns: the columns returned by :code:`process_departement`
+    :param dict tables: the tables to update
+    """
+    offsets = {table: len(tables[table]) for table in file_names}
+    for table, values in rebase(columns, offsets).items():
+        tables[table].extend(zip(*values))
+
+
+def rebase(columns, offsets):
+    """
+    Shift the start, end and ref_id of the tables of one departement after the rows of the previous ones
+
+    :param dict columns: the columns returned by :code:`process_departement`
+    :param dict offsets: number of rows of each table before the departement
+    :return: the list of columns of each table of the departement
+    :rtype: dict
+    """
+    tables = {}
+    for i, table in enumerate(file_names):
+        if table not in columns:
+            continue
+        values = []
+        for field, value in zip(dtypes[table].names, columns[table]):
+            if field in ('start', 'end'):
+                value = (value + offsets[file_names[i + 1]]).tolist()
+            elif field == 'ref_id':
+                value = (value + offsets[file_names[i - 1]]).tolist()
+            values.append(value)
+        tables[table] = values
+    return tables
+
+
+def departement_columns(ban_files, workers):
+    """
+    Process the files of each departement on their own, in order
+
+    At most twice as many departements as workers are processed or waiting to be consumed at any time.
+
+    :param dict ban_files: paths to the files (or URLs of the archives) by departement
+    :param int workers: number of processes
+    :return: generator of departement and columns returned by :code:`process_departement`
+    """
+    departements = sorted(ban_files)
+    if workers <= 1 or len(departements) <= 1:
+        for departement in departements:
+            yield departement, process_departement(departement, ban_files[departement])
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for departement in departements:
+            pending.append((departement, executor.submit(process_departement, departement, ban_files[departement])))
+            if len(pending) > workers:
+                departement, future = pending.popleft()
+                yield departement, future.result()
+        while pending:
+            departement, future = pending.popleft()
+            yield departement, future.result()
+
+
+def build_database(ban_files=None, workers=None, chunk_size=None):
+    """
+    Out-of-core counterpart of :code:`process_files` followed by :code:`create_database`
+
+    The rows of each departement are appended to the tables on disk as soon as it is processed, and the index tables
+    are merged from the sorted runs of each departement, spilled to disk. The hash, bigram and n-gram tables are then
+    built from the tables on disk, chunk_size rows or one commune at a time. Memory is bounded by the departements
+    being processed (see :code:`departement_columns`), by chunk_size rows per run during the merge and by 25 bytes
+    per distinct name for the hash tables. The database is the same as with :code:`process_files` and
+    :code:`create_database`.
+
+    :param dict ban_files: paths to the files (or URLs of the archives) by departement, see :code:`get_ban_files` by
+        default
+    :param int workers: number of processes, see :code:`get_workers` by default
+    :param int chunk_size: number of rows read at once, see :code:`get_chunk_size` by default
+    :return: if building was successful
+    :rtype: bool
+    """
+    ban_files = get_ban_files() if ban_files is None else ban_files
     if not ban_files:  # pragma: no cover
-        logger.info('No CSV file - execute: geocoder decompress')
+        logger.info('No CSV file - execute: geocoder download')
         return False
+    workers = get_workers() if workers is None else workers
+    chunk_size = get_chunk_size() if chunk_size is None else chunk_size
+    reset_database()
 
-    departements = list(ban_files.keys())
-    departements.sort()
+    sizes = {table: 0 for table in file_names}
+    repetitions = {}
+    with tempfile.TemporaryDirectory(dir=here) as runs_folder, ExitStack() as stack:
+        dat_files = {table: stack.enter_context(open(paths[table], 'wb')) for table in file_names}
+        runs = defaultdict(list)
+        for departement, columns in tqdm(departement_columns(ban_files, workers), total=len(ban_files),
+                                         desc="Process files"):
+            for table, values in rebase(columns, sizes).items():
+                if table == 'localisation':
+                    values[1] = repetition_codes(values[1], repetitions)
+                dat_files[table].write(to_array(values, dtypes[table]).tobytes())
+                if table in index_tables:
+                    runs[table].append(spill_run(values, sizes[table], chunk_size,
+                                                 os.path.join(runs_folder, f"{table}-{departement}.pkl")))
+                sizes[table] += len(values[0])
+        stack.close()
+        create_dat_file(list(repetitions), paths['repetition'], dtypes['repetition'])
 
-    for departement in tqdm(departements, desc="Process files"):
-        for file in ban_files[departement]:
-            logger.debug(f"Département : {departement}")
-            logger.debug(f"Fichier : {file}")
-            ban_processing.update(departement, file, processed_files)
+        for table in tqdm(index_tables, desc="Index tables"):
+            merge_runs(runs[table], paths[table + '_index'], dtypes[table + '_index'], chunk_size)
+
+    for table in file_names + [table + '_index' for table in index_tables]:
+        upload_dat_file(paths[table])
+
+    add_hash_tables(chunk_size)
+    add_bigram_tables()
+    add_ngram_tables(chunk_size)
 
     return True
 
 
+def to_array(values, dtype):
+    """
+    Structured array of the columns of a table
+
+    :param list values: the columns of the table
+    :param numpy.dtype dtype: the type of its rows
+    :rtype: numpy.ndarray
+    """
+    array = np.zeros(len(values[0]), dtype=dtype)
+    for field, value in zip(dtype.names, values):
+        array[field] = value
+    return array
+
+
+def spill_run(values, offset, chunk_size, run_path):
+    """
+    Sort the rows of one departement and write them to disk by chunks, with their position in the whole table
+
+    :param list values: the columns of the table, rebased
+    :param int offset: position of the first row in the whole table
+    :param int chunk_size: number of rows by chunk
+    :param str run_path: path to the run file
+    :return: run_path
+    :rtype: str
+    """
+    run = sorted(zip(zip(*values), range(offset, offset + len(values[0]))))
+    with open(run_path, 'wb') as f:
+        for start in range(0, len(run), chunk_size):
+            pickle.dump(run[start:start + chunk_size], f, protocol=pickle.HIGHEST_PROTOCOL)
+    return run_path
+
+
+def read_run(run_path):
+    """
+    Rows of a run, read chunk by chunk
+
+    :param str run_path: path to the run file
+    :return: generator of the (row, position) of the run, in order
+    """
+    with open(run_path, 'rb') as f:
+        while True:
+            try:
+                yield from pickle.load(f)  # nosec
+            except EOFError:
+                return
+
+
+def merge_runs(run_paths, out_filename, dtype, chunk_size):
+    """
+    Merge sorted runs into the positions of the rows of the whole table in sorted order
+
+    :param list run_paths: paths to the runs
+    :param str out_filename: path to the index table
+    :param numpy.dtype dtype: the type of the positions
+    :param int chunk_size: number of positions written at once
+    """
+    positions = (position for row, position in heapq.merge(*(read_run(run_path) for run_path in run_paths)))
+    with open(out_filename, 'wb') as f:
+        for chunk in iter(lambda: list(islice(positions, chunk_size)), []):
+            f.write(np.array(chunk, dtype=dtype).tobytes())
+
+
+def reset_database():
+    """
+    Remove the tables of the database folder, but not the published versions of the database, which may be in use
+    """
+    os.makedirs(database, exist_ok=True)
+    for path in paths.values():
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except PermissionError as e:  # pragma: no cover
+                logger.error('Windows sucks, remove database folder manually and proceed.')
+                raise e
+
+
 def create_database():
-    if os.path.exists(database):
-        try:
-            shutil.rmtree(database)
-        except PermissionError as e:  # pragma: no cover
-            logger.error('Windows sucks, remove database folder manually and proceed.')
-            raise e
-    os.mkdir(database)
+    reset_database()
 
     if not processed_files:  # pragma: no cover
         return False
 
     add_index_tables()
 
+    repetitions = {}
     for table, processed_file in tqdm(processed_files.items(), desc="Store database"):
         logger.debug(table)
-        create_dat_file(list(processed_file), paths[table], dtypes[table])
+        rows = list(processed_file)
+        if table == 'localisation':
+            codes = repetition_codes([row[1] for row in rows], repetitions)
+            rows = [row[:1] + (code, ) + row[2:] for row, code in zip(rows, codes)]
+        create_dat_file(rows, paths[table], dtypes[table])
+    create_dat_file(list(repetitions), paths['repetition'], dtypes['repetition'])
+
+    add_hash_tables()
+    add_bigram_tables()
+    add_ngram_tables()
 
     return True
 
 
-def add_index_tables():
-    index_tables = ['postal', 'commune', 'voie']
+def repetition_codes(values, repetitions):
+    """
+    Codes of the repetitions of the street numbers, their index in the repetition table
+
+    The repetitions are truncated to the size of the repetition table, and the missing ones are empty.
 
+    :param list values: the repetitions
+    :param dict repetitions: the code of each repetition, in the order of the repetition table, updated with the new
+        ones
+    :rtype: list
+    """
+    size = dtypes['repetition'].itemsize // np.dtype('U1').itemsize
+    return [repetitions.setdefault((value or '')[:size], len(repetitions)) for value in values]
+
+
+def add_index_tables():
     # Index tables creation
     for current_table in tqdm(index_tables, desc="Index tables"):
         sort_method = (lambda j, table=current_table: processed_files[table][j])
@@ -100,6 +436,201 @@ def add_index_tables():
             sorted(range(len(processed_files[current_table])), key=sort_method)
 
 
+def name_chunks(values, chunk_size, index=None):
+    """The normalised names of a table, chunk_size at a time.
+
+    Args:
+        values (:obj:`numpy.ndarray`): The table, mapped from its file.
+        chunk_size (int): The number of names of each chunk.
+        index (:obj:`numpy.ndarray`, optional): The order of the names, the
+            order of the table by default.
+
+    Returns:
+        generator of :obj:`list` of str: The chunks of names.
+    """
+    count = len(values) if index is None else len(index)
+    for start in range(0, count, chunk_size):
+        rows = slice(start, start + chunk_size) if index is None else index[start:start + chunk_size]
+        yield to_str(values['normalise'][rows]).tolist()
+
+
+def find_inversions(values):
+    """Inversions of the order of values.
+
+    Args:
+        values (iterable of str): The values in the order of the search.
+
+    Returns:
+        (:obj:`list` of :obj:`tuple`): (value, previous) for each value
+            smaller than the previous one.
+    """
+    inversions, previous = [], None
+    for value in values:
+        if previous is not None and previous > value:
+            inversions.append((value, previous))
+        previous = value
+    return inversions
+
+
+def exact_ranges(values, inversions=None):
+    """Ranges of the values that a binary search over values finds exactly.
+
+    A value is kept only if the binary search would stop on its first
+    occurrence, that is if the previous value is smaller and if it does not
+    fall in an inversion of the order (which happens when long strings are
+    truncated in the database). A value appearing again after a smaller one
+    falls in an inversion, so that each value is kept at most once.
+
+    Args:
+        values (iterable of str): The values in the order of the search.
+        inversions (:obj:`list` of :obj:`tuple`, optional): The inversions
+            of values (see find_inversions), so that values are only read
+            once; found from values by default.
+
+    Returns:
+        generator of :obj:`tuple`: (value, start, end) where start is the
+            first occurrence of value and end the end of its first run.
+    """
+    if inversions is None:
+        values = list(values)
+        inversions = find_inversions(values)
+    previous, start = None, 0
+    for value, run in groupby(values):
+        end = start + sum(1 for _ in run)
+        if (previous is None or previous < value) and \
+                not any(low < value <= high for low, high in inversions):
+            yield value, start, end
+        previous, start = value, end
+
+
+def create_hash_table(entries, out_filename, dtype):
+    """Write an open addressing hash table with linear probing.
+
+    The entries are kept in compact arrays and the slots are written
+    straight to the file of the table.
+
+    Args:
+        entries (iterable of :obj:`tuple`): (key, start, end) where key is
+            a non-zero 64-bit hash.
+        out_filename (str): The path to the table, whose size is the
+            smallest power of two greater than twice the number of entries.
+        dtype (:obj:`numpy.dtype`): The type of the slots.
+    """
+    keys, starts, ends = array('Q'), array('q'), array('q')
+    for key, start, end in entries:
+        keys.append(key)
+        starts.append(start)
+        ends.append(end)
+    size = 1
+    while size < 2 * len(keys):
+        size *= 2
+    mask = size - 1
+    taken, slots = bytearray(size), array('q')
+    for key in keys:
+        slot = key & mask
+        while taken[slot]:
+            slot = (slot + 1) & mask
+        taken[slot] = 1
+        slots.append(slot)
+    table = np.memmap(out_filename, mode='w+', dtype=dtype, shape=(size, ))
+    slots = np.frombuffer(slots, dtype='int64')
+    table['key'][slots] = np.frombuffer(keys, dtype='uint64')
+    table['start'][slots] = np.frombuffer(starts, dtype='int64')
+    table['end'][slots] = np.frombuffer(ends, dtype='int64')
+    table.flush()
+    del table
+    upload_dat_file(out_filename)
+
+
+def add_hash_tables(chunk_size=None):
+    """Create the hash tables used for the exact searches of communes and
+    voies: by name over commune_index and voie_index, and by commune and name
+    over each range of voies of a commune.
+
+    Args:
+        chunk_size (int, optional): The number of names read at once, see
+            get_chunk_size by default.
+    """
+    chunk_size = get_chunk_size() if chunk_size is None else chunk_size
+    commune = np.memmap(paths['commune'], dtype=dtypes['commune'])
+    voie = np.memmap(paths['voie'], dtype=dtypes['voie'])
+
+    for table, values in tqdm([('commune', commune), ('voie', voie)], desc="Hash tables"):
+        index = np.memmap(paths[table + '_index'], dtype=dtypes[table + '_index'])
+        inversions = find_inversions(chain.from_iterable(name_chunks(values, chunk_size, index)))
+        ranges = exact_ranges(chain.from_iterable(name_chunks(values, chunk_size, index)), inversions)
+        create_hash_table(((hash64(name), start, end) for name, start, end in ranges),
+                          paths[table + '_hash'], dtypes[table + '_hash'])
+
+    entries = (
+        (hash64(commune_id, name), first + start, first + end)
+        for commune_id, (first, last) in enumerate(zip(commune['start'].tolist(), commune['end'].tolist()))
+        for name, start, end in exact_ranges(to_str(voie['normalise'][first:last]).tolist()))
+    create_hash_table(entries, paths['commune_voie_hash'], dtypes['commune_voie_hash'])
+
+
+def add_bigram_tables():
+    """Create the inverted index of the bigrams of the voies of each commune.
+
+    The index is stored in compressed sparse rows: voie_bigram holds one
+    record per commune and bigram, sorted by key, and delimits the voies
+    containing it in voie_bigram_posting. Both are written one commune at a
+    time, the keys of a commune being greater than those of the previous
+    ones.
+    """
+    commune = np.memmap(paths['commune'], dtype=dtypes['commune'])
+    voie = np.memmap(paths['voie'], dtype=dtypes['voie'])
+    ranges = list(zip(commune['start'].tolist(), commune['end'].tolist()))
+    size = 0
+
+    with open(paths['voie_bigram'], 'wb') as bigram_file, open(paths['voie_bigram_posting'], 'wb') as posting_file:
+        for commune_id, (first, last) in enumerate(tqdm(ranges, desc="Bigram index")):
+            names = to_str(voie['normalise'][first:last]).tolist()
+            pairs = [(gram, row) for row, name in enumerate(names, first) for gram in bigram_ids(name)]
+            if not pairs:
+                continue
+            pairs = np.array(pairs, dtype='int64')
+            pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+            keys, starts, counts = np.unique(pairs[:, 0] + commune_id * NGRAMS, return_index=True,
+                                             return_counts=True)
+            bigram = np.zeros(len(keys), dtype=dtypes['voie_bigram'])
+            bigram['key'], bigram['start'], bigram['end'] = keys, size + starts, size + starts + counts
+            bigram_file.write(bigram.tobytes())
+            posting_file.write(pairs[:, 1].astype(dtypes['voie_bigram_posting']).tobytes())
+            size += len(pairs)
+
+    upload_dat_file(paths['voie_bigram'])
+    upload_dat_file(paths['voie_bigram_posting'])
+
+
+def add_ngram_tables(chunk_size=None):
+    """Create the n-gram signatures of the communes and voies: the sorted
+    identifiers of the uni and bigrams of each normalised name and the score
+    of their set, used by Similarity.score_id.
+
+    Args:
+        chunk_size (int, optional): The number of names read and written at
+            once, see get_chunk_size by default.
+    """
+    chunk_size = get_chunk_size() if chunk_size is None else chunk_size
+    for table in tqdm(['commune', 'voie'], desc="N-gram signatures"):
+        values = np.memmap(paths[table], dtype=dtypes[table])
+        size = 0
+        with open(paths[table + '_ngram'], 'wb') as ngram_file, open(paths[table + '_ngram_id'], 'wb') as id_file:
+            for names in name_chunks(values, chunk_size):
+                ngram, ngram_ids = [], array('h')
+                for name in names:
+                    similarity = Similarity(name)
+                    start = size + len(ngram_ids)
+                    ngram_ids.extend(similarity.ngram_ids())
+                    ngram.append((start, size + len(ngram_ids), similarity.slice_set_score))
+                ngram_file.write(np.array(ngram, dtype=dtypes[table + '_ngram']).tobytes())
+                id_file.write(np.frombuffer(ngram_ids, dtype='int16').astype(dtypes[table + '_ngram_id']).tobytes())
+                size += len(ngram_ids)
+        upload_dat_file(paths[table + '_ngram'])
+        upload_dat_file(paths[table + '_ngram_id'])
+
+
 def create_dat_file(lst, out_filename, dtype):
     """Write a list in a binary file as a numpy array.
 
@@ -115,5 +646,72 @@ def create_dat_file(lst, out_filename, dtype):
     except TypeError:
         logger.debug(lst[-10:])
     dat_file.flush()
+    upload_dat_file(out_filename)
+
+
+def upload_dat_file(out_filename):
+    """Upload a binary file of the database to S3, when the database is not local.
+
+    Args:
+        out_filename: The name of the binary file.
+    """
     if not LOCAL_DB:
         s3.upload_file(out_filename, "geocoder", f"database/{os.path.basename(out_filename)}")
+
+
+def pack_database(keep=KEEP_VERSIONS):
+    """
+    Pack the tables of the database in a new version, publish it and remove the oldest versions
+
+    The running geocoders switch to the new version when they reload (see :code:`query.reload`).
+
+    :param int keep: number of versions kept, KEEP_VERSIONS environment variable (2) by default
+    :return: if packing was successful
+    :rtype: bool
+    """
+    missing = [table for table, path in paths.items() if not os.path.exists(path)]
+    if missing:  # pragma: no cover
+        logger.error(f"Missing tables {missing} - execute: geocoder index and geocoder reverse")
+        return False
+    version = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+    os.makedirs(os.path.dirname(packed_path(version)))
+    packed.write(paths, packed_path(version), ban_version())
+    publish(version)
+    remove_old_versions(keep)
+    return True
+
+
+def publish(version):
+    """
+    Make a packed version the one loaded by the geocoders, atomically
+
+    :param str version: name of the version
+    """
+    if not LOCAL_DB:
+        s3.upload_file(packed_path(version), "geocoder", f"database/versions/{version}/geocoder.db")
+    with open(current_path + '.tmp', 'w') as f:
+        f.write(version)
+    os.replace(current_path + '.tmp', current_path)
+    if not LOCAL_DB:
+        s3.upload_file(current_path, "geocoder", f"database/{os.path.basename(current_path)}")
+    logger.info(f"Version {version} of the database published")
+
+
+def remove_old_versions(keep=KEEP_VERSIONS):
+    """
+    Remove the versions older than the last keep ones, but never the published one
+
+    The previous versions are still mapped by the geocoders until they reload, which removing their file does not
+    disturb on POSIX systems; elsewhere, the versions in use are removed by a later call.
+
+    :param int keep: number of versions kept
+    """
+    with open(current_path, 'r') as f:
+        published = f.read().strip()
+    names = sorted(os.listdir(versions))
+    for version in names[:max(len(names) - keep, 0)]:
+        if version == published:  # pragma: no cover
+            continue
+        shutil.rmtree(os.path.join(versions, version), ignore_errors=True)
+        if not LOCAL_DB:
+            s3.delete_object(Bucket="geocoder", Key=f"database/versions/{version}/geocoder.db")
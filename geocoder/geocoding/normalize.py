@@ -10,12 +10,45 @@ Attributes:
         France.
     meanless_words (set of str): Set of words in French that does not contain
         information to distinguish one address from another.
+    CACHE_SIZE (int): The number of strings whose normalization is kept by
+        each memoized function (NORMALIZE_CACHE_SIZE environment variable,
+        65536 by default, 0 to disable the memoization).
+    SEPARATORS (dict): The translation table of the separators of words.
+    DIGITS (dict): The translation table deleting the digits.
+    TRANSLITERATION (:obj:`Transliteration`): The translation table of the
+        words, from unicode to upper-case ascii without separators.
+    caches (dict of callable): The memoized functions, by name.
 
 """
+import os
 import re
+from functools import lru_cache
 
 from unidecode import unidecode
 
+CACHE_SIZE = int(os.environ.get("NORMALIZE_CACHE_SIZE", 1 << 16))
+
+SEPARATORS = str.maketrans({',': ' ', "'": ' ', '-': ' ', '"': None})
+DIGITS = str.maketrans('', '', '0123456789')
+PARENTHESES = re.compile(r'[(].*[)]')
+NUMBER = re.compile(r'[0-9]+')
+
+caches = {}
+
+
+class Transliteration(dict):
+    """Translation table of str.translate from unicode to the upper-case
+    ascii of unidecode, whose separators of words are replaced as in
+    SEPARATORS, filled on the first use of each character.
+    """
+
+    def __missing__(self, code):
+        self[code] = value = unidecode(chr(code)).upper().translate(SEPARATORS)
+        return value
+
+
+TRANSLITERATION = Transliteration()
+
 dictionary = {
     "ALL": "ALLEE",
     "AV": "AVENUE",
@@ -56,6 +89,37 @@ voie_type_2 = {("CHEF", "LIEU"), ("LIEU", "DIT"), ("GRANDE", "RUE"), ("GRAND", "
 meanless_words = {"DE", "DES", "DU", "D", "LE", "LES", "LA", "L", "A", "AU", "AUX", "ET", "EN", "SUR", "SOUS", "CEDEX"}
 
 
+def memoized(function):
+    """Memoize a normalization function in a bounded LRU cache.
+
+    The searches and the processing of the BAN files normalize the same
+    cities and streets over and over, so that each distinct string is only
+    normalized once. The function must return an immutable value.
+    """
+    if CACHE_SIZE <= 0:
+        return function
+    caches[function.__name__] = lru_cache(maxsize=CACHE_SIZE)(function)
+    return caches[function.__name__]
+
+
+def metrics():
+    """Hits and misses of the memoized functions.
+
+    Returns:
+        (:obj:`dict` of :obj:`dict`): For each memoized function, its numbers
+        of hits and misses, the number of strings cached and the greatest
+        one.
+
+    """
+    return {name: cache.cache_info()._asdict() for name, cache in caches.items()}
+
+
+def clear():
+    """Empty the caches of the memoized functions and reset their counters."""
+    for cache in caches.values():
+        cache.cache_clear()
+
+
 def uniform(text):
     """Return the upper-case text converted to ascii.
     """
@@ -69,12 +133,13 @@ def remove_separators(text):
     for a slash or a vertical slash and return everything at its left.
     """
     # Remove parenthesis
-    text = re.sub(r'[(].*[)]', '', text)
+    if '(' in text:
+        text = PARENTHESES.sub('', text)
     # The slash
-    if re.findall(r'/', text):
+    if '/' in text:
         return text.split('/')[0]
     # The vertical slash
-    elif re.findall(r'[|]', text):
+    elif '|' in text:
         return text.split('|')[0]
     return text
 
@@ -85,27 +150,19 @@ def uniform_words(text, delete_meanless: bool = False):
     Split the normalized text in words and select those that aren't in the
     module level variable meanless_words set.
     """
-    text = uniform(remove_separators(text))
-
-    text = text.replace(",", ' ')
-    text = text.replace("'", ' ')
-    text = text.replace('"', '')
-    text = text.replace('-', ' ')
+    # uniform and the replacement of the separators, in a single translation
+    words = translate(remove_separators(text).strip().translate(TRANSLITERATION))
 
     if delete_meanless:
-        return [word for word in translate(text) if word not in meanless_words]
-    return [word for word in translate(text)]
+        return [word for word in words if word not in meanless_words]
+    return words
 
 
 def translate(text):
     """Translate the abbreviations to their long form using the module level
     variable dictionary.
     """
-    words = text.split()
-    for i in range(len(words)):
-        if words[i] in dictionary:
-            words[i] = dictionary[words[i]]
-    return words
+    return [dictionary.get(word, word) for word in text.split()]
 
 
 def uniform_adresse(text):
@@ -114,10 +171,11 @@ def uniform_adresse(text):
     return ''.join(uniform_words(text))
 
 
+@memoized
 def uniform_commune(text):
     """Normalization of the city name.
     """
-    return re.sub(r'[0-9]', '', ''.join(uniform_words(text))).strip()
+    return ''.join(uniform_words(text)).translate(DIGITS).strip()
 
 
 def find_voie_type(words):
@@ -130,6 +188,59 @@ def find_voie_type(words):
     return None
 
 
+def number(word):
+    """The first number of a word, None if it has no digit."""
+    if word.isalpha():
+        return None
+    match = NUMBER.search(word)
+    return int(match.group()) if match else None
+
+
+def tokenize(text):
+    """Split an address in words and find its number, street and type of
+    street, in a single scan of the words from the end.
+
+    The type of the street is the last word of voie_type_1, or the first of a
+    pair of voie_type_2, but the last word. The number is the first one of the
+    last word with digits before the type of the street (or before the last
+    word if the type was not found), and the street starts with its type (or
+    after its number if the type was not found).
+
+    Args:
+        text (str): The address.
+
+    Returns:
+        tuple:
+        (words (:obj:`list` of str): The normalized words, numero (int): The
+         number, voie (str): The name, voie_type (str): The type)
+
+    """
+    words = uniform_words(text)
+
+    # If the text has no words, return None
+    if not words:
+        return words, None, None, None
+
+    voie_type_index, numero, numero_index = None, None, None
+    for i in range(len(words) - 2, -1, -1):
+        word = words[i]
+        if voie_type_index is None and (word in voie_type_1 or (word, words[i + 1]) in voie_type_2):
+            # The numbers seen so far are after the type of the street
+            voie_type_index, numero, numero_index = i, None, None
+        elif numero_index is None:
+            numero = number(word)
+            numero_index = i if numero is not None else None
+            if numero_index is not None and voie_type_index is not None:
+                break
+
+    # In the case that the word describing the type of the street wasn't found
+    if voie_type_index is None:
+        voie_type_index = numero_index + 1 if numero_index is not None else 0
+
+    return words, numero, ' '.join(words[voie_type_index:]), words[voie_type_index]
+
+
+@memoized
 def mine(text):
     """Retrieve the useful information from the address.
 
@@ -144,32 +255,34 @@ def mine(text):
          voie_type (str): The type)
 
     """
-    words = uniform_words(text)
+    return tokenize(text)[1:]
 
-    # If the text has no words, return None
-    if not len(words) or len(text) == 0:
-        return None, None, None
 
-    voie_type_index = find_voie_type(words)
+def normalize_column(function, values, default=None):
+    """Normalize a column of strings, once per distinct value.
 
-    # The index of the last word to consider in the search for the number
-    numero_limit = voie_type_index if voie_type_index is not None \
-        else (len(words) - 1)
+    Args:
+        function (callable): The normalization function, uniform_commune or
+            mine for instance.
+        values (:obj:`list`, :obj:`numpy.ndarray` or :obj:`pandas.Series`):
+            The column.
+        default (optional): The output for the values which are not str
+            (missing values).
 
-    # Search for the number
-    numero, numero_index = None, None
-    for i, word in reversed(list(enumerate(words[:numero_limit]))):
-        matches = re.findall(r'[0-9]+', word)
-        if matches:
-            numero, numero_index = int(matches[0]), i
-            break
+    Returns:
+        (:obj:`list`): The normalized values.
 
-    # In the case that the word describing the type of the street wasn't found
-    if voie_type_index is None and numero_index is not None:
-        voie_type_index = numero_index + 1
-    elif voie_type_index is None:
-        voie_type_index = 0
-
-    voie = ' '.join(words[voie_type_index:])
-    voie_type = words[voie_type_index]
-    return numero, voie, voie_type
+    """
+    distinct = {value: None for value in values if isinstance(value, str)}
+    normalized = dict(zip(distinct, map(function, distinct)))
+    return [normalized[value] if isinstance(value, str) else default for value in values]
+
+
+def uniform_commune_column(values):
+    """uniform_commune of each city of a column, None if missing."""
+    return normalize_column(uniform_commune, values)
+
+
+def mine_column(values):
+    """mine of each address of a column, (None, None, None) if missing."""
+    return normalize_column(mine, values, (None, None, None))
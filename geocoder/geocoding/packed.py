@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Packed database: all the tables in a single file.
+
+The file starts with MAGIC and the length of a JSON header, which records the
+schema version, the BAN version and, for each table, its dtype, the offset of
+its first record after the header, its number of records and the SHA-256 of its
+bytes. The tables follow, each one aligned on ALIGNMENT bytes, so that the
+database is opened with a single mmap and each table is a numpy view of it.
+
+Attributes:
+    MAGIC (bytes): The first bytes of a packed database.
+    HEADER (:obj:`struct.Struct`): The layout of MAGIC and of the length of
+        the JSON header.
+    ALIGNMENT (int): The alignment of the tables in the file, a page.
+    CHUNK_SIZE (int): The number of bytes copied at once when packing.
+    VERIFY_DB (bool): Whether the checksums of the tables are verified when
+        the database is loaded (VERIFY_DB environment variable, true by
+        default).
+
+"""
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+
+import numpy as np
+
+from geocoder.geocoding.datatypes import SCHEMA_VERSION, dtypes
+
+MAGIC = b'GEOCODER'
+HEADER = struct.Struct('<8sQ')
+ALIGNMENT = 4096
+CHUNK_SIZE = 1 << 20
+VERIFY_DB = (os.getenv("VERIFY_DB", 'True').lower() in ('true', '1', 't'))
+
+
+class CorruptDatabase(Exception):
+    """The packed database is truncated, altered or of another schema."""
+
+
+def align(size):
+    """Smallest multiple of ALIGNMENT greater than or equal to size."""
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def to_dtype(descr):
+    """Numpy dtype of a description read from the JSON header.
+
+    Args:
+        descr (str or :obj:`list`): The description of the dtype, as returned
+            by numpy.lib.format.dtype_to_descr, with lists instead of tuples.
+
+    Returns:
+        (:obj:`numpy.dtype`): The dtype.
+
+    """
+    if isinstance(descr, list):
+        return np.dtype([tuple(field) for field in descr])
+    return np.dtype(descr)
+
+
+def file_sha256(path):
+    """SHA-256 of the bytes of a file."""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def write(sources, out_filename, ban_version=None):
+    """Pack the files of the tables in a single file.
+
+    The file is written next to out_filename and then renamed, so that a
+    packed database is never partially written.
+
+    Args:
+        sources (:obj:`dict` of str): The path to the file of each table.
+        out_filename (str): The path to the packed database.
+        ban_version (str, optional): The version of the BAN files the tables
+            were built from.
+
+    Returns:
+        (:obj:`dict`): The header of the packed database.
+
+    Raises:
+        CorruptDatabase: If the size of a file is not a multiple of the size
+            of the records of its table.
+
+    """
+    tables, size = {}, 0
+    for table, path in sources.items():
+        dtype = np.dtype(dtypes[table])
+        nbytes = os.path.getsize(path)
+        if nbytes % dtype.itemsize:
+            raise CorruptDatabase(f"{path} does not hold a whole number of {table} records")
+        tables[table] = {'dtype': np.lib.format.dtype_to_descr(dtype), 'offset': size,
+                         'count': nbytes // dtype.itemsize, 'sha256': file_sha256(path)}
+        size = align(size + nbytes)
+
+    header = {'schema': SCHEMA_VERSION, 'ban_version': ban_version, 'tables': tables}
+    encoded = json.dumps(header, sort_keys=True).encode('utf-8')
+    start = align(HEADER.size + len(encoded))
+    with open(out_filename + '.tmp', 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(encoded)))
+        f.write(encoded)
+        for table, path in sources.items():
+            f.seek(start + tables[table]['offset'])
+            with open(path, 'rb') as source:
+                shutil.copyfileobj(source, f, CHUNK_SIZE)
+        f.truncate(start + size)
+    os.replace(out_filename + '.tmp', out_filename)
+    return header
+
+
+def read_header(mapping):
+    """Header of a packed database.
+
+    Args:
+        mapping (:obj:`mmap.mmap`): The packed database.
+
+    Returns:
+        (:obj:`tuple`)
+        (header (:obj:`dict`): The header,
+         start (int): The position of the tables in the file)
+
+    Raises:
+        CorruptDatabase: If the file is not a packed database.
+
+    """
+    if len(mapping) < HEADER.size:
+        raise CorruptDatabase('The packed database is truncated')
+    magic, length = HEADER.unpack_from(mapping, 0)
+    if magic != MAGIC:
+        raise CorruptDatabase('The file is not a packed database')
+    try:
+        header = json.loads(mapping[HEADER.size:HEADER.size + length].decode('utf-8'))
+    except ValueError:
+        raise CorruptDatabase('The header of the packed database is corrupted')
+    return header, align(HEADER.size + length)
+
+
+def load(path, verify=VERIFY_DB):
+    """Map a packed database, checking it.
+
+    Args:
+        path (str): The path to the packed database.
+        verify (bool, optional): Whether to verify the checksums of the
+            tables, VERIFY_DB by default.
+
+    Returns:
+        (:obj:`tuple`)
+        (header (:obj:`dict`): The header of the packed database,
+         tables (:obj:`dict` of :obj:`numpy.ndarray`): Each table, a read only
+            view of a single mmap of the file)
+
+    Raises:
+        CorruptDatabase: If the file is truncated, altered or of another
+            schema.
+
+    """
+    with open(path, 'rb') as f:
+        try:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise CorruptDatabase(f"{path} is empty")
+    header, start = read_header(mapping)
+    if header.get('schema') != SCHEMA_VERSION:
+        raise CorruptDatabase(f"{path} has the schema {header.get('schema')} instead of {SCHEMA_VERSION}: "
+                              f"build the database again")
+
+    tables = {}
+    with memoryview(mapping) as view:
+        for table, spec in header['tables'].items():
+            dtype = to_dtype(spec['dtype'])
+            if table in dtypes and dtype != np.dtype(dtypes[table]):
+                raise CorruptDatabase(f"The {table} table of {path} has the dtype {dtype}")
+            begin = start + spec['offset']
+            end = begin + spec['count'] * dtype.itemsize
+            if end > len(mapping):
+                raise CorruptDatabase(f"The {table} table of {path} is truncated")
+            if verify and hashlib.sha256(view[begin:end]).hexdigest() != spec['sha256']:
+                raise CorruptDatabase(f"The {table} table of {path} is corrupted")
+            tables[table] = np.frombuffer(mapping, dtype=dtype, count=spec['count'], offset=begin)
+    return header, tables
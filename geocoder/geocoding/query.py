@@ -1,43 +1,270 @@
 # -*- coding: utf-8 -*-
 """Interface to query for data.
 
-This module defines the query methods for each table in the database.
+This module defines the query methods for each table in the database. The
+database is mapped on first access to data or limits rather than at import
+time, so that importing the package stays fast.
 
 Attributes:
-    data (:obj:`dict` of :obj:`numpy.ndarray`): The database is formed by numpy
-        arrays. Each of them is identified by a name and accessible by this
-        dictionary with data[name].
-    limits (:obj:`dict` of :obj:`tuple` of int): limits[table] stores the
+    data (:obj:`Handle` of :obj:`numpy.ndarray`): The database is formed by
+        numpy arrays. Each of them is identified by a name and accessible by
+        this mapping with data[name]. The tables with byte string fields are
+        wrapped in a compact.Table, which reads them as str.
+    limits (:obj:`Handle` of :obj:`tuple` of int): limits[table] stores the
         limits of the numpy array called table.
+    VECTORIZED_MIN (int): The number of records above which the similarity
+        scores are computed all at once with numpy.
+    RELOAD_INTERVAL (float): The number of seconds between two checks of the
+        published version of the database by the thread started with watch
+        (RELOAD_INTERVAL environment variable, 30 by default).
 
 """
 import os
+import threading
+from collections.abc import Mapping
+from contextlib import contextmanager
+from contextvars import ContextVar
 
 import kdquery
 import numpy as np
+from botocore.exceptions import ClientError
 from loguru import logger
 
-from geocoder.geocoding import distance, utils, s3, LOCAL_DB
-from geocoder.geocoding.datapaths import paths
+from geocoder.geocoding import compact, distance, fetch, packed, remote, spatial, utils, s3, LOCAL_DB
+from geocoder.geocoding.datapaths import current_path, packed_path, paths
 from geocoder.geocoding.datatypes import dtypes
-from geocoder.geocoding.similarity import Similarity
+from geocoder.geocoding.similarity import NGRAMS, Similarity, ngram_id
 
-data = {}
-limits = {}
+VECTORIZED_MIN = 8
+RELOAD_INTERVAL = float(os.environ.get("RELOAD_INTERVAL", 30))
+
+
+class Database:
+    """A version of the database.
+
+    Args:
+        tables (:obj:`dict` of :obj:`numpy.ndarray`): The tables.
+        version (str, optional): The name of the version, None for the files
+            of the tables.
+
+    """
+
+    def __init__(self, tables, version=None):
+        self.version = version
+        self.tables = {}
+        self.limits = {}
+        for table, values in tables.items():
+            self.tables[table] = compact.Table(values) if compact.is_compact(values.dtype) else values
+            self.limits[table] = (0, len(values))
+
+
+class Handle(Mapping):
+    """The tables, or their limits, of the version of the database in use.
+
+    A search pinned with pinned reads the version it started with until it
+    ends, and any other code the last loaded version.
+
+    Args:
+        attribute (str): The attribute of the Database to read, tables or
+            limits.
+
+    """
+
+    def __init__(self, attribute):
+        self.attribute = attribute
+
+    def __getitem__(self, key):
+        return getattr(current(), self.attribute)[key]
+
+    def __iter__(self):
+        return iter(getattr(current(), self.attribute))
+
+    def __len__(self):
+        return len(getattr(current(), self.attribute))
+
+
+database = None
+pinned_database = ContextVar('pinned_database', default=None)
+reload_lock = threading.Lock()
+watcher = {}
+
+data = Handle('tables')
+limits = Handle('limits')
+
+
+def current():
+    """The version of the database in use: the pinned one, if any, and the
+    last loaded one otherwise, loaded with setup on first use.
+    """
+    pinned_version = pinned_database.get()
+    if pinned_version is not None:
+        return pinned_version
+    if database is None:
+        setup()
+    return database
+
+
+@contextmanager
+def pinned():
+    """Read the same version of the database until the end of the block.
+
+    The version loaded meanwhile by reload is only read by the searches
+    started after it, and the mapping of the previous one is released with
+    the last search reading it. Also usable as a decorator.
+    """
+    token = pinned_database.set(current())
+    try:
+        yield
+    finally:
+        pinned_database.reset(token)
 
 
 def setup():
-    """Initialize the module level variables.
+    """Initialize the module level variables, if not done yet.
+
+    The tables are mapped from the published version of the database when
+    there is one, and from the file of each table otherwise.
+
+    Raises:
+        packed.CorruptDatabase: If the packed database is truncated, altered
+            or of another schema.
+
     """
-    if not data or not limits:
+    global database
+    with reload_lock:
+        if database is not None:
+            return
+        logger.info('Loading geocoding data')
+        version = published_version()
+        new_database = load_version(version) if version is not None else Database(load_tables())
         for table in paths:
-            if not LOCAL_DB:
-                s3.download_file('geocoder', f"database/{table}.dat", paths[table])
-            if os.path.isfile(paths[table]):
-                data[table] = np.memmap(paths[table], dtypes[table])
-                limits[table] = (0, len(data[table]))
-            else:
+            if table not in new_database.tables:
                 logger.info(f"Missing database {table}; geocoder will likely error")
+        database = new_database
+
+
+def reload(prepare=None):
+    """Switch to the published version of the database, if it changed.
+
+    The searches in progress carry on with the version they started with.
+
+    Args:
+        prepare (callable, optional): Called with the new version of the
+            database before switching to it, to warm it up for instance.
+
+    Returns:
+        bool: True if another version was loaded.
+
+    Raises:
+        packed.CorruptDatabase: If the packed database of the published
+            version is truncated, altered or of another schema, in which case
+            the version in use is kept.
+
+    """
+    global database
+    with reload_lock:
+        version = published_version()
+        if version is None or (database is not None and version == database.version):
+            return False
+        new_database = load_version(version)
+        if prepare is not None:
+            prepare(new_database)
+        database = new_database
+        logger.info(f"Switched to the version {version} of the database")
+        return True
+
+
+def watch(interval=RELOAD_INTERVAL, prepare=None):
+    """Reload the database every interval seconds, in a background thread.
+
+    The thread is started once per process, so that it is also started in
+    the workers forked after it.
+
+    Args:
+        interval (float, optional): The number of seconds between two checks,
+            RELOAD_INTERVAL by default. The thread is not started if it is
+            not positive.
+        prepare (callable, optional): Called with each new version of the
+            database before switching to it.
+
+    """
+    if interval <= 0 or watcher.get('pid') == os.getpid():
+        return
+    watcher['pid'] = os.getpid()
+
+    def run():
+        while not watcher['stop'].wait(interval):
+            try:
+                reload(prepare)
+            except (packed.CorruptDatabase, OSError, ClientError) as e:
+                logger.error(f"Impossible to reload the database: {e}")
+
+    watcher['stop'] = threading.Event()
+    threading.Thread(target=run, name='database-watcher', daemon=True).start()
+
+
+def published_version():
+    """Name of the published version of the database.
+
+    Returns:
+        str: The name of the version, None if no version was published.
+
+    """
+    if not LOCAL_DB:
+        try:
+            s3.download_file('geocoder', f"database/{os.path.basename(current_path)}", current_path)
+        except ClientError:
+            return None
+    try:
+        with open(current_path, 'r') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def load_version(version):
+    """Map the packed database of a version.
+
+    On S3, it is fetched through the cache of the host, whose versions older
+    than the last fetch.KEEP_VERSIONS ones are then removed, or read block by
+    block with remote.REMOTE_DB.
+
+    Args:
+        version (str): The name of the version.
+
+    Returns:
+        (:obj:`Database`): The version of the database.
+
+    """
+    path = packed_path(version)
+    key = f"database/versions/{version}/{os.path.basename(path)}"
+    if not LOCAL_DB and remote.REMOTE_DB:
+        header, tables = remote.load(key)
+    else:
+        if not LOCAL_DB:
+            path = fetch.fetch(key)
+            fetch.remove_old_versions()
+        header, tables = packed.load(path)
+    logger.debug(f"Version {version} of the database, from BAN version {header['ban_version']}")
+    return Database(tables, version)
+
+
+def load_tables():
+    """Map the file of each table of the database.
+
+    On S3, the files are fetched in parallel through the cache of the host,
+    or read block by block with remote.REMOTE_DB.
+
+    Returns:
+        (:obj:`dict` of :obj:`numpy.memmap`): The tables whose file exists.
+
+    """
+    if not LOCAL_DB and remote.REMOTE_DB:
+        return {table: remote.table(f"database/{table}.dat", dtypes[table]) for table in paths}
+    files = dict(paths)
+    if not LOCAL_DB:
+        files = dict(zip(paths, fetch.fetch_all([f"database/{table}.dat" for table in paths])))
+    return {table: np.memmap(path, dtypes[table], mode="r") for table, path in files.items() if os.path.isfile(path)}
 
 
 def select(table, column, start, end, element):
@@ -62,7 +289,110 @@ def select(table, column, start, end, element):
     return pos, found
 
 
-def heuristics(table, column, narrow, wide, element):
+def lookup(table, *parts):
+    """Search the range of records with the given key in a hash table.
+
+    Args:
+        table (str): The name of the hash table.
+        parts (:obj:`tuple`): The values forming the key.
+
+    Returns:
+        (:obj:`tuple`)
+        (start (int): The first index of the range,
+         end (int): The last index of the range, excluded)
+        or None if the key is not in the table (or if the table is missing).
+
+    """
+    if table not in data:
+        return None
+    keys = data[table]['key']
+    mask = len(keys) - 1
+    key = utils.hash64(*parts)
+    slot = key & mask
+    while keys[slot]:
+        if keys[slot] == key:
+            return int(data[table]['start'][slot]), int(data[table]['end'][slot])
+        slot = (slot + 1) & mask
+    return None
+
+
+def select_batch(table, column, start, end, elements):
+    """Vectorized version of select for several elements in the same range.
+
+    Args:
+        table (str): The name of the numpy array.
+        column (str): The field to consider.
+        start (int): The bottom limit index to look in the table.
+        end (int): The top limit index to look in the table.
+        elements (:obj:`list` of str or int): The elements to search for.
+
+    Returns:
+        (:obj:`tuple`)
+        (pos (:obj:`numpy.ndarray` of int): the position of each record in
+            the table,
+         found (:obj:`numpy.ndarray` of bool): true where the search was
+            succeeded)
+
+    """
+    values = data[table][column][start:end]
+    elements = np.asarray(elements)
+    pos = np.searchsorted(values, elements)
+    found = np.zeros(len(pos), dtype=bool)
+    inside = pos < len(values)
+    found[inside] = values[pos[inside]] == elements[inside]
+    return pos + start, found
+
+
+def similarity_to(table, column, element):
+    """Similarity to element of the records of table.
+
+    The records are scored by index with their stored n-gram signatures when
+    the column is the normalised name and the signatures are in the database,
+    and from the value of the column otherwise.
+
+    Args:
+        table (str): The name of the numpy array.
+        column (str): The field to consider.
+        element (str): The element to compare with.
+
+    Returns:
+        similarity (:obj:`Similarity`): The similarity to element.
+
+    """
+    ngram = table + '_ngram'
+    if column == 'normalise' and ngram in data and ngram + '_id' in data:
+        return Similarity(element, (data[ngram], data[ngram + '_id']))
+    return Similarity(element)
+
+
+def most_similar(table, column, indices, similarity):
+    """Find the record of table with greatest score of similarity.
+
+    Same result as utils.most_similar. With the n-gram signatures, the
+    scores of more than VECTORIZED_MIN indices are computed all at once.
+
+    Args:
+        table (str): The name of the numpy array.
+        column (str): The field to consider.
+        indices (:obj:`range` or :obj:`list` of int): The records to score.
+        similarity (:obj:`Similarity`): The similarity returned by
+            similarity_to.
+
+    Returns:
+        (:obj:`tuple`)
+        (score (float): The greatest score,
+         rang (int): The position of the record in indices,
+         index (int): The index of the record in the table)
+
+    """
+    if similarity.signatures is None:
+        return utils.most_similar(indices, data[table][column], similarity.score)
+    if len(indices) > VECTORIZED_MIN:
+        return utils.best_score(similarity.scores(indices), indices)
+    return utils.most_similar(indices, None, similarity.score_id)
+
+
+def heuristics(table, column, narrow, wide, element, commune_id=None):
     """Search record on table with field column the most similar to element.
 
     Args:
@@ -85,6 +415,9 @@ def heuristics(table, column, narrow, wide, element):
             third element (float): The threshold for the similarity score in
                 the wide search.
         element (str): The element to search for.
+        commune_id (int, optional): The commune of the voies searched. When
+            given, the wide search only scores the voies sharing enough
+            bigrams with element to reach its threshold.
 
     Returns:
         (:obj:`tuple`)
@@ -93,24 +426,63 @@ def heuristics(table, column, narrow, wide, element):
 
     """
     # Similarity function
-    similarity = Similarity(element).score
+    similarity = similarity_to(table, column, element)
 
     # Narrow search
     indices = range(narrow[0], narrow[1])
     score, rang, element_id = \
-        utils.most_similar(indices, data[table][column], similarity)
+        most_similar(table, column, indices, similarity)
     found = (score is not None and score >= narrow[2])
 
     # Wide search
     if not found and wide is not None:
         indices = range(wide[0], wide[1])
+        if commune_id is not None:
+            indices = voie_candidates(commune_id, wide, similarity)
         score, rang, element_id = \
-            utils.most_similar(indices, data[table][column], similarity)
+            most_similar(table, column, indices, similarity)
         found = (score is not None and score >= wide[2])
 
     return element_id, found
 
 
+def voie_candidates(commune_id, wide, similarity):
+    """Voies of a commune that can reach the threshold of the wide search.
+
+    The score of a voie is at most (2 * b + u) / s, where b is the number of
+    bigrams it shares with the query, u the number of unigrams of the query
+    and s the score of the set of uni and bigrams of the query. The voies
+    whose bound is under the threshold are skipped using the voie_bigram
+    inverted index; the order of the others is kept so that the most similar
+    voie is the same as without pruning.
+
+    Args:
+        commune_id (int): The index of the commune.
+        wide (:obj:`tuple`): The bottom and top limits of the voies of the
+            commune and the threshold of the wide search.
+        similarity (:obj:`Similarity`): The similarity to the query.
+
+    Returns:
+        (:obj:`list` of int): The indices of the voies to score.
+
+    """
+    start, end, threshold = wide
+    unigrams = sum(1 for gram in similarity.slice_set if len(gram) == 1)
+    needed = threshold * similarity.slice_set_score - unigrams - 1e-9
+    if 'voie_bigram' not in data or len(data['voie_bigram']) == 0 or needed <= 0:
+        return range(start, end)
+
+    grams = {ngram_id(gram) for gram in similarity.slice_set if len(gram) == 2} - {None}
+    keys = np.array([commune_id * NGRAMS + gram for gram in grams], dtype='int64')
+    last = len(data['voie_bigram']) - 1
+    groups = data['voie_bigram'][np.searchsorted(data['voie_bigram']['key'], keys).clip(max=last)]
+    groups = groups[groups['key'] == keys]
+    postings = [data['voie_bigram_posting'][group['start']:group['end']] for group in groups]
+    shared = np.bincount(np.concatenate(postings) - start, minlength=end - start) if postings \
+        else np.zeros(end - start, dtype='int64')
+    return np.flatnonzero(2 * shared >= needed) + start
+
+
 def select_departement(dpt_code):
     """Select record on department table with field code equals to dpt_code.
 
@@ -162,6 +534,44 @@ def select_code_postal(code_postal):
     return postal_id if found else None
 
 
+def select_code_postal_batch(codes_postaux):
+    """Vectorized version of select_code_postal.
+
+    Exact matches are resolved with a single searchsorted over the sorted
+    postal codes; the remaining codes fall back to select_code_postal.
+
+    Args:
+        codes_postaux (:obj:`list` of int): The postal codes, None allowed.
+
+    Returns:
+        (:obj:`list` of int): The index of the record of each postal code if
+            the search was succeeded, None otherwise.
+
+    """
+    postal_ids = [None] * len(codes_postaux)
+    # Codes that do not fit in the int32 column are left to the scalar search
+    known = [i for i, code in enumerate(codes_postaux)
+             if code is not None and abs(code) < 2 ** 31]
+    for i in set(range(len(codes_postaux))) - set(known):
+        postal_ids[i] = select_code_postal(codes_postaux[i])
+    if not known:
+        return postal_ids
+
+    codes = np.array([codes_postaux[i] for i in known], dtype='int64')
+    sorted_codes = data['postal']['code'][data['postal_index']]
+    pos = np.searchsorted(sorted_codes, codes)
+    inside = pos < len(sorted_codes)
+    found = np.zeros(len(pos), dtype=bool)
+    found[inside] = sorted_codes[pos[inside]] == codes[inside]
+
+    for i, row in enumerate(known):
+        if found[i]:
+            postal_ids[row] = data['postal_index'][pos[i]]
+        else:
+            postal_ids[row] = select_code_postal(codes_postaux[row])
+    return postal_ids
+
+
 def select_commune(postal_id, commune):
     """Select record on commune table with field normalize equals to commune or
     sufficiently similar.
@@ -218,6 +628,13 @@ def complete_commune_selection(commune):
     if commune is None:
         return None
 
+    # Hash table search
+    exact = lookup('commune_hash', commune)
+    if exact is not None:
+        commune_id = data['commune_index'][exact[0]]
+        if data['commune']['normalise'][commune_id] == commune:
+            return commune_id
+
     # Binary search with index list, because the commune table is not
     # entirely sorted.
     i, commune_id = utils.search(commune,
@@ -229,11 +646,10 @@ def complete_commune_selection(commune):
     # Heuristics
     if not found:
         start, end = limits['commune_index']
-        similarity = Similarity(commune).score
+        similarity = similarity_to('commune', 'normalise', commune)
         indices = data['commune_index'][max(start, i - 2): min(end, i + 2)]
         score, rang, commune_id = \
-            utils.most_similar(indices, data['commune']['normalise'],
-                               similarity)
+            most_similar('commune', 'normalise', indices, similarity)
         found = (score is not None and score >= 0.7)
 
     return commune_id if found else None
@@ -255,6 +671,11 @@ def select_voie(commune_id, voie, voie_type):
     if commune_id is None or voie is None:
         return None
 
+    # Hash table search
+    exact = lookup('commune_voie_hash', commune_id, voie)
+    if exact is not None and data['voie']['normalise'][exact[0]] == voie:
+        return exact[0]
+
     # Binary search
     ref_element = data['commune'][commune_id]
     start, end = ref_element['start'], ref_element['end']
@@ -264,10 +685,10 @@ def select_voie(commune_id, voie, voie_type):
     if not found:
         start_type, end_type = voie_id - 1, voie_id
         if voie_type is not None:
-            while data['voie']['normalise'][start_type].startswith(voie_type):
+            while start_type >= 0 and data['voie']['normalise'][start_type].startswith(voie_type):
                 start_type -= 1
             start_type += 1
-            while data['voie']['normalise'][end_type].startswith(voie_type):
+            while end_type < len(data['voie']) and data['voie']['normalise'][end_type].startswith(voie_type):
                 end_type += 1
 
         if end_type - start_type > 1:
@@ -279,11 +700,47 @@ def select_voie(commune_id, voie, voie_type):
         narrow = (narrow_start, narrow_end, 0.6)
         wide = (start, end, 0.4)
 
-        voie_id, found = heuristics('voie', 'normalise', narrow, wide, voie)
+        voie_id, found = heuristics('voie', 'normalise', narrow, wide, voie,
+                                    commune_id)
 
     return voie_id if found else None
 
 
+def search_voie_index(voie):
+    """Search voie in the entire voie table through the voie_index table.
+
+    Args:
+        voie (str): The street name.
+
+    Returns:
+        (:obj:`tuple`)
+        (i (int): The position of the result in the voie_index table,
+         j (int): The end of the range of names equal to voie in the
+            voie_index table (equal to i if voie was not found),
+         voie_id (int): The index of the result in the voie table)
+
+    """
+    # Hash table search
+    exact = lookup('voie_hash', voie)
+    if exact is not None:
+        voie_id = data['voie_index'][exact[0]]
+        if data['voie']['normalise'][voie_id] == voie:
+            return exact[0], exact[1], voie_id
+
+    # Binary search with index list, because the voie table is not entirely
+    # sorted.
+    i, voie_id = utils.search(voie, data['voie_index'],
+                              data['voie']['normalise'],
+                              sorted=False)
+
+    # If the search was successful, find the greatest interval of equality
+    j = i
+    if data['voie']['normalise'][voie_id] == voie:
+        while data['voie']['normalise'][data['voie_index'][j]] == voie:
+            j += 1
+    return i, j, voie_id
+
+
 def complete_voie_selection(code_postal, commune, voie):
     """Select record on voie table with field normalise most similar to voie.
 
@@ -306,10 +763,7 @@ def complete_voie_selection(code_postal, commune, voie):
     if voie is None:
         return None
 
-    # Binary search
-    i, voie_id = utils.search(voie, data['voie_index'],
-                              data['voie']['normalise'],
-                              sorted=False)
+    i, j, voie_id = search_voie_index(voie)
 
     # If the search was successful and there is no code_postal or commune
     # to continue, we finish.
@@ -318,10 +772,6 @@ def complete_voie_selection(code_postal, commune, voie):
 
     # Indices of voie table to consider in the heuristics step
     if data['voie']['normalise'][voie_id] == voie:
-        # If the search was successful, find the greatest interval of equality
-        j = i
-        while data['voie']['normalise'][data['voie_index'][j]] == voie:
-            j += 1
         voie_indices = data['voie_index'][i: j]
     else:
         # If the search wasn't successful, pick some near indices from the
@@ -333,10 +783,9 @@ def complete_voie_selection(code_postal, commune, voie):
 
     # First heuristics: apply similarity to commune
     if commune is not None:
-        similarity = Similarity(commune).score
+        similarity = similarity_to('commune', 'normalise', commune)
         score, rang, commune_id = \
-            utils.most_similar(commune_indices, data['commune']['normalise'],
-                               similarity)
+            most_similar('commune', 'normalise', commune_indices, similarity)
         voie_id = voie_indices[rang]
         if score is not None and score >= 0.7:
             return voie_id
@@ -432,3 +881,66 @@ def nearest_point_from(query):
 
     """
     return kdquery.nearest_point(query, 0, get_properties, distance.spherical)
+
+
+def nearest_localisation_from(query):
+    """Find the nearest address to a given query with the spatial index.
+
+    Args:
+        query (:obj:`tuple` of float): Longitude and latitude of the position
+            in this order.
+
+    Returns:
+        (:obj:`tuple`)
+        (localisation_id (int): Index of the nearest address in the
+            localisation table, None if the spatial index is not in the
+            database,
+         dist (float): The distance between the query and the nearest address)
+
+    """
+    if 'spatial_node' not in data or 'spatial_point' not in data:
+        return None, None
+    return spatial.nearest(data['spatial_node'], data['spatial_point'], query)
+
+
+def nearest_localisations_from(longitudes, latitudes):
+    """Find the nearest address to each of many positions with the spatial
+    index.
+
+    Args:
+        longitudes (:obj:`numpy.ndarray` of float): The longitudes.
+        latitudes (:obj:`numpy.ndarray` of float): The latitudes.
+
+    Returns:
+        (:obj:`tuple`)
+        (localisation_ids (:obj:`numpy.ndarray` of int): Index of the nearest
+            address of each position in the localisation table, -1 if the
+            position is not a number, None if the spatial index is not in the
+            database,
+         dists (:obj:`numpy.ndarray` of float): The distances between the
+            positions and the nearest addresses)
+
+    """
+    if 'spatial_node' not in data or 'spatial_point' not in data:
+        return None, None
+    return spatial.nearest_batch(data['spatial_node'], data['spatial_point'],
+                                 longitudes, latitudes)
+
+
+def spatial_search(function, *args):
+    """Call a search function of the spatial module on the spatial index.
+
+    Args:
+        function (:obj:`function`): The function, taking the nodes and points
+            of the kd-tree as first arguments.
+        args: The other arguments of the function.
+
+    Returns:
+        The result of the function, None if the spatial index is not in the
+        database.
+
+    """
+    if 'spatial_node' not in data or 'spatial_point' not in data:
+        logger.error('Spatial index not found - execute: geocoder reverse')
+        return None
+    return function(data['spatial_node'], data['spatial_point'], *args)
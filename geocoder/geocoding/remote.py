@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""Tables read from S3 block by block.
+
+With REMOTE_DB, the tables of the database are not downloaded before serving:
+each one is a RemoteArray, which reads the records it is asked for with
+ranged GETs of the blocks holding them. The blocks are kept in a bounded
+cache shared by all the tables, which evicts the least recently used ones, so
+that a cold node serves at once and only downloads the pages its searches
+touch.
+
+Since the tables are not read in full, their checksums are not verified; the
+header of the packed database, its schema and the dtypes of the tables are.
+
+Attributes:
+    REMOTE_DB (bool): Whether the tables are read from S3 block by block
+        instead of downloaded, when LOCAL_DB is false (REMOTE_DB environment
+        variable, false by default).
+    BLOCK_SIZE (int): The size of the blocks (REMOTE_BLOCK_SIZE environment
+        variable, 1 MB by default).
+    CACHE_SIZE (int): The greatest number of bytes of the cached blocks
+        (REMOTE_CACHE_SIZE environment variable, 256 MB by default).
+    cache (:obj:`BlockCache`): The cache of the blocks.
+
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from geocoder.geocoding import packed, s3
+from geocoder.geocoding.datatypes import SCHEMA_VERSION, dtypes
+
+REMOTE_DB = (os.getenv("REMOTE_DB", 'False').lower() in ('true', '1', 't'))
+BLOCK_SIZE = int(os.environ.get("REMOTE_BLOCK_SIZE", 1 << 20))
+CACHE_SIZE = int(os.environ.get("REMOTE_CACHE_SIZE", 256 << 20))
+
+
+class BlockCache:
+    """Bounded cache of blocks, evicting the least recently used ones.
+
+    Args:
+        capacity (int): The greatest number of bytes of the cached blocks.
+
+    """
+
+    def __init__(self, capacity=CACHE_SIZE):
+        self.capacity = capacity
+        self.blocks = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """The block of a key, None if it is not cached."""
+        with self.lock:
+            block = self.blocks.get(key)
+            if block is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.blocks.move_to_end(key)
+            return block
+
+    def put(self, key, block):
+        """Cache a block, evicting the least recently used ones beyond the
+        capacity.
+        """
+        with self.lock:
+            if key in self.blocks:
+                return
+            self.blocks[key] = block
+            self.size += len(block)
+            while self.size > self.capacity and self.blocks:
+                self.size -= len(self.blocks.popitem(last=False)[1])
+
+    def clear(self):
+        """Empty the cache and reset its counters."""
+        with self.lock:
+            self.blocks.clear()
+            self.size = self.hits = self.misses = 0
+
+    def metrics(self):
+        """Size and hit ratio of the cache.
+
+        Returns:
+            (:obj:`dict`): The capacity and size of the cache in bytes, its
+            number of blocks, its numbers of hits and misses and its hit
+            ratio (None before the first read).
+
+        """
+        with self.lock:
+            reads = self.hits + self.misses
+            return {'capacity': self.capacity, 'size': self.size, 'blocks': len(self.blocks),
+                    'hits': self.hits, 'misses': self.misses, 'hit_ratio': self.hits / reads if reads else None}
+
+
+cache = BlockCache()
+
+
+class RemoteFile:
+    """An object of the geocoder bucket, read block by block.
+
+    Args:
+        key (str): The key of the object.
+        client (optional): The S3 client, geocoding.s3 by default.
+        block_size (int, optional): The size of the blocks, BLOCK_SIZE by
+            default.
+
+    """
+
+    def __init__(self, key, client=None, block_size=BLOCK_SIZE):
+        self.key = key
+        self.client = s3 if client is None else client
+        self.block_size = block_size
+        head = self.client.head_object(Bucket='geocoder', Key=key)
+        self.size = head['ContentLength']
+        self.etag = head['ETag']
+
+    def get(self, first, last):
+        """Download blocks first to last (included) with a single ranged GET,
+        and cache them.
+        """
+        begin, end = first * self.block_size, min((last + 1) * self.block_size, self.size)
+        body = self.client.get_object(Bucket='geocoder', Key=self.key, IfMatch=self.etag,
+                                      Range=f"bytes={begin}-{end - 1}")['Body'].read()
+        if len(body) != end - begin:
+            raise packed.CorruptDatabase(f"{self.key} was truncated while being read")
+        blocks = [body[i:i + self.block_size] for i in range(0, len(body), self.block_size)]
+        for block, index in zip(blocks, range(first, last + 1)):
+            cache.put((self.key, self.etag, index), block)
+        return blocks
+
+    def read(self, offset, length):
+        """Read bytes, downloading the blocks which are not cached.
+
+        Args:
+            offset (int): The position of the first byte.
+            length (int): The number of bytes.
+
+        Returns:
+            bytes: The bytes.
+
+        """
+        if length <= 0:
+            return b''
+        first, last = offset // self.block_size, (offset + length - 1) // self.block_size
+        blocks, missing = [], []
+        for index in range(first, last + 1):
+            block = cache.get((self.key, self.etag, index))
+            if block is None and missing and missing[-1][1] == index - 1:
+                missing[-1][1] = index
+            elif block is None:
+                missing.append([index, index])
+            blocks.append(block)
+        for start, stop in missing:  # consecutive missing blocks are downloaded together
+            blocks[start - first:stop - first + 1] = self.get(start, stop)
+        data = b''.join(blocks)
+        begin = offset - first * self.block_size
+        return data[begin:begin + length]
+
+
+class RemoteArray:
+    """A table stored in a RemoteFile, read like a numpy array.
+
+    Integers, slices and arrays of indices read the records they select,
+    field names return a RemoteArray of the field, and np.asarray reads the
+    whole table.
+
+    Args:
+        file (:obj:`RemoteFile`): The file holding the table.
+        dtype (:obj:`numpy.dtype`): The type of the records.
+        offset (int): The position of the first record in the file.
+        count (int): The number of records.
+        field (str, optional): The field read, the whole records by default.
+
+    """
+
+    def __init__(self, file, dtype, offset, count, field=None):
+        self.file = file
+        self.records = np.dtype(dtype)
+        self.offset = offset
+        self.count = count
+        self.field = field
+        dtype = self.records if field is None else self.records[field]
+        self.dtype = dtype.base
+        self.shape = (count, ) + dtype.shape
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def nbytes(self):
+        return self.count * self.records.itemsize
+
+    def __len__(self):
+        return self.count
+
+    def select(self, records):
+        return records if self.field is None else records[self.field]
+
+    def read(self, start, stop):
+        """The records from start to stop, as a numpy array."""
+        size = self.records.itemsize
+        data = self.file.read(self.offset + start * size, (stop - start) * size)
+        return np.frombuffer(data, dtype=self.records)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return RemoteArray(self.file, self.records, self.offset, self.count, key)
+        if isinstance(key, (int, np.integer)):
+            index = int(key) + self.count if key < 0 else int(key)
+            if not 0 <= index < self.count:
+                raise IndexError(f"index {key} is out of bounds for size {self.count}")
+            return self.select(self.read(index, index + 1)[0])
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.count)
+            if step != 1:
+                return self.take(np.arange(start, stop, step))
+            return self.select(self.read(start, max(start, stop)))
+        return self.take(np.asarray(key))
+
+    def take(self, indices):
+        """The records at an array of indices, or of a boolean mask."""
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+        indices = np.where(indices < 0, indices + self.count, indices).astype('int64')
+        if indices.size and (indices.min() < 0 or indices.max() >= self.count):
+            raise IndexError(f"index out of bounds for size {self.count}")
+        unique, inverse = np.unique(indices, return_inverse=True)
+        # indices closer than a block are read together, with the records between them
+        runs = np.split(unique, np.flatnonzero(np.diff(unique) * self.records.itemsize > self.file.block_size) + 1)
+        records = np.concatenate([self.read(run[0], run[-1] + 1)[run - run[0]] for run in runs if len(run)] or
+                                 [np.empty(0, dtype=self.records)])
+        return self.select(records[inverse.reshape(indices.shape)])
+
+    def searchsorted(self, values, side='left', sorter=None):
+        """Indices where values would be inserted to keep the sorted table
+        sorted, by binary search on the records.
+        """
+        values = np.asarray(values)
+        positions = np.empty(values.shape, dtype='int64')
+        for position, value in np.ndenumerate(values):
+            low, high = 0, self.count
+            while low < high:
+                middle = (low + high) // 2
+                element = self[middle if sorter is None else int(sorter[middle])]
+                if element < value or (side == 'right' and element == value):
+                    low = middle + 1
+                else:
+                    high = middle
+            positions[position] = low
+        return positions if positions.ndim else int(positions)
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.select(self.read(0, self.count))
+        return values if dtype is None else values.astype(dtype)
+
+    def tolist(self):
+        return np.asarray(self).tolist()
+
+
+def load(key, client=None):
+    """Open a packed database of the geocoder bucket without downloading it.
+
+    Args:
+        key (str): The key of the packed database.
+        client (optional): The S3 client, geocoding.s3 by default.
+
+    Returns:
+        (:obj:`tuple`)
+        (header (:obj:`dict`): The header of the packed database,
+         tables (:obj:`dict` of :obj:`RemoteArray`): Each table)
+
+    Raises:
+        packed.CorruptDatabase: If the object is truncated or not a packed
+            database of the current schema.
+
+    """
+    file = RemoteFile(key, client)
+    if file.size < packed.HEADER.size:
+        raise packed.CorruptDatabase(f"{key} is truncated")
+    magic, length = packed.HEADER.unpack(file.read(0, packed.HEADER.size))
+    if magic != packed.MAGIC:
+        raise packed.CorruptDatabase(f"{key} is not a packed database")
+    try:
+        header = json.loads(file.read(packed.HEADER.size, length).decode('utf-8'))
+    except ValueError:
+        raise packed.CorruptDatabase(f"The header of {key} is corrupted")
+    if header.get('schema') != SCHEMA_VERSION:
+        raise packed.CorruptDatabase(f"{key} has the schema {header.get('schema')} instead of {SCHEMA_VERSION}")
+    start = packed.align(packed.HEADER.size + length)
+    tables = {}
+    for table, spec in header['tables'].items():
+        dtype = packed.to_dtype(spec['dtype'])
+        if table in dtypes and dtype != np.dtype(dtypes[table]):
+            raise packed.CorruptDatabase(f"The {table} table of {key} has the dtype {dtype}")
+        if start + spec['offset'] + spec['count'] * dtype.itemsize > file.size:
+            raise packed.CorruptDatabase(f"The {table} table of {key} is truncated")
+        tables[table] = RemoteArray(file, dtype, start + spec['offset'], spec['count'])
+    return header, tables
+
+
+def table(key, dtype, client=None):
+    """Open the file of a table of the geocoder bucket without downloading it.
+
+    Args:
+        key (str): The key of the file.
+        dtype (:obj:`numpy.dtype`): The type of the records of the table.
+        client (optional): The S3 client, geocoding.s3 by default.
+
+    Returns:
+        (:obj:`RemoteArray`): The table.
+
+    """
+    file = RemoteFile(key, client)
+    return RemoteArray(file, dtype, 0, file.size // np.dtype(dtype).itemsize)
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""Cache of the outputs of the position search.
+
+The same addresses are searched over and over (records of the same clients,
+retries, the same agencies), so the output of search.position is kept for
+each normalized input, as returned by search.preprocessing, in a bounded
+cache which evicts the least recently used outputs. The outputs are cached
+per version of the database, which is part of their key: while the searches
+pinned to the previous version end, both versions are cached side by side, and
+the outputs of the previous one are only evicted as the least recently used.
+The outputs of versions older than the newest one seen are not cached anymore.
+The versions are ordered by name, the time at which they were packed (see
+index.pack_database).
+
+With RESULT_CACHE_SHARED, the outputs are also kept in a SQLite database
+shared by the processes of the host (the workers of the API server), so that
+each worker benefits from the searches of the others. It holds the last
+RESULT_CACHE_SHARED_SIZE outputs, and is only a best effort: its errors are
+logged and the search goes on without it.
+
+Attributes:
+    RESULT_CACHE_SIZE (int): The number of outputs kept by each process
+        (RESULT_CACHE_SIZE environment variable, 10000 by default, 0 to
+        disable the cache).
+    RESULT_CACHE_SHARED (str): The path to the SQLite database shared by the
+        processes (RESULT_CACHE_SHARED environment variable, none by default).
+    RESULT_CACHE_SHARED_SIZE (int): The number of outputs kept in the shared
+        database (RESULT_CACHE_SHARED_SIZE environment variable, 1000000 by
+        default).
+    cache (:obj:`ResultCache`): The cache of the outputs.
+
+"""
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from loguru import logger
+
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", 10000))
+RESULT_CACHE_SHARED = os.environ.get("RESULT_CACHE_SHARED") or None
+RESULT_CACHE_SHARED_SIZE = int(os.environ.get("RESULT_CACHE_SHARED_SIZE", 1000000))
+
+
+class SharedTier:
+    """Outputs shared by the processes of the host in a SQLite database.
+
+    Each thread of each process has its own connection. The oldest outputs
+    are removed beyond the capacity, and those of the older versions of the
+    database when a newer version is used.
+
+    Args:
+        path (str): The path to the SQLite database.
+        capacity (int, optional): The number of outputs kept,
+            RESULT_CACHE_SHARED_SIZE by default.
+
+    """
+
+    def __init__(self, path, capacity=RESULT_CACHE_SHARED_SIZE):
+        self.path = path
+        self.capacity = capacity
+        self.local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.inserts = 0
+
+    def connection(self):
+        """The connection of the thread, opened on first use in each
+        process.
+        """
+        if getattr(self.local, 'pid', None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("CREATE TABLE IF NOT EXISTS results "
+                               "(key TEXT PRIMARY KEY, version TEXT, output TEXT)")
+            connection.execute("CREATE INDEX IF NOT EXISTS results_version ON results (version)")
+            self.local.connection, self.local.pid = connection, os.getpid()
+        return self.local.connection
+
+    def get(self, key):
+        """The output of an input, None if it is not cached."""
+        try:
+            row = self.connection().execute("SELECT output FROM results WHERE key = ?", (key, )).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Shared result cache unavailable: {e}")
+            return None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, version, output):
+        """Cache the output of an input, removing the oldest outputs beyond
+        the capacity from time to time.
+        """
+        try:
+            connection = self.connection()
+            connection.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (key, version, json.dumps(output)))
+            self.inserts += 1
+            if self.inserts % 1000 == 0:
+                connection.execute("DELETE FROM results WHERE rowid <= (SELECT MAX(rowid) FROM results) - ?",
+                                   (self.capacity, ))
+        except sqlite3.Error as e:
+            logger.warning(f"Shared result cache unavailable: {e}")
+
+    def clear(self, version):
+        """Remove the outputs of the versions of the database older than
+        version, and of the tables without version.
+        """
+        try:
+            self.connection().execute("DELETE FROM results WHERE version IS NULL OR version < ?", (version, ))
+        except sqlite3.Error as e:
+            logger.warning(f"Shared result cache unavailable: {e}")
+
+    def metrics(self):
+        """Hits and misses of the process in the shared database."""
+        reads = self.hits + self.misses
+        return {'path': self.path, 'capacity': self.capacity, 'hits': self.hits, 'misses': self.misses,
+                'hit_ratio': self.hits / reads if reads else None}
+
+
+class ResultCache:
+    """Bounded cache of the outputs of the position search, evicting the
+    least recently used ones, with an optional shared tier.
+
+    Args:
+        capacity (int, optional): The number of outputs kept,
+            RESULT_CACHE_SIZE by default.
+        shared (str, optional): The path to the SQLite database shared by
+            the processes, RESULT_CACHE_SHARED by default.
+
+    """
+
+    def __init__(self, capacity=RESULT_CACHE_SIZE, shared=RESULT_CACHE_SHARED):
+        self.capacity = capacity
+        self.shared = SharedTier(shared) if shared and capacity > 0 else None
+        self.outputs = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def newer(self, version):
+        """Whether version is newer than the newest version seen, in which
+        case it becomes the newest one.
+
+        The outputs of the older versions are left to the LRU eviction, and
+        those of the shared tier are removed by the caller, out of the lock.
+        """
+        if version is None or (self.version is not None and version <= self.version):
+            return False
+        self.version = version
+        return True
+
+    def get(self, version, key):
+        """The output of a normalized input.
+
+        Args:
+            version (str): The version of the database searched.
+            key (:obj:`tuple`): The normalized input.
+
+        Returns:
+            (:obj:`dict`): The output, None if it is not cached.
+
+        """
+        if self.capacity <= 0:
+            return None
+        with self.lock:
+            newer = self.newer(version)
+            output = self.outputs.get((version, key))
+            if output is not None:
+                self.hits += 1
+                self.outputs.move_to_end((version, key))
+                return output
+            self.misses += 1
+        if self.shared is not None:
+            if newer:
+                self.shared.clear(version)
+            output = self.shared.get(json.dumps([version, *key]))
+            if output is not None:
+                self.put(version, key, output, shared=False)
+        return output
+
+    def put(self, version, key, output, shared=True):
+        """Cache the output of a normalized input, unless it was searched in
+        a version older than the newest one seen.
+
+        Args:
+            version (str): The version of the database searched.
+            key (:obj:`tuple`): The normalized input.
+            output (:obj:`dict`): The output, not to be modified afterwards.
+            shared (bool, optional): Whether to cache it in the shared tier
+                too, True by default.
+
+        """
+        if self.capacity <= 0:
+            return
+        with self.lock:
+            newer = self.newer(version)
+            if version != self.version:
+                return
+            self.outputs[(version, key)] = output
+            self.outputs.move_to_end((version, key))
+            while len(self.outputs) > self.capacity:
+                self.outputs.popitem(last=False)
+        if self.shared is not None:
+            if newer:
+                self.shared.clear(version)
+            if shared:
+                self.shared.put(json.dumps([version, *key]), version, output)
+
+    def clear(self):
+        """Empty the cache, but not its shared tier, and reset its counters."""
+        with self.lock:
+            self.outputs.clear()
+            self.hits = self.misses = 0
+
+    def metrics(self):
+        """Size and hit ratio of the cache.
+
+        Returns:
+            (:obj:`dict`): The newest version seen, the capacity and the
+            number of outputs of the cache, its numbers of hits and misses, its hit ratio (None before
+            the first search) and the metrics of its shared tier, if any.
+
+        """
+        with self.lock:
+            reads = self.hits + self.misses
+            return {'version': self.version, 'capacity': self.capacity, 'size': len(self.outputs), 'hits': self.hits,
+                    'misses': self.misses, 'hit_ratio': self.hits / reads if reads else None,
+                    'shared': self.shared.metrics() if self.shared is not None else None}
+
+
+cache = ResultCache()
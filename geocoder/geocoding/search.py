@@ -2,9 +2,15 @@
 """Definition of the search methods.
 
 This module defines the logic of the two most relevant methods of this package:
-the position method and the reverse method.
+the position method and the reverse method. Each search reads a single version
+of the database, even if another one is loaded meanwhile (see query.pinned).
 """
-from geocoder.geocoding import result, normalize, query
+from collections import defaultdict
+
+import numpy as np
+
+from geocoder.geocoding import distance, result, result_cache, normalize, query, spatial
+from geocoder.geocoding.utils import SCALE
 
 
 def preprocessing(code_postal, commune, adresse):
@@ -49,9 +55,56 @@ def preprocessing(code_postal, commune, adresse):
     return code_postal, commune, numero, voie, voie_type
 
 
+def get_status(postal_id, commune_id, voie_id, localisation_id, numero):
+    """Pick the most precise record found and the quality of the result.
+
+    Args:
+        postal_id (int): The index of the postal code or None.
+        commune_id (int): The index of the city or None.
+        voie_id (int): The index of the street or None.
+        localisation_id (int): The index of the street number or None.
+        numero (int): The street number from the input or None.
+
+    Returns:
+        (:obj:`tuple`)
+        (status (:obj:`tuple`): The name of a table and the index of an
+            element in this table, None if nothing was found,
+         quality (int): The quality of the result)
+
+    """
+    if localisation_id is not None:
+        # Quality = 1 -> The search was successful.
+        status, quality = ('localisation', localisation_id), 1
+
+    elif voie_id is not None:
+        status = ('voie', voie_id)
+        # Quality = 2 -> The precise number was not found.
+        # Quality = 3 -> The precise number was not found and there was no
+        #                number in the input.
+        quality = 3 if numero is None else 2
+
+    elif commune_id is not None:
+        # Quality = 4 -> The street was not found.
+        status, quality = ('commune', commune_id), 4
+
+    elif postal_id is not None:
+        # Quality = 5 -> The commune was not found.
+        status, quality = ('postal', postal_id), 5
+
+    else:
+        # Quality = 6 -> Nothing was found.
+        status, quality = None, 6
+
+    return status, quality
+
+
+@query.pinned()
 def position(code_postal=None, commune=None, adresse=None):
     """Find the position over the surface of the Earth of the given address.
 
+    The outputs are cached by normalized input and version of the database
+    (see result_cache).
+
     Args:
         code_postal (str): The postal code.
         commune (str): The city name.
@@ -87,9 +140,29 @@ def position(code_postal=None, commune=None, adresse=None):
 
     """
     # Input preprocessing.
-    code_postal, commune, numero, voie, voie_type = \
-        preprocessing(code_postal, commune, adresse)
+    key = preprocessing(code_postal, commune, adresse)
+    version = query.current().version
+    output = result_cache.cache.get(version, key)
+    if output is None:
+        output = search_position(*key)
+        result_cache.cache.put(version, key, output)
+    return copy_output(output)
+
 
+def search_position(code_postal, commune, numero, voie, voie_type):
+    """Search the normalized input of the position method in the database.
+
+    Args:
+        code_postal (int): The postal code.
+        commune (str): The city name normalized.
+        numero (int): The street number.
+        voie (str): The street name normalized.
+        voie_type (str): The type of street.
+
+    Returns:
+        :obj:`dict`: The output of the position method.
+
+    """
     # Try to find postal code.
     postal_id = query.select_code_postal(code_postal)
 
@@ -107,32 +180,129 @@ def position(code_postal=None, commune=None, adresse=None):
     localisation_id = query.select_localisation(voie_id, numero)
 
     # Prepare the output.
-    if localisation_id is not None:
-        # Quality = 1 -> The search was successful.
-        status, quality = ('localisation', localisation_id), 1
+    status, quality = get_status(postal_id, commune_id, voie_id,
+                                 localisation_id, numero)
+    return result.get_output(status, quality)
 
-    elif voie_id is not None:
-        status = ('voie', voie_id)
-        # Quality = 2 -> The precise number was not found.
-        # Quality = 3 -> The precise number was not found and there was no
-        #                number in the input.
-        quality = 3 if numero is None else 2
 
-    elif commune_id is not None:
-        # Quality = 4 -> The street was not found.
-        status, quality = ('commune', commune_id), 4
+def map_unique(function, *columns):
+    """Apply function once per distinct row of the given columns.
 
-    elif postal_id is not None:
-        # Quality = 5 -> The commune was not found.
-        status, quality = ('postal', postal_id), 5
+    Args:
+        function (:obj:`function`): The function to apply, taking one argument
+            per column.
+        columns (:obj:`list`): Columns of the same length.
 
-    else:
-        # Quality = 6 -> Nothing was found.
-        status, quality = None, 6
+    Returns:
+        (:obj:`list`): The result of function for each row of the columns.
 
-    return result.get_output(status, quality)
+    """
+    cache = {}
+    output = []
+    for key in zip(*columns):
+        if key not in cache:
+            cache[key] = function(*key)
+        output.append(cache[key])
+    return output
+
+
+def select_voie_batch(commune_ids, voies, voie_types, codes_postaux, communes):
+    """Find the street of each row of a batch.
+
+    Exact matches are searched with one searchsorted per city over its range
+    of streets; the other rows go through the same cascade as position.
+
+    Returns:
+        (:obj:`list` of int): The index of the street of each row or None.
+
+    """
+    groups = defaultdict(set)
+    for commune_id, voie in zip(commune_ids, voies):
+        if commune_id is not None and voie is not None:
+            groups[commune_id].add(voie)
+
+    exact = {}
+    for commune_id, group in groups.items():
+        group = sorted(group)
+        record = query.data['commune'][commune_id]
+        pos, found = query.select_batch('voie', 'normalise', record['start'],
+                                        record['end'], group)
+        exact.update({(commune_id, voie): voie_id
+                      for voie, voie_id, ok in zip(group, pos, found) if ok})
+
+    def select(commune_id, voie, voie_type, code_postal, commune):
+        voie_id = exact.get((commune_id, voie))
+        if voie_id is None:
+            voie_id = query.select_voie(commune_id, voie, voie_type)
+        if voie_id is None:
+            voie_id = query.complete_voie_selection(code_postal, commune, voie)
+        return voie_id
+
+    return map_unique(select, commune_ids, voies, voie_types, codes_postaux,
+                      communes)
+
+
+def copy_output(output):
+    """Copy an output of result.get_output so that rows do not share dicts.
+    """
+    return {key: dict(value) if isinstance(value, dict) else value
+            for key, value in output.items()}
+
+
+@query.pinned()
+def position_batch(codes_postaux, communes, adresses):
+    """Vectorized version of position for whole columns of addresses.
 
+    The input is normalized once per distinct value, the postal codes are
+    resolved with a single searchsorted and the other steps run once per
+    distinct combination of their inputs.
 
+    Args:
+        codes_postaux (:obj:`list` of str): The postal codes.
+        communes (:obj:`list` of str): The city names.
+        adresses (:obj:`list` of str): Addresses with number and street name.
+
+    Returns:
+        (:obj:`list` of :obj:`dict`): The output of position for each row.
+
+    Example:
+        >>> from geocoder.geocoding import search
+        >>> search.position_batch(['91120'], ['Palaiseau'], ['12, Bd des Maréchaux'])
+
+    """
+    # Input preprocessing.
+    codes_postaux = map_unique(lambda c: preprocessing(c, None, None)[0], codes_postaux)
+    communes = normalize.uniform_commune_column(communes)
+    mined = normalize.mine_column(adresses)
+    numeros, voies, voie_types = zip(*mined) if mined else ((), (), ())
+
+    # Try to find postal codes.
+    distinct = list(dict.fromkeys(codes_postaux))
+    postal_ids = dict(zip(distinct, query.select_code_postal_batch(distinct)))
+    postal_ids = [postal_ids[code_postal] for code_postal in codes_postaux]
+
+    # Try to find cities.
+    def select_commune(postal_id, commune):
+        commune_id = query.select_commune(postal_id, commune)
+        if commune_id is None:
+            commune_id = query.complete_commune_selection(commune)
+        return commune_id
+
+    commune_ids = map_unique(select_commune, postal_ids, communes)
+
+    # Try to find streets and numbers.
+    voie_ids = select_voie_batch(commune_ids, voies, voie_types, codes_postaux,
+                                 communes)
+    localisation_ids = map_unique(query.select_localisation, voie_ids, numeros)
+
+    # Prepare the output.
+    outputs = map_unique(lambda *ids: result.get_output(*get_status(*ids)),
+                         postal_ids, commune_ids, voie_ids, localisation_ids,
+                         numeros)
+    return [copy_output(output) for output in outputs]
+
+
+@query.pinned()
 def reverse(position):
     """Finds the nearest address in France to a given position over the Earth.
 
@@ -171,8 +341,191 @@ def reverse(position):
     """
     if position is None:
         return result.get_output(None, 6)
-    node_id, dist = query.nearest_point_from(position)
+    localisation_id, dist = query.nearest_localisation_from(position)
 
-    # Get the reference id for the address.
-    localisation_id = query.data['kdtree']['ref_id'][node_id]
+    # Fall back on the kd-tree of older databases.
+    if localisation_id is None:
+        node_id, dist = query.nearest_point_from(position)
+        localisation_id = query.data['kdtree']['ref_id'][node_id]
     return result.get_output(('localisation', localisation_id), 1)
+
+
+@query.pinned()
+def reverse_batch(longitudes, latitudes):
+    """Finds the nearest address in France to each of many positions.
+
+    The positions are searched in spatially sorted order with the spatial
+    index. Positions that are not numbers get the output of reverse(None).
+
+    Args:
+        longitudes (:obj:`numpy.ndarray` of float): The longitudes.
+        latitudes (:obj:`numpy.ndarray` of float): The latitudes.
+
+    Returns:
+        (:obj:`list` of :obj:`dict`): The output of reverse for each position.
+
+    Example:
+        >>> import numpy as np
+        >>> from geocoder.geocoding import search
+        >>> search.reverse_batch(np.array([2.21, 2.22]), np.array([48, 48.1]))
+
+    """
+    localisation_ids, dists = query.nearest_localisations_from(longitudes, latitudes)
+
+    # Fall back on the kd-tree of older databases.
+    if localisation_ids is None:
+        positions = zip(np.asarray(longitudes, dtype='float64').tolist(),
+                        np.asarray(latitudes, dtype='float64').tolist())
+        return [reverse(position if np.isfinite(position).all() else None)
+                for position in positions]
+
+    # One output per distinct address.
+    found = localisation_ids != -1
+    unique_ids, inverse = np.unique(localisation_ids[found], return_inverse=True)
+    outputs = result.get_outputs('localisation', unique_ids, 1)
+    not_found = result.get_output(None, 6)
+    rows = iter(inverse.ravel().tolist())
+    return [copy_output(outputs[next(rows)] if ok else not_found) for ok in found.tolist()]
+
+
+def localisation_distances(localisation_ids, longitudes, latitudes):
+    """Distances in meters from addresses to positions.
+    """
+    records = query.data['localisation'][localisation_ids]
+    return distance.haversine(records['longitude'] / 10 ** SCALE,
+                              records['latitude'] / 10 ** SCALE,
+                              longitudes, latitudes)
+
+
+def get_neighbours(localisation_ids, distances, indices, count):
+    """Outputs of addresses found around positions, with their distance.
+
+    Args:
+        localisation_ids (:obj:`numpy.ndarray` of int): The addresses found.
+        distances (:obj:`numpy.ndarray` of float): Their distance in meters to
+            the position around which they were found.
+        indices (:obj:`numpy.ndarray` of int): The index of this position,
+            in increasing order.
+        count (int): The number of positions.
+
+    Returns:
+        (:obj:`list` of :obj:`list` of :obj:`dict`): The outputs of the
+            addresses found around each position, each with an additional
+            'distance' (float) field.
+
+    """
+    outputs = result.get_outputs('localisation', localisation_ids, 1)
+    for output, dist in zip(outputs, distances.tolist()):
+        output['distance'] = dist
+    bounds = np.searchsorted(indices, np.arange(count + 1)).tolist()
+    return [outputs[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+
+def search_angle(radius_m):
+    """Angle in degrees, seen from the center of the Earth, that covers a
+    radius in meters, slightly enlarged so that rounding cannot exclude an
+    address at exactly this distance.
+    """
+    return np.degrees(radius_m / distance.EARTH_RADIUS) * (1 + 1e-9)
+
+
+@query.pinned()
+def near_k(position, k):
+    """Finds the k nearest addresses in France to a given position.
+
+    Args:
+        position (:obj:`tuple` of float): Longitude and latitude of the
+            position in this order.
+        k (int): The number of addresses.
+
+    Returns:
+        (:obj:`list` of :obj:`dict`): The output of reverse for each address,
+            nearest first, with an additional 'distance' field in meters.
+
+    Example:
+        >>> from geocoder.geocoding import search
+        >>> search.near_k((2.21, 48), 5)
+
+    """
+    if position is None:
+        return []
+    found = query.spatial_search(spatial.k_nearest, position, k)
+    if found is None:
+        return []
+    localisation_ids = np.array(found[0], dtype='int64')
+    distances = localisation_distances(localisation_ids, *position)
+    return get_neighbours(localisation_ids, distances, np.zeros(len(localisation_ids)), 1)[0]
+
+
+@query.pinned()
+def within(position, radius_m):
+    """Finds the addresses in France within a given distance of a position.
+
+    Args:
+        position (:obj:`tuple` of float): Longitude and latitude of the
+            position in this order.
+        radius_m (float): The distance in meters.
+
+    Returns:
+        (:obj:`list` of :obj:`dict`): The output of reverse for each address,
+            nearest first, with an additional 'distance' field in meters.
+
+    Example:
+        >>> from geocoder.geocoding import search
+        >>> search.within((2.21, 48), 200)
+
+    """
+    if position is None:
+        return []
+    return within_batch(np.array([position[0]]), np.array([position[1]]), radius_m)[0]
+
+
+@query.pinned()
+def near_k_batch(longitudes, latitudes, k):
+    """Finds the k nearest addresses in France to each of many positions.
+
+    Args:
+        longitudes (:obj:`numpy.ndarray` of float): The longitudes.
+        latitudes (:obj:`numpy.ndarray` of float): The latitudes.
+        k (int): The number of addresses.
+
+    Returns:
+        (:obj:`list` of :obj:`list` of :obj:`dict`): The output of near_k for
+            each position, empty if the position is not a number.
+
+    """
+    longitudes = np.asarray(longitudes, dtype='float64')
+    latitudes = np.asarray(latitudes, dtype='float64')
+    found = query.spatial_search(spatial.k_nearest_batch, longitudes, latitudes, k)
+    if found is None:
+        return [[] for _ in range(len(longitudes))]
+    indices, ranks = np.nonzero(found[0] != -1)
+    localisation_ids = found[0][indices, ranks]
+    distances = localisation_distances(localisation_ids, longitudes[indices], latitudes[indices])
+    return get_neighbours(localisation_ids, distances, indices, len(longitudes))
+
+
+@query.pinned()
+def within_batch(longitudes, latitudes, radius_m):
+    """Finds the addresses in France within a given distance of each of many
+    positions.
+
+    Args:
+        longitudes (:obj:`numpy.ndarray` of float): The longitudes.
+        latitudes (:obj:`numpy.ndarray` of float): The latitudes.
+        radius_m (float): The distance in meters.
+
+    Returns:
+        (:obj:`list` of :obj:`list` of :obj:`dict`): The output of within for
+            each position, empty if the position is not a number.
+
+    """
+    longitudes = np.asarray(longitudes, dtype='float64')
+    latitudes = np.asarray(latitudes, dtype='float64')
+    found = query.spatial_search(spatial.within, longitudes, latitudes, search_angle(radius_m))
+    if found is None:
+        return [[] for _ in range(len(longitudes))]
+    indices, localisation_ids, _ = found
+    distances = localisation_distances(localisation_ids, longitudes[indices], latitudes[indices])
+    keep = distances <= radius_m
+    return get_neighbours(localisation_ids[keep], distances[keep], indices[keep], len(longitudes))
@@ -5,7 +5,38 @@ This module defines the class used for computing the score of similarity
 between two strings. Even with the ideas for computing this score are well know
 (ngrams), the exactly method is not and that`s why an own implementation was
 needed.
+
+Attributes:
+    NGRAMS (int): The number of identifiers of ascii unigrams and bigrams.
+    NGRAM_IDS (:obj:`dict` of int): The identifier of each ascii unigram and
+        bigram.
+
 """
+import numpy as np
+
+from geocoder.geocoding.utils import plain
+
+NGRAMS = 128 + 128 * 128
+
+NGRAM_IDS = {chr(first): first for first in range(128)}
+NGRAM_IDS.update({chr(first) + chr(second): 128 + first * 128 + second
+                  for first in range(128) for second in range(128)})
+
+
+def ngram_id(gram):
+    """Integer identifier of an ascii unigram or bigram.
+
+    Unigrams take the identifiers 0 to 127 and bigrams the identifiers 128 to
+    NGRAMS - 1. The normalized strings are ascii, so other characters do not
+    get an identifier and None is returned.
+    """
+    return NGRAM_IDS.get(gram)
+
+
+def bigram_ids(s):
+    """Set of the identifiers of the ascii bigrams of s.
+    """
+    return {ngram_id(s[i:(i + 2)]) for i in range(len(s) - 1)} - {None}
 
 
 class Similarity():
@@ -20,17 +51,37 @@ class Similarity():
         slice_set (:obj:`set` of :obj:`str`): The set of uni and bigrams.
         slice_set_score (int): The score of the attribute slice_set, that is,
             the sum of the length of the strings in that set.
+        signatures (:obj:`tuple`): The n-gram signatures of the strings to
+            compare with, None if they are not available.
+        weights (:obj:`numpy.ndarray` of int): The length of each n-gram of
+            slice_set, indexed by its identifier, and 0 for the other ones.
 
     """
 
-    def __init__(self, s):
+    def __init__(self, s, signatures=None):
         """
         Args:
             s (str): The string to compute the 1 and 2 grams set.
+            signatures (:obj:`tuple`, optional): The n-gram signatures of the
+                strings to compare with, needed by score_id: a table with one
+                record (start, end, score) per string and the table of sorted
+                n-gram identifiers that start and end delimit.
 
         """
         self.slice_set = set(list(s) + self.k_letters_list(s, 2))
         self.slice_set_score = self.set_score(self.slice_set)
+        self.signatures = signatures
+        if signatures is not None:
+            self.signatures = tuple(plain(table) for table in signatures)
+            ngram_ids = self.ngram_ids()
+            self.weights = np.zeros(NGRAMS, dtype='int8')
+            self.weights[ngram_ids] = [1 if i < 128 else 2 for i in ngram_ids]
+
+    def ngram_ids(self):
+        """Sorted identifiers of the ascii n-grams of the attribute slice_set.
+        """
+        return sorted(NGRAM_IDS[gram] for gram in self.slice_set
+                      if gram in NGRAM_IDS)
 
     def k_letters_list(self, s, k):
         """List of all the strings formed by k consecutive letters of s.
@@ -85,3 +136,76 @@ class Similarity():
             return 0
 
         return intersection_score / union_score
+
+    def score_id(self, row):
+        """String similarity score with a string of the signatures table.
+
+        Same score as the score method, computed from the stored n-gram
+        identifiers of the string instead of the string itself.
+
+        Args:
+            row (int): The index of the string in the signatures table.
+
+        Returns:
+            (float): The score of similarity between the string of index row
+                and the string s passed as argument in the initialization of
+                the class.
+
+        """
+        ngram, ngram_ids = self.signatures
+        start, end, slice_set_score = ngram[row].item()
+
+        # The intersection between the n-grams of s and of the string.
+        intersection_score = int(self.weights[ngram_ids[start:end]].sum())
+
+        union_score = slice_set_score + self.slice_set_score - \
+            intersection_score
+
+        # The union_score is zero only if both strings are empty
+        if union_score == 0:  # pragma: no cover
+            return 0
+
+        return intersection_score / union_score
+
+    def scores(self, rows):
+        """String similarity scores with several strings of the signatures
+        table at once.
+
+        Same scores as score_id, computed with numpy operations over the
+        concatenated n-gram identifiers of the rows.
+
+        Args:
+            rows (:obj:`range` or :obj:`list` of int): The indices of the
+                strings in the signatures table.
+
+        Returns:
+            (:obj:`numpy.ndarray` of float): The score of similarity of each
+                row.
+
+        """
+        ngram, ngram_ids = self.signatures
+        if not len(rows):
+            return np.zeros(0)
+        if isinstance(rows, range) and rows.step == 1:
+            # Contiguous rows have contiguous n-gram identifiers
+            records = ngram[rows.start:rows.stop]
+            first, last = records['start'][0], records['end'][-1]
+            ids = ngram_ids[first:last]
+            starts, ends = records['start'] - first, records['end'] - first
+        else:
+            records = ngram[np.asarray(rows)]
+            lengths = records['end'] - records['start']
+            ends = np.cumsum(lengths)
+            starts = ends - lengths
+            ids = ngram_ids[np.arange(ends[-1]) + np.repeat(records['start'] - starts, lengths)]
+
+        cumulated = np.zeros(len(ids) + 1, dtype='int64')
+        np.cumsum(self.weights[ids], out=cumulated[1:])
+        intersection_score = cumulated[ends] - cumulated[starts]
+
+        union_score = records['score'] + self.slice_set_score - \
+            intersection_score
+
+        # The union_score is zero only if both strings are empty
+        return np.divide(intersection_score, union_score,
+                         out=np.zeros(len(records)), where=union_score != 0)
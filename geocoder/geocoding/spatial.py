@@ -0,0 +1,645 @@
+# -*- coding: utf-8 -*-
+"""Array-native spatial index for reverse search.
+
+The positions are mapped to unit vectors of the three dimensional space, where
+the euclidean distance between two points grows with their distance over the
+Earth's surface. They are stored in a static kd-tree whose leaves are buckets
+of at most LEAF_SIZE points, contiguous in the spatial_point table, so that the
+distances to a whole bucket are evaluated at once with numpy.
+
+The tree is complete and stored in heap order in the spatial_node table: the
+children of node i are nodes 2 * i + 1 and 2 * i + 2.
+
+Attributes:
+    LEAF_SIZE (int): The greatest number of points in a leaf of the kd-tree.
+    BATCH_SIZE (int): The number of positions searched together by
+        nearest_batch.
+
+"""
+import heapq
+import math
+
+import numpy as np
+
+from geocoder.geocoding.distance import degree
+from geocoder.geocoding.utils import plain
+
+LEAF_SIZE = 32
+BATCH_SIZE = 4096
+
+
+def to_unit(longitudes, latitudes):
+    """Unit vectors of positions given in degrees.
+
+    Args:
+        longitudes (:obj:`numpy.ndarray` of float): The longitudes.
+        latitudes (:obj:`numpy.ndarray` of float): The latitudes.
+
+    Returns:
+        (:obj:`numpy.ndarray` of float): The unit vectors, one per row.
+
+    """
+    longitudes = np.radians(np.asarray(longitudes, dtype='float64'))
+    latitudes = np.radians(np.asarray(latitudes, dtype='float64'))
+    cos_latitudes = np.cos(latitudes)
+    return np.stack([cos_latitudes * np.cos(longitudes),
+                     cos_latitudes * np.sin(longitudes),
+                     np.sin(latitudes)], axis=-1)
+
+
+def chord_to_degree(chord):
+    """Angle in degrees between two unit vectors at distance chord.
+    """
+    return degree(2 * math.asin(min(chord / 2, 1.0)))
+
+
+def build(points, node_dtype):
+    """Build the kd-tree of points.
+
+    Each node splits its points at their median along the dimension of
+    greatest spread. The points are reordered in place so that the points of
+    each node are contiguous, and each node stores the bounding box of its
+    points.
+
+    Args:
+        points (:obj:`numpy.ndarray`): The points, with a field xyz holding
+            their unit vector.
+        node_dtype (:obj:`numpy.dtype`): The type of the nodes.
+
+    Returns:
+        (:obj:`numpy.ndarray`): The nodes in heap order.
+
+    """
+    leaves = 1
+    while leaves * LEAF_SIZE < len(points):
+        leaves *= 2
+
+    nodes = np.zeros(2 * leaves - 1, dtype=node_dtype)
+    nodes['start'][0], nodes['end'][0] = 0, len(points)
+
+    for node in range(len(nodes)):
+        start, end = int(nodes['start'][node]), int(nodes['end'][node])
+        xyz = points['xyz'][start:end]
+        if start == end:
+            # An empty box is at infinite distance from any query
+            nodes['low'][node], nodes['high'][node] = math.inf, -math.inf
+            continue
+        nodes['low'][node], nodes['high'][node] = xyz.min(axis=0), xyz.max(axis=0)
+        if node >= leaves - 1:
+            continue
+
+        middle = (start + end) // 2
+        left, right = 2 * node + 1, 2 * node + 2
+        nodes['start'][left], nodes['end'][left] = start, middle
+        nodes['start'][right], nodes['end'][right] = middle, end
+
+        dimension = int(np.argmax(nodes['high'][node] - nodes['low'][node]))
+        order = np.argpartition(xyz[:, dimension], middle - start)
+        points[start:end] = points[start:end][order]
+
+    return nodes
+
+
+def unit(position):
+    """Unit vector of a position given in degrees.
+    """
+    longitude, latitude = math.radians(position[0]), math.radians(position[1])
+    return np.array([math.cos(latitude) * math.cos(longitude),
+                     math.cos(latitude) * math.sin(longitude),
+                     math.sin(latitude)])
+
+
+def columns(nodes, points):
+    """The columns of the kd-tree used by the searches, as plain arrays.
+    """
+    nodes, points = plain(nodes), plain(points)
+    return nodes['low'], nodes['high'], nodes['start'], nodes['end'], points['xyz'], points['ref_id']
+
+
+def closest(tree, query, bound=math.inf):
+    """Find the point of the kd-tree nearest to a unit vector.
+
+    The nodes are visited by increasing distance from the query to their
+    bounding box, until that distance exceeds the distance to the best point
+    found, so that the search is exact. Among points at the same distance, the
+    one with the lowest ref_id is returned.
+
+    Args:
+        tree (:obj:`tuple`): The columns of the kd-tree.
+        query (:obj:`numpy.ndarray` of float): The unit vector.
+        bound (float, optional): A squared distance known to be greater than or
+            equal to the squared distance to the nearest point.
+
+    Returns:
+        (:obj:`tuple`)
+        (row (int): The row of the nearest point in the points table, None if
+            there is no point,
+         square (float): The squared euclidean distance to the nearest point)
+
+    """
+    lows, highs, starts, ends, xyz, ref_ids = tree
+    internal = len(lows) // 2
+    best, best_id, best_row = bound, None, None
+    heap = [(0.0, 0)] if len(lows) else []
+
+    while heap:
+        gap, node = heapq.heappop(heap)
+        if gap > best:
+            break
+
+        if node < internal:
+            children = slice(2 * node + 1, 2 * node + 3)
+            gaps = np.maximum(np.maximum(lows[children] - query, query - highs[children]), 0)
+            for child, gap in zip((2 * node + 1, 2 * node + 2), np.einsum('ij,ij->i', gaps, gaps).tolist()):
+                if gap <= best:
+                    heapq.heappush(heap, (gap, child))
+            continue
+
+        start, end = starts[node], ends[node]
+        if start == end:
+            continue
+        distances = xyz[start:end] - query
+        distances = np.einsum('ij,ij->i', distances, distances)
+        row = int(distances.argmin())
+        square = float(distances[row])
+        if square > best:
+            continue
+        ties = np.flatnonzero(distances == square)
+        if len(ties) > 1:
+            row = int(ties[ref_ids[start:end][ties].argmin()])
+        ref_id = int(ref_ids[start + row])
+        if best_id is None or square < best or ref_id < best_id:
+            best, best_id, best_row = square, ref_id, start + row
+
+    return best_row, best
+
+
+def nearest(nodes, points, position):
+    """Find the nearest point to a given position.
+
+    Args:
+        nodes (:obj:`numpy.ndarray`): The nodes of the kd-tree.
+        points (:obj:`numpy.ndarray`): The points of the kd-tree.
+        position (:obj:`tuple` of float): Longitude and latitude of the
+            position in this order.
+
+    Returns:
+        (:obj:`tuple`)
+        (ref_id (int): The ref_id of the nearest point, None if there is no
+            point,
+         dist (float): The distance in degrees between the position and the
+            nearest point)
+
+    """
+    tree = columns(nodes, points)
+    row, square = closest(tree, unit(position))
+    if row is None:
+        return None, math.inf
+    return int(tree[5][row]), chord_to_degree(math.sqrt(square))
+
+
+def morton_order(longitudes, latitudes):
+    """Order of positions along a Z-order curve, so that consecutive
+    positions are close to each other.
+    """
+    keys = np.zeros(len(longitudes), dtype='uint64')
+    for shift, values in enumerate([longitudes, latitudes]):
+        low, high = (values.min(), values.max()) if len(values) else (0, 0)
+        cells = ((values - low) / max(high - low, 1e-12) * 0xffff).astype('uint64')
+        for bit in range(16):
+            keys |= ((cells >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit + shift)
+    return np.argsort(keys, kind='stable')
+
+
+def box_gaps(tree, nodes, queries):
+    """Squared distances from queries to the bounding boxes of nodes.
+    """
+    lows, highs = tree[0], tree[1]
+    gaps = np.maximum(np.maximum(lows[nodes] - queries, queries - highs[nodes]), 0)
+    return np.einsum('ij,ij->i', gaps, gaps)
+
+
+def gather(tree, queries, pairs, nodes, width=LEAF_SIZE):
+    """Squared distances from queries to the points of the paired nodes.
+
+    Args:
+        tree (:obj:`tuple`): The columns of the kd-tree.
+        queries (:obj:`numpy.ndarray` of float): The unit vectors.
+        pairs (:obj:`numpy.ndarray` of int): The query of each pair.
+        nodes (:obj:`numpy.ndarray` of int): The node of each pair.
+        width (int, optional): The greatest number of points of the nodes.
+
+    Returns:
+        (:obj:`tuple`)
+        (offsets (:obj:`numpy.ndarray` of int): The rows of the points of
+            each pair, padded to width,
+         squares (:obj:`numpy.ndarray` of float): Their squared distances to
+            the query, infinite for the padding)
+
+    """
+    starts, ends, xyz = tree[2], tree[3], tree[4]
+    offsets = starts[nodes][:, None] + np.arange(width)
+    inside = offsets < ends[nodes][:, None]
+    offsets = np.minimum(offsets, len(xyz) - 1)
+
+    differences = xyz[offsets] - queries[pairs][:, None, :]
+    return offsets, np.where(inside, np.einsum('ijk,ijk->ij', differences, differences), np.inf)
+
+
+def home_nodes(tree, queries, depth):
+    """Node of the nearest bounding box at a given depth for each query.
+    """
+    nodes = np.zeros(len(queries), dtype='int64')
+    for _ in range(depth):
+        left = 2 * nodes + 1
+        nodes = np.where(box_gaps(tree, left + 1, queries) < box_gaps(tree, left, queries), left + 1, left)
+    return nodes
+
+
+def leaves_within(tree, queries, bounds):
+    """Pairs of queries and leaves whose bounding box is within the bound of
+    the query.
+
+    Args:
+        tree (:obj:`tuple`): The columns of the kd-tree.
+        queries (:obj:`numpy.ndarray` of float): The unit vectors.
+        bounds (:obj:`numpy.ndarray` of float): The squared distance bound of
+            each query.
+
+    Returns:
+        (:obj:`tuple`)
+        (pairs (:obj:`numpy.ndarray` of int): The query of each pair,
+         leaves (:obj:`numpy.ndarray` of int): The leaf of each pair)
+
+    """
+    internal = len(tree[0]) // 2
+    pairs = np.arange(len(queries))
+    nodes = np.zeros(len(queries), dtype='int64')
+    while len(nodes) and nodes[0] < internal:
+        pairs, nodes = np.repeat(pairs, 2), (2 * nodes[:, None] + [1, 2]).ravel()
+        keep = box_gaps(tree, nodes, queries[pairs]) <= bounds[pairs]
+        pairs, nodes = pairs[keep], nodes[keep]
+    return pairs, nodes
+
+
+def closest_in_leaves(tree, queries, pairs, leaves):
+    """Nearest point to each query among the points of the paired leaves.
+
+    Args:
+        tree (:obj:`tuple`): The columns of the kd-tree.
+        queries (:obj:`numpy.ndarray` of float): The unit vectors.
+        pairs (:obj:`numpy.ndarray` of int): The query of each pair.
+        leaves (:obj:`numpy.ndarray` of int): The leaf of each pair.
+
+    Returns:
+        (:obj:`tuple`)
+        (rows (:obj:`numpy.ndarray` of int): The row of the nearest point of
+            each query, -1 if the query is in no pair,
+         squares (:obj:`numpy.ndarray` of float): The squared distances)
+
+    """
+    ref_ids = tree[5]
+    offsets, squares = gather(tree, queries, pairs, leaves)
+
+    # Nearest point of each pair, then of each query, with the lowest ref_id
+    # among equal distances
+    closest = squares.min(axis=1)
+    slots = np.where(squares == closest[:, None], ref_ids[offsets], np.iinfo('int32').max).argmin(axis=1)
+    offsets = offsets[np.arange(len(offsets)), slots]
+    order = np.lexsort((ref_ids[offsets], closest, pairs))
+    first = order[np.flatnonzero(np.diff(pairs[order], prepend=-1))]
+
+    rows = np.full(len(queries), -1, dtype='int64')
+    best = np.full(len(queries), np.inf)
+    rows[pairs[first]], best[pairs[first]] = offsets[first], closest[first]
+    return rows, best
+
+
+def depth(tree):
+    """Depth of the leaves of the kd-tree.
+    """
+    return ((len(tree[0]) + 1) // 2).bit_length() - 1
+
+
+def closest_batch(tree, queries):
+    """Find the point of the kd-tree nearest to each of many unit vectors.
+
+    All the queries go down the tree together: first to the leaf of the
+    nearest bounding box, whose points bound the distance to the nearest
+    point, then to every leaf within that bound. The search is exact and
+    breaks ties like closest.
+
+    Args:
+        tree (:obj:`tuple`): The columns of the kd-tree.
+        queries (:obj:`numpy.ndarray` of float): The unit vectors, one per
+            row.
+
+    Returns:
+        (:obj:`tuple`)
+        (rows (:obj:`numpy.ndarray` of int): The row of the nearest point of
+            each query in the points table,
+         squares (:obj:`numpy.ndarray` of float): The squared euclidean
+            distances to the nearest points)
+
+    """
+    pairs = np.arange(len(queries))
+    rows, best = closest_in_leaves(tree, queries, pairs, home_nodes(tree, queries, depth(tree)))
+    return closest_in_leaves(tree, queries, *leaves_within(tree, queries, best))
+
+
+def push_leaf(found, k, squares, ref_ids, start):
+    """Push the points of a leaf in the bounded heap of the k nearest points.
+
+    The heap holds (-square, -ref_id, row) so that its first item is the
+    farthest of the points found, with the greatest ref_id among equal
+    distances.
+    """
+    bound = -found[0][0] if len(found) == k else math.inf
+    for offset in np.flatnonzero(squares <= bound).tolist():
+        item = (-float(squares[offset]), -int(ref_ids[offset]), start + offset)
+        if len(found) < k:
+            heapq.heappush(found, item)
+        elif item > found[0]:
+            heapq.heapreplace(found, item)
+
+
+def k_closest(tree, query, k):
+    """Find the k points of the kd-tree nearest to a unit vector.
+
+    Like closest, the nodes are visited by increasing distance to their
+    bounding box, and the search stops once that distance exceeds the
+    distance to the k-th point of a bounded heap.
+
+    Args:
+        tree (:obj:`tuple`): The columns of the kd-tree.
+        query (:obj:`numpy.ndarray` of float): The unit vector.
+        k (int): The number of points.
+
+    Returns:
+        (:obj:`tuple`)
+        (rows (:obj:`list` of int): The rows of the points, by increasing
+            distance then ref_id,
+         squares (:obj:`list` of float): Their squared euclidean distances)
+
+    """
+    lows, highs, starts, ends, xyz, ref_ids = tree
+    internal = len(lows) // 2
+    found = []
+    heap = [(0.0, 0)] if len(lows) and k > 0 else []
+
+    while heap:
+        gap, node = heapq.heappop(heap)
+        bound = -found[0][0] if len(found) == k else math.inf
+        if gap > bound:
+            break
+
+        if node < internal:
+            children = slice(2 * node + 1, 2 * node + 3)
+            gaps = np.maximum(np.maximum(lows[children] - query, query - highs[children]), 0)
+            for child, gap in zip((2 * node + 1, 2 * node + 2), np.einsum('ij,ij->i', gaps, gaps).tolist()):
+                if gap <= bound:
+                    heapq.heappush(heap, (gap, child))
+            continue
+
+        start, end = starts[node], ends[node]
+        distances = xyz[start:end] - query
+        push_leaf(found, k, np.einsum('ij,ij->i', distances, distances), ref_ids[start:end], start)
+
+    found.sort(reverse=True)
+    return [row for _, _, row in found], [-square for square, _, _ in found]
+
+
+def sort_candidates(tree, pairs, offsets, squares):
+    """Sort flattened candidates by query, distance and ref_id.
+    """
+    pairs, offsets, squares = np.broadcast_to(pairs[:, None], offsets.shape).ravel(), offsets.ravel(), squares.ravel()
+    keep = np.flatnonzero(np.isfinite(squares))
+    pairs, offsets, squares = pairs[keep], offsets[keep], squares[keep]
+    order = np.lexsort((tree[5][offsets], squares, pairs))
+    return pairs[order], offsets[order], squares[order]
+
+
+def k_closest_batch(tree, queries, k):
+    """Find the k points of the kd-tree nearest to each of many unit vectors.
+
+    The points of the node of the nearest bounding box, at the deepest level
+    whose nodes hold at least k points, bound the distance to the k-th point.
+    Then the points of every leaf within that bound are sorted.
+
+    Args:
+        tree (:obj:`tuple`): The columns of the kd-tree.
+        queries (:obj:`numpy.ndarray` of float): The unit vectors, one per
+            row.
+        k (int): The number of points.
+
+    Returns:
+        (:obj:`tuple`)
+        (rows (:obj:`numpy.ndarray` of int): The rows of the k points of each
+            query by increasing distance then ref_id, -1 beyond the number of
+            points,
+         squares (:obj:`numpy.ndarray` of float): Their squared euclidean
+            distances, infinite beyond the number of points)
+
+    """
+    size = len(tree[4])
+    rows = np.full((len(queries), k), -1, dtype='int64')
+    squares = np.full((len(queries), k), np.inf)
+    if not size or not k or not len(queries):
+        return rows, squares
+
+    level = depth(tree)
+    while level > 0 and size >> level < min(k, size):
+        level -= 1
+    pairs = np.arange(len(queries))
+    bounds = gather(tree, queries, pairs, home_nodes(tree, queries, level), -(-size >> level))[1]
+    bounds = np.partition(bounds, min(k, size) - 1, axis=1)[:, min(k, size) - 1]
+
+    pairs, leaves = leaves_within(tree, queries, bounds)
+    pairs, offsets, distances = sort_candidates(tree, pairs, *gather(tree, queries, pairs, leaves))
+    ranks = np.arange(len(pairs)) - np.searchsorted(pairs, pairs)
+    keep = ranks < k
+    rows[pairs[keep], ranks[keep]] = offsets[keep]
+    squares[pairs[keep], ranks[keep]] = distances[keep]
+    return rows, squares
+
+
+def within_batch(tree, queries, bound):
+    """Find the points of the kd-tree within a squared distance of each of
+    many unit vectors.
+
+    Args:
+        tree (:obj:`tuple`): The columns of the kd-tree.
+        queries (:obj:`numpy.ndarray` of float): The unit vectors, one per
+            row.
+        bound (float): The squared euclidean distance.
+
+    Returns:
+        (:obj:`tuple`)
+        (pairs (:obj:`numpy.ndarray` of int): The query of each point found,
+         rows (:obj:`numpy.ndarray` of int): The row of each point found,
+         squares (:obj:`numpy.ndarray` of float): Their squared euclidean
+            distances, sorted by query, distance and ref_id)
+
+    """
+    pairs, leaves = leaves_within(tree, queries, np.full(len(queries), bound))
+    pairs, offsets, squares = sort_candidates(tree, pairs, *gather(tree, queries, pairs, leaves))
+    keep = squares <= bound
+    return pairs[keep], offsets[keep], squares[keep]
+
+
+def chunks(longitudes, latitudes):
+    """Split the positions that are numbers in chunks of BATCH_SIZE along a
+    Z-order curve, so that the positions of a chunk visit the same nodes.
+
+    Yields:
+        (:obj:`tuple`)
+        (indices (:obj:`numpy.ndarray` of int): The index of the positions,
+         queries (:obj:`numpy.ndarray` of float): Their unit vectors)
+
+    """
+    valid = np.flatnonzero(np.isfinite(longitudes) & np.isfinite(latitudes))
+    order = valid[morton_order(longitudes[valid], latitudes[valid])]
+    for start in range(0, len(order), BATCH_SIZE):
+        indices = order[start:start + BATCH_SIZE]
+        yield indices, to_unit(longitudes[indices], latitudes[indices])
+
+
+def to_degree(squares):
+    """Angles in degrees between unit vectors at squared distances squares.
+    """
+    return np.degrees(2 * np.arcsin(np.minimum(np.sqrt(squares) / 2, 1.0)))
+
+
+def nearest_batch(nodes, points, longitudes, latitudes):
+    """Find the nearest point to each of many positions.
+
+    Duplicated positions are searched once, and the distinct positions are
+    searched by chunks (see chunks).
+
+    Args:
+        nodes (:obj:`numpy.ndarray`): The nodes of the kd-tree.
+        points (:obj:`numpy.ndarray`): The points of the kd-tree.
+        longitudes (:obj:`numpy.ndarray` of float): The longitudes.
+        latitudes (:obj:`numpy.ndarray` of float): The latitudes.
+
+    Returns:
+        (:obj:`tuple`)
+        (ref_ids (:obj:`numpy.ndarray` of int): The ref_id of the nearest
+            point of each position, -1 if the position is not a number or if
+            there is no point,
+         dists (:obj:`numpy.ndarray` of float): The distances in degrees, NaN
+            where the ref_id is -1)
+
+    """
+    longitudes = np.asarray(longitudes, dtype='float64')
+    latitudes = np.asarray(latitudes, dtype='float64')
+    ref_ids = np.full(len(longitudes), -1, dtype='int64')
+    dists = np.full(len(longitudes), np.nan)
+
+    valid = np.flatnonzero(np.isfinite(longitudes) & np.isfinite(latitudes))
+    if not len(valid) or not len(nodes):
+        return ref_ids, dists
+    positions, inverse = np.unique(np.stack([longitudes[valid], latitudes[valid]], axis=-1),
+                                   axis=0, return_inverse=True)
+    tree = columns(nodes, points)
+    rows = np.zeros(len(positions), dtype='int64')
+    squares = np.zeros(len(positions))
+    for indices, queries in chunks(positions[:, 0], positions[:, 1]):
+        rows[indices], squares[indices] = closest_batch(tree, queries)
+
+    inverse = inverse.ravel()
+    ref_ids[valid] = tree[5][rows][inverse]
+    dists[valid] = to_degree(squares)[inverse]
+    return ref_ids, dists
+
+
+def k_nearest(nodes, points, position, k):
+    """Find the k nearest points to a given position.
+
+    Args:
+        nodes (:obj:`numpy.ndarray`): The nodes of the kd-tree.
+        points (:obj:`numpy.ndarray`): The points of the kd-tree.
+        position (:obj:`tuple` of float): Longitude and latitude of the
+            position in this order.
+        k (int): The number of points.
+
+    Returns:
+        (:obj:`tuple`)
+        (ref_ids (:obj:`list` of int): The ref_id of the points, nearest
+            first,
+         dists (:obj:`list` of float): Their distances in degrees)
+
+    """
+    tree = columns(nodes, points)
+    rows, squares = k_closest(tree, unit(position), k)
+    return tree[5][rows].tolist(), to_degree(np.array(squares)).tolist()
+
+
+def k_nearest_batch(nodes, points, longitudes, latitudes, k):
+    """Find the k nearest points to each of many positions.
+
+    Args:
+        nodes (:obj:`numpy.ndarray`): The nodes of the kd-tree.
+        points (:obj:`numpy.ndarray`): The points of the kd-tree.
+        longitudes (:obj:`numpy.ndarray` of float): The longitudes.
+        latitudes (:obj:`numpy.ndarray` of float): The latitudes.
+        k (int): The number of points.
+
+    Returns:
+        (:obj:`tuple`)
+        (ref_ids (:obj:`numpy.ndarray` of int): The ref_ids of the k nearest
+            points of each position, one row per position, nearest first, -1
+            if the position is not a number or beyond the number of points,
+         dists (:obj:`numpy.ndarray` of float): Their distances in degrees,
+            NaN where the ref_id is -1)
+
+    """
+    longitudes = np.asarray(longitudes, dtype='float64')
+    latitudes = np.asarray(latitudes, dtype='float64')
+    ref_ids = np.full((len(longitudes), k), -1, dtype='int64')
+    dists = np.full((len(longitudes), k), np.nan)
+
+    tree = columns(nodes, points)
+    for indices, queries in chunks(longitudes, latitudes):
+        rows, squares = k_closest_batch(tree, queries, k)
+        found = rows != -1
+        ref_ids[indices] = np.where(found, tree[5][np.maximum(rows, 0)], -1)
+        dists[indices] = np.where(found, to_degree(squares), np.nan)
+    return ref_ids, dists
+
+
+def within(nodes, points, longitudes, latitudes, angle):
+    """Find the points within a given angle of each of many positions.
+
+    Args:
+        nodes (:obj:`numpy.ndarray`): The nodes of the kd-tree.
+        points (:obj:`numpy.ndarray`): The points of the kd-tree.
+        longitudes (:obj:`numpy.ndarray` of float): The longitudes.
+        latitudes (:obj:`numpy.ndarray` of float): The latitudes.
+        angle (float): The angle in degrees between the positions and the
+            points, as seen from the center of the Earth.
+
+    Returns:
+        (:obj:`tuple`)
+        (indices (:obj:`numpy.ndarray` of int): The position of each point
+            found,
+         ref_ids (:obj:`numpy.ndarray` of int): The ref_id of each point found,
+            sorted by position, distance and ref_id,
+         dists (:obj:`numpy.ndarray` of float): Their distances in degrees)
+
+    """
+    longitudes = np.asarray(longitudes, dtype='float64')
+    latitudes = np.asarray(latitudes, dtype='float64')
+    chord = 2 * math.sin(math.radians(min(angle, 180)) / 2)
+
+    tree = columns(nodes, points)
+    indices, rows, squares = [np.zeros(0, dtype='int64')], [np.zeros(0, dtype='int64')], [np.zeros(0)]
+    for chunk, queries in chunks(longitudes, latitudes):
+        pairs, found, distances = within_batch(tree, queries, chord * chord)
+        indices.append(chunk[pairs])
+        rows.append(found)
+        squares.append(distances)
+
+    indices, rows, squares = np.concatenate(indices), np.concatenate(rows), np.concatenate(squares)
+    order = np.argsort(indices, kind='stable')
+    return indices[order], tree[5][rows[order]], to_degree(squares[order])
@@ -7,6 +7,10 @@ Attributes:
     SCALE (int): The scale conversion of float to int.
 
 """
+import hashlib
+
+import numpy as np
+
 SCALE = 7
 
 
@@ -24,31 +28,6 @@ def int_to_degree(integer):
     return float(i / (10 ** SCALE))
 
 
-def pre_order(size):
-    """List in pre order of integers ranging from 0 to size in a balanced
-    binary tree.
-    """
-    interval_list = [None] * size
-    interval_list[0] = (0, size)
-    tail = 1
-
-    for head in range(size):
-        start, end = interval_list[head]
-        mid = (start + end) // 2
-
-        if mid > start:
-            interval_list[tail] = (start, mid)
-            tail += 1
-
-        if mid + 1 < end:
-            interval_list[tail] = (mid + 1, end)
-            tail += 1
-
-        interval_list[head] = mid
-
-    return interval_list
-
-
 def search(element, indices, values, sorted=True):
     """Search element in a list of values.
 
@@ -97,13 +76,47 @@ def binary_search(element, values, start, end, get_index):
 
 def most_similar(indices, values, similarity):
     """Find the value with greatest score of similarity.
+
+    If values is None, the similarity function is called with the indices
+    themselves.
     """
     max_result = None, None, None
     for (rang, index) in enumerate(indices):
-        score = similarity(values[index])
+        score = similarity(values[index] if values is not None else index)
         max_score = max_result[0]
         if score == 1:
             return score, rang, index
         elif max_score is None or score > max_score:
             max_result = score, rang, index
     return max_result
+
+
+def hash64(*parts):
+    """Stable 64-bit hash of a tuple of values, never equal to zero.
+
+    The builtin hash of str is salted per process, so the hash tables of the
+    database are keyed on blake2b instead.
+    """
+    text = '\x1f'.join(str(part) for part in parts)
+    digest = hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little') or 1
+
+
+def plain(table):
+    """A table as a plain numpy array, which skips the overhead of
+    numpy.memmap indexing; tables which are not numpy arrays (read from S3
+    block by block) are returned as they are.
+    """
+    return table.view(np.ndarray) if isinstance(table, np.ndarray) else table
+
+
+def best_score(scores, indices):
+    """Same result as most_similar from the scores of all the indices.
+
+    The first greatest score is selected, which is also the first perfect
+    score if there is one.
+    """
+    if not len(scores):
+        return None, None, None
+    rang = int(np.argmax(scores))
+    return float(scores[rang]), rang, indices[rang]
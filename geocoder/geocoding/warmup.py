@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""Warm-up of the database before serving.
+
+The tables are mapped lazily, so that the first searches of a geocoder pay for
+the page faults of the tables they read. The warm-up reads the hot tables into
+the page cache beforehand, with madvise(WILLNEED) and a sequential read of one
+byte per page, optionally locks them in memory with mlock, and runs a few
+representative searches. The geocoder is ready once it is done.
+
+Attributes:
+    WARMUP (bool): Whether the API server warms up before serving (WARMUP
+        environment variable, true by default).
+    HOT_TABLES (:obj:`list` of str): The tables read by every search,
+        prefetched by default (WARMUP_TABLES environment variable, a comma
+        separated list, to change them).
+    MLOCK (bool): Whether the prefetched tables are locked in memory
+        (WARMUP_MLOCK environment variable, false by default).
+    QUERIES (int): The number of representative searches (WARMUP_QUERIES
+        environment variable, 100 by default).
+    ready (:obj:`threading.Event`): Set once the warm-up is done.
+
+"""
+import ctypes
+import mmap
+import os
+import threading
+import time
+
+import numpy as np
+from loguru import logger
+
+from geocoder.geocoding import query, search
+from geocoder.geocoding.utils import int_to_degree
+
+WARMUP = (os.getenv("WARMUP", 'True').lower() in ('true', '1', 't'))
+HOT_TABLES = os.getenv("WARMUP_TABLES", ','.join([
+    'departement', 'postal', 'postal_index', 'commune', 'commune_index', 'commune_hash', 'commune_ngram',
+    'commune_ngram_id', 'voie', 'voie_index', 'voie_hash', 'commune_voie_hash', 'voie_bigram', 'voie_bigram_posting',
+    'voie_ngram', 'voie_ngram_id', 'spatial_node'])).split(',')
+MLOCK = (os.getenv("WARMUP_MLOCK", 'False').lower() in ('true', '1', 't'))
+QUERIES = int(os.getenv("WARMUP_QUERIES", 100))
+
+ready = threading.Event()
+warming = {}
+
+
+def mapping_of(array):
+    """The memory map holding an array.
+
+    Args:
+        array (:obj:`numpy.ndarray`): A table, or a view of a table.
+
+    Returns:
+        (:obj:`mmap.mmap`): The memory map, None if the array is in memory.
+
+    """
+    base = array
+    while base is not None:
+        if isinstance(base, mmap.mmap):
+            return base
+        base = base.obj if isinstance(base, memoryview) else getattr(base, 'base', None)
+    return None
+
+
+def lock(address, length):
+    """Lock pages in memory with mlock.
+
+    Returns:
+        bool: True if the pages were locked, False if mlock is not available
+        or failed (usually because of RLIMIT_MEMLOCK).
+
+    """
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.mlock(ctypes.c_void_p(address), ctypes.c_size_t(length)) == 0:
+            return True
+        logger.warning(f"mlock failed: {os.strerror(ctypes.get_errno())}")
+    except (OSError, AttributeError):  # pragma: no cover
+        logger.warning("mlock is not available")
+    return False
+
+
+def prefetch_table(values, locked=False):
+    """Read the pages of a table into the page cache.
+
+    Args:
+        values (:obj:`numpy.ndarray`): The table.
+        locked (bool, optional): Whether to lock its pages in memory.
+
+    Returns:
+        int: The number of bytes of the pages of the table, 0 if it is not
+        mapped (in memory, or read from S3 block by block).
+
+    """
+    mapping = mapping_of(values)
+    if mapping is None or not values.nbytes:
+        return 0
+    origin = np.frombuffer(mapping, dtype='uint8', count=0).ctypes.data
+    start = (values.ctypes.data - origin) // mmap.PAGESIZE * mmap.PAGESIZE
+    length = values.ctypes.data - origin + values.nbytes - start
+    if hasattr(mapping, 'madvise') and hasattr(mmap, 'MADV_WILLNEED'):
+        mapping.madvise(mmap.MADV_WILLNEED, start, length)
+    np.frombuffer(mapping, dtype='uint8', count=length, offset=start)[::mmap.PAGESIZE].sum()
+    if locked:
+        lock(origin + start, length)
+    return length
+
+
+def prefetch(database=None, tables=None, locked=MLOCK):
+    """Read the hot tables of a version of the database into the page cache.
+
+    Args:
+        database (:obj:`query.Database`, optional): The version of the
+            database, the one in use by default.
+        tables (:obj:`list` of str, optional): The tables, HOT_TABLES by
+            default.
+        locked (bool, optional): Whether to lock them in memory, MLOCK by
+            default.
+
+    Returns:
+        int: The number of bytes read.
+
+    """
+    database = query.current() if database is None else database
+    tables = HOT_TABLES if tables is None else tables
+    values = [database.tables[table] for table in tables if table in database.tables]
+    return sum(prefetch_table(getattr(table, 'values', table), locked) for table in values)
+
+
+def run_queries(count=QUERIES):
+    """Run representative searches, spread over the whole database.
+
+    Each search is a position search of an address of the database, and a
+    reverse search of its position.
+
+    Args:
+        count (int, optional): The number of searches, QUERIES by default.
+
+    """
+    voie = query.data['voie'] if 'voie' in query.data else []
+    for voie_id in np.unique(np.linspace(0, len(voie) - 1, min(count, len(voie))).astype('int64')).tolist():
+        record = voie[voie_id]
+        commune = query.data['commune'][record['ref_id']]
+        code_postal = str(query.data['postal']['code'][commune['ref_id']]).zfill(5)
+        numero = query.data['localisation']['numero'][record['start']] if record['start'] < record['end'] else ''
+        search.position(code_postal, commune['nom'], f"{numero} {record['nom']}")
+        search.reverse((int_to_degree(record['longitude']), int_to_degree(record['latitude'])))
+
+
+def warm_up(tables=None, locked=MLOCK, count=QUERIES):
+    """Prefetch the hot tables and run representative searches, then set ready.
+
+    Args:
+        tables (:obj:`list` of str, optional): The tables, HOT_TABLES by
+            default.
+        locked (bool, optional): Whether to lock them in memory, MLOCK by
+            default.
+        count (int, optional): The number of searches, QUERIES by default.
+
+    """
+    begin = time.time()
+    size = prefetch(tables=tables, locked=locked)
+    run_queries(count)
+    ready.set()
+    logger.info(f"Warm-up done in {time.time() - begin:.1f} s ({size >> 20} MB prefetched)")
+
+
+def start():
+    """Warm up in a background thread, or set ready at once if WARMUP is false.
+
+    The warm-up is started once per process, and not at all if it is done.
+    """
+    if not WARMUP:
+        ready.set()
+    elif not ready.is_set() and warming.get('pid') != os.getpid():
+        warming['pid'] = os.getpid()
+        threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
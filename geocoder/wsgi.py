@@ -6,6 +6,7 @@ import platform
 from abc import ABC
 
 from geocoder.api.provider import app
+from geocoder.geocoding import query, warmup
 
 if platform.uname().system.lower() == 'linux':
     import gunicorn.app.base
@@ -27,12 +28,28 @@ if platform.uname().system.lower() == 'linux':
             return self.application
 
 
+def post_worker_init(worker):
+    """
+    Switch to the new versions of the database as they are published, in each worker, once their hot tables are
+    prefetched
+    """
+    query.watch(prepare=warmup.prefetch)
+
+
 def runserver(options):
     if platform.uname().system.lower() == 'linux':
         bind = f"{options.pop('host')}:{options.pop('port')}"
         options.update({"bind": bind})
+        options.setdefault("post_worker_init", post_worker_init)
+        options.setdefault("preload_app", True)
+        if warmup.WARMUP:  # in the master, whose mapping the workers share
+            warmup.warm_up()
+        else:
+            warmup.ready.set()
         StandaloneApplication(app, options).run()
     else:
+        query.watch(prepare=warmup.prefetch)
+        warmup.start()
         app.run(host=options["host"],  # nosec
                 port=options["port"],  # nosec
                 debug=os.environ.get("DEBUG", True))  # nosec
@@ -2,12 +2,14 @@ import json
 import shutil
 import sys
 
+import numpy as np
 import pytest
 
 import geocoder
 from geocoder import __version__
-from geocoder.geocoding.activate_reverse import create_kdtree
+from geocoder.geocoding.activate_reverse import create_kdtree, create_spatial_index
 from geocoder.geocoding.datapaths import database
+from geocoder.geocoding import search
 from geocoder.geocoding.download import check_ban_version, decompress, remove_downloaded_raw_ban_files
 from geocoder.geocoding.index import process_files, create_database
 from geocoder.wsgi import app
@@ -18,6 +20,7 @@ decompress()
 process_files()
 create_database()
 create_kdtree()
+create_spatial_index()
 remove_downloaded_raw_ban_files()
 
 
@@ -68,6 +71,527 @@ def test_functions():
     assert output['voie']['nom'] == "CORNE DE VACHON"  # should be "BOULEVARD DES MARECHAUX" with full DB
 
 
+def test_find_batch():
+    rows = [('01500', 'Ambérieu-en-Bugey', 'Rue du Professeur Christian Cabrol'),
+            ('01400', None, '630, la Chèvre'),
+            ('01501', 'Amberieu', None),
+            (None, None, None),
+            ('01500', 'Ambérieu-en-Bugey', 'Rue du Professeur Christian Cabrol')]
+    outputs = geocoder.find_batch(*zip(*rows))
+    assert outputs == [geocoder.find(*row) for row in rows]
+    assert outputs[0] is not outputs[-1]
+
+
+def test_hash_tables():
+    from geocoder.geocoding import query
+    start, end = query.lookup('commune_hash', 'AMBERIEUENBUGEY')
+    assert query.data['commune']['normalise'][query.data['commune_index'][start]] == 'AMBERIEUENBUGEY'
+    assert query.complete_commune_selection('AMBERIEUENBUGEY') == query.data['commune_index'][start]
+    assert query.lookup('commune_hash', 'NOWHERE') is None
+
+
+def test_voie_candidates(monkeypatch):
+    from geocoder.geocoding import query
+    from geocoder.geocoding.similarity import Similarity
+    commune_id = query.complete_commune_selection('AMBERIEUENBUGEY')
+    record = query.data['commune'][commune_id]
+    narrow = (record['start'], record['start'] + 1, 0.6)
+    wide = (record['start'], record['end'], 0.4)
+    for voie in ['RUE DU PROFESSEUR CHRISTIAN CABROL', 'RUE DU PROF CABROL', 'XYZ']:
+        voie_id, found = query.heuristics('voie', 'normalise', narrow, wide, voie, commune_id)
+        assert found == query.heuristics('voie', 'normalise', narrow, wide, voie)[1]
+        if found:
+            assert voie_id == query.heuristics('voie', 'normalise', narrow, wide, voie)[0]
+    empty = np.zeros(0, dtype=query.data['voie_bigram'].dtype)
+    monkeypatch.setitem(query.current().tables, 'voie_bigram', empty)
+    assert query.voie_candidates(commune_id, wide, Similarity('RUE DU PROF CABROL')) == \
+        range(record['start'], record['end'])
+
+
+def test_score_id():
+    from geocoder.geocoding import query
+    from geocoder.geocoding.similarity import Similarity
+    signatures = (query.data['voie_ngram'], query.data['voie_ngram_id'])
+    for voie in ['RUE DU PROFESSEUR CHRISTIAN CABROL', 'LA CHEVRE', 'Z']:
+        similarity = Similarity(voie, signatures)
+        for row in range(0, len(query.data['voie']), 97):
+            assert similarity.score_id(row) == similarity.score(query.data['voie']['normalise'][row])
+
+
+def test_scores():
+    from geocoder.geocoding import query
+    from geocoder.geocoding.similarity import Similarity
+    signatures = (query.data['voie_ngram'], query.data['voie_ngram_id'])
+    similarity = Similarity('RUE DU PROFESSEUR CHRISTIAN CABROL', signatures)
+    for rows in [range(0, 500), range(3, 3), list(range(0, len(query.data['voie']), 97))]:
+        scores = similarity.scores(rows)
+        assert [float(score) for score in scores] == [similarity.score_id(row) for row in rows]
+
+
+def test_spatial_index():
+    from geocoder.geocoding import distance, query
+    from geocoder.geocoding.utils import int_to_degree
+    table = query.data['localisation']
+    for position in [(5.2, 46.2), (4.94, 46.13), (2.2099, 48.7099)]:
+        localisation_id, dist = query.nearest_localisation_from(position)
+        distances = [distance.spherical(position, (int_to_degree(record['longitude']),
+                                                   int_to_degree(record['latitude'])))
+                     for record in table[::50]]
+        assert dist <= min(distances) + 1e-9
+        record = table[localisation_id]
+        assert abs(distance.spherical(position, (int_to_degree(record['longitude']),
+                                                 int_to_degree(record['latitude']))) - dist) < 1e-9
+
+
+def test_near_batch():
+    positions = [(5.2, 46.2), (4.94, 46.13), (float('nan'), 46.0), (5.2, 46.2), (2.2099, 48.7099)]
+    outputs = geocoder.near_batch(*map(np.array, zip(*positions)))
+    assert outputs == [geocoder.near(position) for position in positions[:2]] + [geocoder.near(None)] + \
+        [geocoder.near(position) for position in positions[3:]]
+    assert outputs[0] is not outputs[3]
+
+
+def test_reverse_file(client, caplog):
+    response = client.post('/reverse_file', json={'longitude': [5.2, None], 'latitude': [46.2, 46.2]})
+    data = json.loads(response.data.decode("utf-8"))["data"]
+    assert data['voie.nom'] == [geocoder.near((5.2, 46.2))['voie']['nom'], None]
+    assert data['quality'] == [1, 6]
+    response = client.post('/reverse_file', json={'longitude': [5.2], 'latitude': []})
+    assert response.status_code == 400
+
+
+def test_near_k_within():
+    position = (5.2, 46.2)
+    outputs = geocoder.near_k(position, 10)
+    assert len(outputs) == 10
+    assert {key: value for key, value in outputs[0].items() if key != 'distance'} == geocoder.near(position)
+    distances = [output['distance'] for output in outputs]
+    assert distances == sorted(distances)
+    inside = geocoder.within(position, distances[4])
+    assert inside[:5] == outputs[:5]
+    assert all(output['distance'] <= distances[4] for output in inside)
+    positions = np.array([5.2, float('nan')]), np.array([46.2, 46.2])
+    assert search.near_k_batch(*positions, 10) == [outputs, []]
+    assert search.within_batch(*positions, distances[4]) == [inside, []]
+
+
+def test_merge_departement():
+    from collections import defaultdict, deque
+    from geocoder.geocoding.index import processed_files, to_columns, merge_departement, file_names
+    tables = defaultdict(deque)
+    columns = to_columns({table: processed_files[table] for table in file_names})
+    merge_departement(columns, tables)
+    assert all(list(tables[table]) == list(processed_files[table]) for table in file_names)
+    merge_departement(columns, tables)
+    size = len(processed_files['voie'])
+    assert len(tables['voie']) == 2 * size
+    name, nom, lon, lat, start, end, ref_id = tables['voie'][size]
+    assert (start, end, ref_id) == (processed_files['voie'][0][4] + len(processed_files['localisation']),
+                                    processed_files['voie'][0][5] + len(processed_files['localisation']),
+                                    processed_files['voie'][0][6] + len(processed_files['commune']))
+
+
+def test_read_columns(tmp_path):
+    from geocoder.geocoding.ban_processing import read_columns, read_lines
+    header = 'id;id_fantoir;numero;rep;nom_voie;code_postal;code_insee;nom_commune;code_insee_ancienne_commune;' \
+             'nom_ancienne_commune;x;y;lon;lat;type_position;alias;nom_ld;libelle_acheminement;libelle_cadastre'
+    rows = ['x;y;12;;Rue du Professeur Christian Cabrol;01500;01004;Ambérieu-en-Bugey;;;0;0;5.35;45.95;;;;x;',
+            'x;y;14;bis;Rue du Professeur Christian Cabrol;01500;01004;Ambérieu-en-Bugey;;;0;0;5.351;45.951;;;;x;',
+            'x;y; 16;"ter";"Rue du Lavoir";01500;01004;;;;0;0;5.352;45.952;;;Vareilles;x;',
+            'x;y;;;Rue du Lavoir;01500;01004;Ambérieu-en-Bugey;;;0;0;5.352;45.952;;;;x;',
+            'x;y;18;;Rue du Lavoir;01500;01004;Ambérieu-en-Bugey;;;0;0;5.3e0;+45.9;;;;x;']
+    path = tmp_path / 'adresses-01.csv'
+    path.write_text('\n'.join([header] + rows) + '\n', encoding='UTF-8')
+    lines = read_lines(str(path), 'adresses')
+    assert len(lines) == 4
+    assert sorted(read_columns(str(path), 'adresses')) == sorted(lines)
+
+
+def test_stream_archive(tmp_path):
+    import gzip
+    from collections import defaultdict, deque
+    from geocoder.geocoding.ban_processing import update
+    header = 'id;id_fantoir;numero;rep;nom_voie;code_postal;code_insee;nom_commune;code_insee_ancienne_commune;' \
+             'nom_ancienne_commune;x;y;lon;lat;type_position;alias;nom_ld;libelle_acheminement;libelle_cadastre'
+    rows = ['x;y;12;;Rue du Professeur Christian Cabrol;01500;01004;Ambérieu-en-Bugey;;;0;0;5.35;45.95;;;;x;',
+            'x;y;14;bis;Rue du Professeur Christian Cabrol;01500;01004;Ambérieu-en-Bugey;;;0;0;5.351;45.951;;;;x;',
+            'x;y;3;;Rue du Lavoir;01500;01004;Ambérieu-en-Bugey;;;0;0;5.352;45.952;;;;x;;']
+    text = '\n'.join([header] + rows) + '\n'
+    csv_path, gz_path = tmp_path / 'adresses-01.csv', tmp_path / 'adresses-01.csv.gz'
+    csv_path.write_text(text, encoding='UTF-8')
+    with gzip.open(gz_path, 'wt', encoding='UTF-8') as f:
+        f.write(text)
+    from_csv, from_gz = defaultdict(deque), defaultdict(deque)
+    update('01', str(csv_path), from_csv)
+    update('01', str(gz_path), from_gz)
+    assert len(from_gz['localisation']) == 3
+    assert from_gz == from_csv
+
+
+def test_download_resume(tmp_path, monkeypatch):
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from geocoder.geocoding import download
+    body = bytes(range(256)) * 1000
+    ranges = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if not self.path.endswith('adresses-01.csv.gz'):
+                self.send_error(404)
+                return
+            start = int(self.headers.get('Range', 'bytes=0-')[6:-1])
+            ranges.append(start)
+            self.send_response(206 if start else 200)
+            self.send_header('Content-Length', str(len(body) - start))
+            self.end_headers()
+            # the first transfer is cut in the middle
+            self.wfile.write(body[start:len(body) // 2] if len(ranges) == 1 else body[start:])
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(download, 'ban_url', 'http://127.0.0.1:{}/{{}}'.format(server.server_port))
+    monkeypatch.setattr(download, 'raw_data_folder_path', str(tmp_path))
+    monkeypatch.setattr(download, 'DOWNLOAD_BACKOFF', 0.)
+    monkeypatch.setattr(download, 'DOWNLOAD_CHUNK_SIZE', 1000)
+    try:
+        assert download.download_ban_files(['adresses-01.csv.gz', 'lieux-dits-01-beta.csv.gz'], 2) == \
+            ['lieux-dits-01-beta.csv.gz']
+    finally:
+        server.shutdown()
+    assert len(ranges) == 2 and ranges[0] == 0 and 0 < ranges[1] <= len(body) // 2
+    assert (tmp_path / 'adresses-01.csv.gz').read_bytes() == body
+
+
+def test_incremental_update(tmp_path, monkeypatch):
+    import functools
+    import gzip
+    import threading
+    from collections import defaultdict, deque
+    from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+    from geocoder.geocoding import download, incremental
+    from geocoder.geocoding.index import process_departement, merge_departement
+    header = 'id;id_fantoir;numero;rep;nom_voie;code_postal;code_insee;nom_commune;code_insee_ancienne_commune;' \
+             'nom_ancienne_commune;x;y;lon;lat;type_position;alias;nom_ld;libelle_acheminement;libelle_cadastre'
+    rows = ['x;y;12;;Rue du Professeur Christian Cabrol;01500;01004;Ambérieu-en-Bugey;;;0;0;5.35;45.95;;;;x;',
+            'x;y;3;;Rue du Lavoir;01500;01004;Ambérieu-en-Bugey;;;0;0;5.352;45.952;;;;x;']
+    served = tmp_path / 'served'
+    served.mkdir()
+    for name in ['adresses-01.csv.gz', 'lieux-dits-01-beta.csv.gz']:
+        with gzip.open(served / name, 'wt', encoding='UTF-8') as f:
+            f.write('\n'.join([header] + rows) + '\n' if name.startswith('adresses') else '')
+    gets = []
+
+    class Handler(SimpleHTTPRequestHandler):
+        def do_GET(self):
+            gets.append(self.path)
+            super().do_GET()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(Handler, directory=str(served)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(download, 'ban_url', 'http://127.0.0.1:{}/{{}}'.format(server.server_port))
+    monkeypatch.setattr(download, 'raw_data_folder_path', str(tmp_path / 'raw'))
+    monkeypatch.setattr(incremental, 'cache_folder_path', str(tmp_path / 'cache'))
+    try:
+        tables, expected = defaultdict(deque), defaultdict(deque)
+        assert incremental.update(1, tables)
+        assert len(gets) == 2
+        merge_departement(process_departement('01', [str(path) for path in sorted(served.iterdir())]), expected)
+        assert tables == expected
+        assert not incremental.update(1, defaultdict(deque))
+        assert len(gets) == 2
+    finally:
+        server.shutdown()
+
+
+def test_merge_runs(tmp_path):
+    from geocoder.geocoding import query
+    from geocoder.geocoding.datatypes import dtypes
+    from geocoder.geocoding.index import processed_files, spill_run, merge_runs, to_array
+    rows = list(processed_files['voie'])
+    half = len(rows) // 2
+    runs = [spill_run(list(zip(*rows[:half])), 0, 100, str(tmp_path / 'first.pkl')),
+            spill_run(list(zip(*rows[half:])), half, 100, str(tmp_path / 'second.pkl'))]
+    merge_runs(runs, str(tmp_path / 'voie_index.dat'), dtypes['voie_index'], 1000)
+    assert np.fromfile(tmp_path / 'voie_index.dat', dtype=dtypes['voie_index']).tolist() == \
+        query.data['voie_index'].tolist()
+    assert to_array(list(zip(*rows)), dtypes['voie']).tobytes() == np.asarray(query.data['voie']).tobytes()
+
+
+def test_compact_tables():
+    from geocoder.geocoding import query
+    from geocoder.geocoding.index import repetition_codes
+    commune = query.data['commune']
+    assert commune.dtype['nom'].kind == 'S'
+    stored = np.asarray(commune)['nom']
+    assert commune['nom'][3] == stored[3].decode() and isinstance(commune['nom'][3], str)
+    assert commune['nom'][2:6].tolist() == [name.decode() for name in stored[2:6]]
+    assert commune[3]['nom'].item() == stored[3].decode() and commune[3]['start'] == stored.base[3]['start']
+    assert query.select('commune', 'normalise', 0, 1, commune['normalise'][0]) == (0, True)
+    assert set(query.data['repetition'][query.data['localisation']['repetition']].tolist()) >= {'', 'bis'}
+    assert repetition_codes([None, 'bis', 'bister', 'ter'], {}) == [0, 1, 1, 2]
+
+
+def test_packed_database(tmp_path):
+    from geocoder.geocoding import packed
+    from geocoder.geocoding.datapaths import paths
+    path = str(tmp_path / 'geocoder.db')
+    header = packed.write(paths, path, 'v1')
+    loaded, tables = packed.load(path)
+    assert loaded == json.loads(json.dumps(header)) and loaded['ban_version'] == 'v1'
+    for table in paths:
+        assert tables[table].tobytes() == open(paths[table], 'rb').read()
+        assert (tables[table].ctypes.data - tables['departement'].ctypes.data) % packed.ALIGNMENT == 0
+    begin = packed.align(packed.HEADER.size + len(json.dumps(header, sort_keys=True)))
+    with open(path, 'r+b') as f:
+        f.seek(begin + header['tables']['voie']['offset'] + 7)
+        byte = f.read(1)
+        f.seek(-1, 1)
+        f.write(bytes([byte[0] ^ 1]))
+    with pytest.raises(packed.CorruptDatabase, match='voie table'):
+        packed.load(path)
+    packed.load(path, verify=False)
+    with open(path, 'r+b') as f:
+        f.truncate(begin + header['tables']['spatial_point']['offset'] + 10)
+    with pytest.raises(packed.CorruptDatabase, match='truncated'):
+        packed.load(path, verify=False)
+    with open(path, 'wb') as f:
+        f.write(b'not a database')
+    with pytest.raises(packed.CorruptDatabase):
+        packed.load(path)
+
+
+def test_reload(client, tmp_path, monkeypatch):
+    from geocoder.geocoding import index, query
+    monkeypatch.setattr(query, 'database', query.current())
+    (tmp_path / 'versions').mkdir()
+    for module in [index, query]:
+        monkeypatch.setattr(module, 'current_path', str(tmp_path / 'CURRENT'))
+        monkeypatch.setattr(module, 'packed_path', lambda version: str(tmp_path / 'versions' / version / 'geocoder.db'))
+    monkeypatch.setattr(index, 'versions', str(tmp_path / 'versions'))
+    expected = geocoder.find('01500', 'Ambérieu-en-Bugey', 'Rue du Professeur Christian Cabrol')
+    previous = query.current()
+    assert index.pack_database()
+    with query.pinned():
+        assert query.reload()
+        assert query.current() is previous
+    assert query.current().version == (tmp_path / 'CURRENT').read_text()
+    assert not query.reload()
+    assert geocoder.find('01500', 'Ambérieu-en-Bugey', 'Rue du Professeur Christian Cabrol') == expected
+    response = client.post('/reload')
+    assert json.loads(response.data.decode("utf-8")) == {'database': query.current().version, 'reloaded': False}
+    assert index.pack_database() and index.pack_database(keep=2)
+    assert sorted(path.name for path in (tmp_path / 'versions').iterdir())[-1] == (tmp_path / 'CURRENT').read_text()
+    assert len(list((tmp_path / 'versions').iterdir())) == 2
+
+
+def test_warm_up(client):
+    from geocoder.geocoding import query, warmup
+    assert warmup.mapping_of(np.asarray(query.data['voie'])['start']) is not None
+    assert warmup.prefetch_table(np.arange(10)) == 0
+    assert warmup.prefetch(tables=['voie'], locked=True) >= np.asarray(query.data['voie']).nbytes
+    warmup.warm_up(count=5)
+    response = client.get('/ready')
+    assert response.status_code == 200
+    assert json.loads(response.data.decode("utf-8")) == {'database': query.current().version, 'ready': True}
+
+
+def test_import_time():
+    import subprocess  # nosec
+    heavy = {'boto3', 'flask', 'flask_restx', 'gunicorn', 'pandas', 'requests', 'geocoder.geocoding.query'}
+    for module, budget in [('geocoder', 0.2), ('geocoder.geocoding.__main__', 0.5)]:
+        output = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],  # nosec
+                                capture_output=True, text=True, check=True).stderr
+        times = {line.split('|')[2].strip(): int(line.split('|')[1]) for line in output.splitlines()
+                 if line.startswith('import time:') and line.split('|')[1].strip().isdigit()}
+        assert not heavy & set(times)
+        assert times[module] < budget * 1e6
+
+
+class LocalS3:
+    """S3 stand-in serving the files of a folder"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.downloads = []
+
+    def head_object(self, Bucket, Key):
+        import hashlib
+        content = (self.folder / Key).read_bytes()
+        return {'ETag': f'"{hashlib.md5(content).hexdigest()}"', 'ContentLength': len(content)}  # nosec
+
+    def download_file(self, Bucket, Key, Filename, Config=None):
+        self.downloads.append(Key)
+        shutil.copyfile(self.folder / Key, Filename)
+
+    def get_object(self, Bucket, Key, Range, IfMatch=None):
+        import io
+        begin, end = map(int, Range[len('bytes='):].split('-'))
+        with open(self.folder / Key, 'rb') as f:
+            f.seek(begin)
+            return {'Body': io.BytesIO(f.read(end - begin + 1))}
+
+
+def test_fetch(tmp_path, monkeypatch):
+    from geocoder.geocoding import fetch, packed
+    monkeypatch.setattr(fetch, 'FETCH_CACHE', str(tmp_path / 'cache'))
+    client = LocalS3(tmp_path / 'bucket')
+    (tmp_path / 'bucket' / 'database').mkdir(parents=True)
+    (tmp_path / 'bucket' / 'database' / 'voie.dat').write_bytes(b'voie' * 1000)
+    paths = fetch.fetch_all(['database/voie.dat'] * 8, client)
+    assert len(set(paths)) == 1 and open(paths[0], 'rb').read() == b'voie' * 1000
+    assert client.downloads == ['database/voie.dat']
+    (tmp_path / 'bucket' / 'database' / 'voie.dat').write_bytes(b'rue' * 1000)
+    path = fetch.fetch('database/voie.dat', client)
+    assert path != paths[0] and open(path, 'rb').read() == b'rue' * 1000
+    assert not (tmp_path / paths[0]).exists() and len(client.downloads) == 2
+    client.download_file = lambda Bucket, Key, Filename, Config=None: open(Filename, 'wb').write(b'rue' * 999)
+    (tmp_path / 'bucket' / 'database' / 'voie.dat').write_bytes(b'way' * 1000)
+    with pytest.raises(packed.CorruptDatabase):
+        fetch.fetch('database/voie.dat', client)
+    assert sorted(file.name for file in (tmp_path / 'cache' / 'database' / 'voie.dat').iterdir()
+                  if not file.name.endswith('.lock')) == [path.split('/')[-1]]
+
+
+def test_remote_tables(client, tmp_path, monkeypatch):
+    from geocoder.geocoding import index, packed, query, remote
+    for module in [index, query]:
+        monkeypatch.setattr(module, 'current_path', str(tmp_path / 'CURRENT'))
+        monkeypatch.setattr(module, 'packed_path', lambda version: str(tmp_path / 'versions' / version / 'geocoder.db'))
+    monkeypatch.setattr(index, 'versions', str(tmp_path / 'versions'))
+    assert index.pack_database()
+    version = query.published_version()
+    key = f"database/versions/{version}/geocoder.db"
+    (tmp_path / key).parent.mkdir(parents=True)
+    shutil.copyfile(query.packed_path(version), tmp_path / key)
+    monkeypatch.setattr(remote, 's3', LocalS3(tmp_path))
+    monkeypatch.setattr(remote, 'cache', remote.BlockCache(2 * remote.BLOCK_SIZE))
+    header, tables = remote.load(key)
+    assert header == packed.load(query.packed_path(version))[0]
+    voie, points = tables['voie'], tables['spatial_point']
+    local = np.asarray(query.current().tables['voie'])
+    assert np.array_equal(np.asarray(voie), local) and voie[-1] == local[-1] and voie['nom'][3] == local['nom'][3]
+    rows = np.array([[5, 0], [len(local) - 1, 5]])
+    assert np.array_equal(voie[rows], local[rows]) and np.array_equal(voie['start'][2:40:3], local['start'][2:40:3])
+    assert np.array_equal(points['xyz'][7:9], np.asarray(query.current().tables['spatial_point'])['xyz'][7:9])
+    keys = local['nom'][[0, 10, 100]]
+    assert np.array_equal(np.searchsorted(voie['nom'], keys, sorter=local['nom'].argsort()),
+                          np.searchsorted(local['nom'], keys, sorter=local['nom'].argsort()))
+    metrics = remote.cache.metrics()
+    assert metrics['size'] <= 2 * remote.BLOCK_SIZE and metrics['blocks'] <= 2 and 0 < metrics['hit_ratio'] < 1
+    expected = [geocoder.find('01500', 'Ambérieu-en-Bugey', 'Rue du Professeur Christian Cabrol'),
+                geocoder.near((5.2, 46.2))]
+    monkeypatch.setattr(query, 'LOCAL_DB', False)
+    monkeypatch.setattr(remote, 'REMOTE_DB', True)
+    monkeypatch.setattr(query, 'database', query.load_version(version))
+    assert isinstance(query.current().tables['localisation'], remote.RemoteArray)
+    assert [geocoder.find('01500', 'Ambérieu-en-Bugey', 'Rue du Professeur Christian Cabrol'),
+            geocoder.near((5.2, 46.2))] == expected
+    response = client.get('/metrics')
+    assert json.loads(response.data.decode("utf-8"))['block_cache'] == remote.cache.metrics()
+
+
+def test_normalize_memoized(client):
+    from geocoder.geocoding import normalize
+    from geocoder.geocoding.ban_processing import get_field, line_specs
+    normalize.clear()
+    for _ in range(3):
+        assert normalize.mine('12, Bd des Maréchaux') == normalize.mine.__wrapped__('12, Bd des Maréchaux')
+        assert normalize.uniform_commune('Palaiseau 1') == 'PALAISEAU'
+    fields = ['x'] * (max(field for field in line_specs['adresses'].values() if field is not None) + 1)
+    fields[line_specs['adresses']['nom_voie']] = '"Rue de la Paix"'
+    for _ in range(3):
+        assert get_field('nom_voie', fields, normalize.uniform_adresse, 'adresses') == ('RUE DE LA PAIX', 'RUEDELAPAIX')
+    metrics = normalize.metrics()
+    for name in ['mine', 'uniform_commune', 'normalize_field']:
+        assert (metrics[name]['hits'], metrics[name]['misses']) == (2, 1)
+    response = client.get('/metrics')
+    assert json.loads(response.data.decode("utf-8"))['normalize']['mine']['hits'] >= 2
+
+
+def test_tokenize():
+    import pandas as pd
+    from geocoder.geocoding import normalize
+    expected = {'12, Bd des Maréchaux': ((12, 'BOULEVARD DES MARECHAUX', 'BOULEVARD'), 'BOULEVARDDESMARECHAUX'),
+                'Chemin (ancien) 3 Grande Rue': ((3, 'GRANDE RUE', 'GRANDE'), 'CHEMINGRANDERUE'),
+                'LIEU DIT LES 4 VENTS': ((None, 'LIEU DIT LES 4 VENTS', 'LIEU'), 'LIEUDITLESVENTS'),
+                '7 bis/9 rue St-Jean': ((7, 'BIS', 'BIS'), 'BIS'),
+                'Résidence "Les Pins" 12B': ((None, 'RESIDENCE LES PINS 12B', 'RESIDENCE'), 'RESIDENCELESPINSB'),
+                '  ': ((None, None, None), ''),
+                'Zone 3 12 av du Pdt Wilson': ((12, 'AVENUE DU PRESIDENT WILSON', 'AVENUE'),
+                                               'ZONEAVENUEDUPRESIDENTWILSON'),
+                'Saint-Étienne (42) | Loire': ((None, 'SAINT ETIENNE', 'SAINT'), 'SAINTETIENNE')}
+    for text, (mined, commune) in expected.items():
+        assert normalize.tokenize(text) == (normalize.uniform_words(text), *mined)
+        assert normalize.mine.__wrapped__(text) == mined and normalize.uniform_commune.__wrapped__(text) == commune
+    column = pd.Series(list(expected) * 2 + [None, float('nan')])
+    assert normalize.mine_column(column) == [mined for mined, _ in expected.values()] * 2 + [(None, None, None)] * 2
+    assert normalize.uniform_commune_column(column.to_numpy()) == \
+        [commune for _, commune in expected.values()] * 2 + [None, None]
+
+
+def test_result_cache(client, tmp_path, monkeypatch):
+    from geocoder.geocoding import result_cache
+    monkeypatch.setattr(result_cache, 'cache', result_cache.ResultCache(capacity=2))
+    output = search.position('91120', 'Palaiseau', '12, Bd des Maréchaux')
+    output['quality'] = None
+    assert search.position('91120', 'PALAISEAU', '12 boulevard des Marechaux')['quality'] is not None
+    assert result_cache.cache.metrics()['hits'] == 1
+    for adresse in ['1 rue de Paris', '2 rue de Paris', '12, Bd des Maréchaux']:
+        search.position('91120', 'Palaiseau', adresse)
+    metrics = result_cache.cache.metrics()
+    assert (metrics['size'], metrics['hits'], metrics['misses']) == (2, 1, 4)  # evicted by the two others
+    assert json.loads(client.get('/metrics').data.decode("utf-8"))['result_cache']['size'] == 2
+
+    shared = str(tmp_path / 'results.db')
+    first, second = result_cache.ResultCache(2, shared), result_cache.ResultCache(2, shared)
+    first.put('v1', (91120, 'PALAISEAU', 12, 'RUE', 'RUE'), {'quality': 1})
+    assert second.get('v1', (91120, 'PALAISEAU', 12, 'RUE', 'RUE')) == {'quality': 1}
+    assert second.metrics()['shared']['hits'] == 1
+    assert second.get('v2', (91120, 'PALAISEAU', 12, 'RUE', 'RUE')) is None  # another version of the database
+    assert result_cache.ResultCache(2, shared).get('v1', (91120, 'PALAISEAU', 12, 'RUE', 'RUE')) is None
+    assert result_cache.ResultCache(0, shared).get('v2', (91120, )) is None
+
+    interleaved, other = result_cache.ResultCache(4, shared), result_cache.ResultCache(4, shared)
+    for version in ['v3', 'v4', 'v3', 'v4', 'v3']:  # searches pinned to v3 end while v4 is loaded
+        interleaved.put(version, (version, ), {'quality': version})
+        assert interleaved.get('v3', ('v3', )) == {'quality': 'v3'}
+        assert interleaved.get('v4', ('v4', )) in (None, {'quality': 'v4'})
+    assert interleaved.get('v4', ('v4', )) == other.get('v4', ('v4', )) == {'quality': 'v4'}
+    assert interleaved.metrics()['version'] == 'v4' and other.metrics()['shared']['hits'] == 1
+
+
+def test_kdtree_nodes():
+    import kdquery
+    from geocoder.geocoding import query
+    from geocoder.geocoding.activate_reverse import kdtree_nodes
+    from geocoder.geocoding.utils import degree_to_int
+    table = query.data['localisation']
+    nodes = kdtree_nodes(table['longitude'], table['latitude'], [[-10 ** 9, 10 ** 9], [-10 ** 9, 10 ** 9]])
+    assert sorted(nodes['ref_id'].tolist()) == list(range(len(table)))
+    limits = [[degree_to_int(-62), degree_to_int(55)], [degree_to_int(-22), degree_to_int(52)]]
+    assert np.asarray(query.data['kdtree']).tobytes() == \
+        kdtree_nodes(table['longitude'], table['latitude'], limits).tobytes()
+
+    def get_properties(node_id):
+        node = nodes[node_id]
+        region = [[int(node['limit_left']), int(node['limit_right'])],
+                  [int(node['limit_bottom']), int(node['limit_top'])]]
+        return ((int(node['longitude']), int(node['latitude'])), region, int(node['dimension']), True,
+                None if node['left'] == -1 else int(node['left']), None if node['right'] == -1 else int(node['right']))
+
+    longitudes, latitudes = table['longitude'].astype(float), table['latitude'].astype(float)
+    for position in [(52000000, 462000000), (49400000, 461300000), (22099000, 487099000)]:
+        node_id, dist = kdquery.nearest_point(position, 0, get_properties)
+        assert abs(dist - np.hypot(longitudes - position[0], latitudes - position[1]).min()) < 1e-6
+
+
 def pytest_sessionfinish(session, exitstatus):
     """ whole test run finishes. """
     if 'geocoder' in sys.modules: